@@ -14,13 +14,45 @@ from multi_agent_backend import (
     AGENT_NAMES,
     DEFAULT_API_URL,
     DEFAULT_CHAT_MODEL,
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_INDEX_PATH,
     DEPRECATED_CHAT_MODELS,
+    HEDGE_ENV,
+    INDEX_PATH_ENV,
+    SPECULATIVE_ENV,
     RECOMMENDED_CHAT_MODELS,
+    RERANKER_KINDS,
+    ConversationMemory,
+    HedgePolicy,
+    VectorStorage,
+    default_agent_profiles,
     initialize_system,
+    merge_agent_profiles,
+    pacing_stats,
+    prewarm,
     process_question,
 )
+from api_client import APIError
+from blob_store import BlobStore, write_json_array
+from eda_chunker import merge_chunk_stats
+import deadlines
+import index_snapshot
+import profiling
+import response_cache
+from query_planner import planning_enabled
+from service_client import ServiceClient
+from table_store import TABLE_SUFFIXES, read_tables, tables_to_text
 
+# 设置后前端作为 server.py 服务的客户端运行，多人共享同一后端与知识库
+SERVICE_URL = os.getenv("EDA_QA_SERVER_URL", "").strip()
+INDEX_PATH = os.getenv(INDEX_PATH_ENV, DEFAULT_INDEX_PATH)
+SNAPSHOT_DIR = os.getenv(index_snapshot.SNAPSHOT_DIR_ENV, index_snapshot.DEFAULT_SNAPSHOT_DIR)
+# 文档全文与智能体输出存放在磁盘，session_state 只保留哈希，避免会话内存随对话增长
+BLOB_STORE = BlobStore()
 
+
+@profiling.profiled("parse_upload")
 def extract_file_content(uploaded_file):
     """将上传文件转为纯文本，用于RAG索引。失败返回(None, error_msg)。"""
     name = uploaded_file.name.lower()
@@ -51,19 +83,32 @@ def extract_file_content(uploaded_file):
                 return text, None
             except Exception as e:
                 return None, f"DOCX解析失败: {e}"
-        if suffix in ["xlsx", "xls"]:
+        if suffix in TABLE_SUFFIXES:
             try:
-                import pandas as pd
-                sheets = pd.read_excel(BytesIO(data), sheet_name=None)
-                text = "\n".join([df.to_csv(index=False) for df in sheets.values()])
-                return text, None
+                return tables_to_text(read_tables(uploaded_file.name, data)), None
             except Exception as e:
-                return None, f"Excel解析失败: {e}"
+                return None, f"表格解析失败: {e}"
         return None, "不支持的文件类型"
     except Exception as e:
         return None, f"读取失败: {e}"
 
 
+@profiling.profiled("parse_upload")
+def extract_file_tables(uploaded_file):
+    """Excel / CSV 解析为 [(表名, pyarrow.Table)]，按列存放而不是转成 CSV 文本。失败返回(None, error_msg)。"""
+    try:
+        tables = read_tables(uploaded_file.name, uploaded_file.getvalue())
+    except Exception as e:
+        return None, f"表格解析失败: {e}"
+    if not tables:
+        return None, "表格为空"
+    return tables, None
+
+
+def is_table_file(name):
+    return "." in name and name.lower().rsplit(".", 1)[-1] in TABLE_SUFFIXES
+
+
 def load_api_key_from_env():
     env_file_path = "api_key.env"
     if not os.path.exists(env_file_path):
@@ -79,15 +124,212 @@ def show_ingest_summary(summary):
     if isinstance(summary, dict):
         added = summary.get("added", 0) or 0
         errors = summary.get("errors", [])
+        stats = summary.get("chunk_stats") or {}
     else:
         added = int(summary) if summary is not None else 0
         errors = []
+        stats = {}
     if added > 0:
         st.info(f"已索引 {added} 条文本片段")
+        if isinstance(summary, dict) and summary.get("tables"):
+            st.caption(
+                f"表格：{summary['tables']} 张、{summary['rows']:,} 行按列存储，"
+                f"仅向量化表结构与行摘要，具体取值在问答时按列精确查询"
+            )
+        if stats.get("count"):
+            st.caption(
+                f"分块统计：平均 {stats['avg_chars']} 字符，"
+                f"最短 {stats['min_chars']} / 最长 {stats['max_chars']}，共 {stats['total_chars']:,} 字符"
+            )
     if errors:
         st.warning("部分文件未成功索引：\n" + "\n".join(errors))
 
 
+def profiles_to_rows(profiles):
+    return [
+        {
+            "智能体": name,
+            "模型": profile.get("model") or "",
+            "max_tokens": profile.get("max_tokens"),
+            "temperature": profile.get("temperature"),
+            "stop": "|".join(profile.get("stop") or []),
+        }
+        for name, profile in profiles.items()
+    ]
+
+
+def rows_to_profiles(rows):
+    """表格行转为 set_agent_profiles 的覆盖项；空单元格表示使用默认值。"""
+    overrides = {}
+    for row in rows:
+        override = {
+            "model": row.get("模型") or None,
+            "stop": row.get("stop") or None,
+        }
+        if row.get("max_tokens"):
+            override["max_tokens"] = int(row["max_tokens"])
+        if row.get("temperature") is not None:
+            override["temperature"] = float(row["temperature"])
+        overrides[row["智能体"]] = override
+    return overrides
+
+
+@st.cache_resource(show_spinner="正在预热：建立连接、加载已保存的索引...")
+def prewarmed(api_key, api_url):
+    """进程级缓存：所有会话与页面重跑共享同一份预热结果（连接池与已加载的索引）。"""
+    return prewarm(api_key, api_url, INDEX_PATH, SNAPSHOT_DIR)
+
+
+def initialize_local_system():
+    """按侧栏配置在本进程内初始化；未配置密钥时返回 None。"""
+    api_key = st.session_state.api_config.get("api_key", "")
+    # 如果界面没有输入API密钥，尝试从文件加载
+    if not api_key:
+        api_key = load_api_key_from_env()
+        if api_key:
+            st.info("从api_key.env文件加载API密钥")
+    if not api_key:
+        st.error("请先配置API密钥")
+        return None
+    api_url = st.session_state.api_config.get("api_url", DEFAULT_API_URL)
+    warm = prewarmed(api_key, api_url)
+    for error in warm["errors"]:
+        st.warning(error)
+    result = initialize_system(
+        api_key,
+        api_url,
+        model_type=st.session_state.api_config.get("chat_model", DEFAULT_CHAT_MODEL),
+        reranker=st.session_state.reranker_kind,
+        fallback_models=st.session_state.api_config["fallback_models"],
+        light_models=st.session_state.api_config["light_models"],
+        extra_api_keys=st.session_state.api_config["extra_api_keys"].splitlines(),
+        agent_profiles=st.session_state.agent_profiles,
+        speculative=st.session_state.speculative,
+        hedge=st.session_state.hedge,
+        knowledge_base=warm["rag_system"],
+    )
+    if result["status"] == "success":
+        result["timings"] = {**warm["timings"], **result["timings"]}
+    return result
+
+
+def connect_service():
+    """服务模式：连接 EDA_QA_SERVER_URL 指向的后端，问答与知识库均由服务端处理。"""
+    try:
+        client = ServiceClient(
+            SERVICE_URL,
+            tenant=os.getenv("EDA_QA_TENANT", "default"),
+            token=os.getenv("EDA_QA_SERVICE_TOKEN"),
+        )
+    except APIError as e:
+        return {"status": "failure", "message": f"无法连接服务 {SERVICE_URL}：{e}", "traceback": traceback.format_exc()}
+    return {
+        "status": "success",
+        "multi_agent": client,
+        "rag_system": client.rag_system,
+        "model_type": client.model_type,
+    }
+
+
+def chat_agents(chat):
+    """读取一条回答对应的各智能体输出。"""
+    return BLOB_STORE.get_json(chat["agents_blob"])
+
+
+def exported_chats():
+    """逐条还原对话记录（含智能体输出），供导出时流式写出。"""
+    for chat in st.session_state.chat_history:
+        chat = dict(chat)
+        if "agents_blob" in chat:
+            chat["agents"] = chat_agents(chat)
+            del chat["agents_blob"]
+        yield chat
+
+
+def export_file(write):
+    """导出内容逐段写入 blob 存储（生成时不在内存中拼接整份内容），再读出字节交给下载按钮。"""
+    return BLOB_STORE.get_bytes(BLOB_STORE.put_stream(write))
+
+
+def document_texts():
+    return [BLOB_STORE.get_text(f["sha256"]) for f in st.session_state.uploaded_files if f.get("kind") != "table"]
+
+
+def document_tables():
+    """按列存储的表格文件（保存的是原始文件字节）重新解析为 [(表名, pyarrow.Table)]。"""
+    tables = []
+    for f in st.session_state.uploaded_files:
+        if f.get("kind") == "table":
+            tables.extend(read_tables(f["name"], BLOB_STORE.get_bytes(f["sha256"])))
+    return tables
+
+
+def ingest_documents(rag_system, texts, tables):
+    """文本走分块向量化，表格走列存储；返回合并后的入库摘要。"""
+    summary = {"added": 0, "errors": [], "chunk_stats": {}}
+    for part in (
+        rag_system.ingest_texts(texts, **st.session_state.chunk_config) if texts else None,
+        rag_system.ingest_tables(tables) if tables else None,
+    ):
+        if part is None:
+            continue
+        summary["added"] += part.get("added", 0) or 0
+        summary["errors"] += part.get("errors", [])
+        summary["chunk_stats"] = merge_chunk_stats(summary["chunk_stats"], part.get("chunk_stats") or {})
+        for key in ("tables", "rows"):
+            if key in part:
+                summary[key] = part[key]
+    return summary
+
+
+def start_ingest(rag_system, texts, tables, label):
+    """本地知识库在后台线程入库，完成后原子发布新版本，期间可以继续提问；服务模式仍同步提交。"""
+    if not hasattr(rag_system, "submit_ingest"):
+        show_ingest_summary(ingest_documents(rag_system, texts, tables))
+        return
+    future = rag_system.submit_ingest(texts, tables, **st.session_state.chunk_config)
+    st.session_state.ingest_jobs.append({"label": label, "future": future, "started": ts.time()})
+
+
+def show_ingest_jobs():
+    """已完成的后台入库显示摘要后移除，进行中的显示耗时。"""
+    running = []
+    for job in st.session_state.ingest_jobs:
+        if not job["future"].done():
+            running.append(job)
+            continue
+        try:
+            show_ingest_summary(job["future"].result())
+        except Exception as e:
+            st.error(f"{job['label']} 索引失败：{e}")
+    st.session_state.ingest_jobs = running
+    if running:
+        for job in running:
+            st.info(f"后台索引中：{job['label']}（已用 {ts.time() - job['started']:.0f} 秒），当前知识库仍可正常问答")
+        if st.button("刷新索引进度", key="refresh_ingest"):
+            st.rerun()
+
+
+def toggle_profiling():
+    directory = os.getenv(profiling.PROFILE_ENV) or profiling.DEFAULT_PROFILE_DIR
+    profiling.configure(directory if st.session_state.profiling_enabled else None)
+
+
+RESPONSE_CACHE_MODES = {"关闭": None, "读写": response_cache.MODE_READWRITE, "回放": response_cache.MODE_REPLAY}
+
+
+def current_cache_mode():
+    cache = response_cache.get_cache()
+    return next(label for label, mode in RESPONSE_CACHE_MODES.items() if mode == (cache.mode if cache else None))
+
+
+def change_cache_mode():
+    mode = RESPONSE_CACHE_MODES[st.session_state.response_cache_mode]
+    directory = os.getenv(response_cache.CACHE_ENV) or response_cache.DEFAULT_CACHE_DIR
+    max_mb = float(os.getenv(response_cache.CACHE_SIZE_ENV) or response_cache.DEFAULT_MAX_MB)
+    response_cache.configure(directory if mode else None, mode or response_cache.MODE_READWRITE, max_mb)
+
+
 def pending_agent_status():
     return {name: "pending" for name in AGENT_NAMES}
 
@@ -168,6 +410,10 @@ st.markdown("""
         border-left-color: #198754;
         background-color: #d1e7dd;
     }
+    .agent-status-skipped {
+        border-left-color: #ffc107;
+        background-color: #fff3cd;
+    }
     .agent-status-failed {
         border-left-color: #dc3545;
         background-color: #f8d7da;
@@ -189,6 +435,7 @@ def render_agent_status(agent_status_dict):
         "pending": "⏸️",
         "running": "🔄",
         "completed": "✅",
+        "skipped": "⏭️",
         "failed": "❌"
     }
     
@@ -196,6 +443,7 @@ def render_agent_status(agent_status_dict):
         "pending": "agent-status-pending",
         "running": "agent-status-running",
         "completed": "agent-status-completed",
+        "skipped": "agent-status-skipped",
         "failed": "agent-status-failed"
     }
     
@@ -203,15 +451,17 @@ def render_agent_status(agent_status_dict):
         "pending": "等待中",
         "running": "处理中",
         "completed": "已完成",
+        "skipped": "已跳过",
         "failed": "失败"
     }
     
     total = len(AGENT_NAMES)
     completed = sum(1 for agent in AGENT_NAMES if agent_status_dict.get(agent) == "completed")
     failed = sum(1 for agent in AGENT_NAMES if agent_status_dict.get(agent) == "failed")
+    skipped = sum(1 for agent in AGENT_NAMES if agent_status_dict.get(agent) == "skipped")
     running = sum(1 for agent in AGENT_NAMES if agent_status_dict.get(agent) == "running")
     
-    progress = (completed + failed) / total if total > 0 else 0
+    progress = (completed + failed + skipped) / total if total > 0 else 0
     
     #显示进度条
     st.progress(progress, text=f"进度: {completed}/{total} 已完成, {running} 进行中")
@@ -251,8 +501,47 @@ if 'api_config' not in st.session_state:
     }
 if 'chat_model' not in st.session_state.api_config:
     st.session_state.api_config["chat_model"] = DEFAULT_CHAT_MODEL
+if 'fallback_models' not in st.session_state.api_config:
+    st.session_state.api_config["fallback_models"] = [
+        m for m in RECOMMENDED_CHAT_MODELS if m != st.session_state.api_config["chat_model"]
+    ]
+if 'light_models' not in st.session_state.api_config:
+    st.session_state.api_config["light_models"] = []
+if 'extra_api_keys' not in st.session_state.api_config:
+    st.session_state.api_config["extra_api_keys"] = ""
 if 'current_agent_status' not in st.session_state:
     st.session_state.current_agent_status = {}
+if 'chunk_config' not in st.session_state:
+    st.session_state.chunk_config = {
+        "chunk_size": DEFAULT_CHUNK_SIZE,
+        "chunk_overlap": DEFAULT_CHUNK_OVERLAP,
+    }
+if 'reranker_kind' not in st.session_state:
+    st.session_state.reranker_kind = RERANKER_KINDS[0]
+if 'conversation' not in st.session_state:
+    st.session_state.conversation = ConversationMemory()
+if 'use_conversation_memory' not in st.session_state:
+    st.session_state.use_conversation_memory = True
+if 'query_planning' not in st.session_state:
+    st.session_state.query_planning = planning_enabled()
+if 'speculative' not in st.session_state:
+    st.session_state.speculative = os.getenv(SPECULATIVE_ENV) == "1"
+if 'hedge' not in st.session_state:
+    st.session_state.hedge = os.getenv(HEDGE_ENV) == "1"
+if 'deadline_s' not in st.session_state:
+    st.session_state.deadline_s = int(deadlines.default_seconds() or 0)
+if 'ingest_jobs' not in st.session_state:
+    st.session_state.ingest_jobs = []
+if 'agent_profiles' not in st.session_state:
+    st.session_state.agent_profiles = default_agent_profiles()
+if 'startup_timings' not in st.session_state:
+    st.session_state.startup_timings = {}
+
+# 本地模式且已配置密钥时，首次打开页面即在后台预热（结果跨会话缓存）
+if not SERVICE_URL and not st.session_state.system_initialized:
+    _env_key = load_api_key_from_env()
+    if _env_key:
+        prewarmed(_env_key, st.session_state.api_config.get("api_url", DEFAULT_API_URL))
 
 #侧边栏
 with st.sidebar:
@@ -270,10 +559,26 @@ with st.sidebar:
     st.session_state.api_config["chat_model"] = chat_model
     st.caption(f"推荐默认：{DEFAULT_CHAT_MODEL}")
 
+    fallback_options = [m for m in RECOMMENDED_CHAT_MODELS if m != chat_model]
+    st.session_state.api_config["fallback_models"] = st.multiselect(
+        "备用模型（限流/异常时自动切换）",
+        options=fallback_options,
+        default=[m for m in st.session_state.api_config["fallback_models"] if m in fallback_options],
+        help="主模型返回 429/5xx 或 choices 为空时自动切换，并按响应延迟选择端点",
+    )
+    st.session_state.api_config["light_models"] = st.multiselect(
+        "评审模型（轻量步骤）",
+        options=RECOMMENDED_CHAT_MODELS,
+        default=st.session_state.api_config["light_models"],
+        help="检索评估、拒绝评估、语义一致性、幻觉检测四个评审步骤优先使用的模型；留空则与主模型相同",
+    )
+
     if st.session_state.system_initialized and st.session_state.multi_agent is not None:
         active_model = getattr(st.session_state.multi_agent, "model_type", "未知")
         st.text(f"当前已加载：{active_model}")
-        if active_model in DEPRECATED_CHAT_MODELS or active_model != chat_model:
+        if SERVICE_URL:
+            st.caption(f"服务模式：{SERVICE_URL}（模型与知识库由服务端配置）")
+        elif active_model in DEPRECATED_CHAT_MODELS or active_model != chat_model:
             st.warning("模型与选择不一致，请点「重置系统」后重新「初始化系统」")
 
     with st.expander("API 密钥（可选）", expanded=False):
@@ -288,37 +593,82 @@ with st.sidebar:
             "API 端点",
             value=st.session_state.api_config.get("api_url", DEFAULT_API_URL),
         )
+        extra_keys_input = st.text_area(
+            "额外 API 密钥（每行一个，可选）",
+            value=st.session_state.api_config.get("extra_api_keys", ""),
+            help="多个密钥之间分摊请求配额，某个密钥被限流时自动切换",
+        )
         st.session_state.api_config["api_key"] = api_key_input
         st.session_state.api_config["api_url"] = api_url_input
+        st.session_state.api_config["extra_api_keys"] = extra_keys_input
         st.caption("魔搭 API 需绑定阿里云账号")
+
+    with st.expander("检索设置", expanded=False):
+        st.session_state.reranker_kind = st.selectbox(
+            "检索重排",
+            options=RERANKER_KINDS,
+            index=RERANKER_KINDS.index(st.session_state.reranker_kind),
+            help="lexical：词法重排（无需模型）；cross-encoder：本地 CPU 模型（需 sentence-transformers）；修改后需重新初始化",
+        )
+        st.caption("按标题、命令块与表格行结构分块；修改后点「重新索引」生效")
+        st.session_state.chunk_config["chunk_size"] = st.number_input(
+            "分块大小（字符）",
+            min_value=100,
+            max_value=4000,
+            step=50,
+            value=st.session_state.chunk_config["chunk_size"],
+        )
+        st.session_state.chunk_config["chunk_overlap"] = st.number_input(
+            "分块重叠（字符）",
+            min_value=0,
+            max_value=500,
+            step=10,
+            value=st.session_state.chunk_config["chunk_overlap"],
+            help="仅在单个段落超出分块大小、需要按句切分时使用",
+        )
+        st.session_state.use_conversation_memory = st.checkbox(
+            "多轮对话记忆",
+            value=st.session_state.use_conversation_memory,
+            help="追问时带上此前对话的压缩摘要；同一主题的追问直接复用上一轮检索结果",
+        )
+        if not SERVICE_URL:
+            st.session_state.query_planning = st.checkbox(
+                "拆分复合问题",
+                value=st.session_state.query_planning,
+                help="对比类（A 与 B 的区别）或含多个分句的问题拆成子查询，一次批量向量化后并行检索，按 RRF 合并结果",
+            )
+            if st.session_state.multi_agent is not None:
+                st.session_state.multi_agent.query_planning = st.session_state.query_planning
+        if not SERVICE_URL and st.session_state.rag_system is not None:
+            if st.button(
+                "发布索引快照",
+                help=f"把当前知识库发布为只读快照（{SNAPSHOT_DIR}），各进程以内存映射共享同一份数据，"
+                     f"其他会话几秒内切换到新版本，下次启动时直接加载，无需重新向量化",
+            ):
+                try:
+                    manifest = st.session_state.rag_system.publish_snapshot(SNAPSHOT_DIR)
+                    prewarmed.clear()
+                    st.success(f"已发布快照 {manifest['version']}（{manifest['chunks']} 个文本块）")
+                except (OSError, ValueError) as e:
+                    st.error(f"快照发布失败：{e}")
     
     col1, col2 = st.columns(2)
     with col1:
         if st.button("初始化系统", use_container_width=False, type="primary", 
                     help="初始化多智能体系统和RAG引擎"):
             with st.spinner("正在初始化系统..."):
-                # 获取API配置
-                api_key = st.session_state.api_config.get("api_key", "")
-                api_url = st.session_state.api_config.get("api_url", DEFAULT_API_URL)
-                chat_model = st.session_state.api_config.get("chat_model", DEFAULT_CHAT_MODEL)
-                
-                # 如果界面没有输入API密钥，尝试从文件加载
-                if not api_key:
-                    api_key = load_api_key_from_env()
-                    if api_key:
-                        st.info("从api_key.env文件加载API密钥")
-                
-                if not api_key:
-                    st.error("请先配置API密钥")
+                if SERVICE_URL:
+                    init_result = connect_service()
                 else:
-                    # 初始化后端系统
-                    init_result = initialize_system(api_key, api_url, model_type=chat_model)
+                    init_result = initialize_local_system()
+                if init_result is not None:
                     if init_result["status"] == "success":
                         st.session_state.multi_agent = init_result["multi_agent"]
                         st.session_state.rag_system = init_result["rag_system"]
                         st.session_state.system_initialized = True
-                        st.session_state.active_chat_model = init_result.get("model_type", chat_model)
-                        st.success(f"系统初始化完成！模型：{init_result.get('model_type', chat_model)}")
+                        st.session_state.active_chat_model = init_result["model_type"]
+                        st.session_state.startup_timings = init_result.get("timings", {})
+                        st.success(f"系统初始化完成！模型：{init_result['model_type']}")
                     else:
                         st.error(f"系统初始化失败: {init_result['message']}")
                         # 特别处理API认证错误
@@ -343,8 +693,80 @@ with st.sidebar:
     # status_color = "✅" if st.session_state.system_initialized else "⭕"
     if st.session_state.system_initialized :    
         st.title("已就绪")
+        timings = st.session_state.startup_timings
+        if timings:
+            labels = {"import": "导入", "connect": "建连", "load_index": "加载索引", "init": "初始化"}
+            st.caption("启动耗时：" + "，".join(f"{labels.get(k, k)} {v:.2f}s" for k, v in timings.items()))
+        rag_system = st.session_state.rag_system
+        version = rag_system.version if isinstance(rag_system, VectorStorage) else None
+        if version is not None and len(version):
+            snapshot = version.snapshot
+            st.caption(
+                f"知识库：{len(version)} 个文本块（版本 {version.number}），向量 {rag_system.model_type}"
+                + ("（本地计算）" if rag_system.embedder is not None else "")
+                + (f"（快照 {snapshot.version}，内存映射共享）" if snapshot else "")
+            )
+        router = getattr(st.session_state.multi_agent, "router", None)
+        if router is not None:
+            with st.expander("模型端点状态", expanded=False):
+                st.dataframe(router.stats(), use_container_width=True, hide_index=True)
+                if router.hedging is not None:
+                    hedging = router.hedging.stats()
+                    st.caption(
+                        f"对冲请求：{hedging['hedged']}/{hedging['requests']} 次，对冲先返回 {hedging['hedge_wins']} 次，"
+                        f"预算不足跳过 {hedging['skipped_by_budget']} 次；触发阈值（p{hedging['percentile']}）："
+                        + ("、".join(f"{m} {t:.1f}s" for m, t in hedging["thresholds"].items()) or "样本不足")
+                    )
+                st.caption("限流节奏：有余量时不等待，遇 429 / Retry-After / 剩余配额不足时自动放慢")
+                st.dataframe(pacing_stats(), use_container_width=True, hide_index=True)
     else:
         st.title("未初始化")
+    if not SERVICE_URL:
+        with st.expander("性能分析", expanded=False):
+            # 开关作用于整个进程，每次重跑时与实际状态同步（其他会话可能已切换）
+            st.session_state.profiling_enabled = profiling.is_enabled()
+            st.toggle(
+                "开启性能分析",
+                key="profiling_enabled",
+                on_change=toggle_profiling,
+                help="对问答流程、文档解析与入库逐次运行 cProfile，结果写入 profiles/ 目录；作用于整个进程，会略微拖慢处理",
+            )
+            reports = profiling.recent_reports()
+            if reports:
+                report = reports[-1]
+                st.caption(
+                    f"最近一次 {report['label']}：墙钟 {report['wall_s']:.2f}s，本地 CPU {report['cpu_s']:.2f}s，"
+                    f"网络 / 限流等待 {report['wait_s']:.2f}s"
+                )
+                st.dataframe(
+                    [{"分类": name, "自耗时(s)": seconds} for name, seconds in report["categories"].items()],
+                    use_container_width=True,
+                    hide_index=True,
+                )
+                st.dataframe(report["hotspots"][:10], use_container_width=True, hide_index=True)
+                st.caption(f"完整结果：{report['file']}")
+        with st.expander("回复缓存", expanded=False):
+            # 与性能分析相同，缓存模式作用于整个进程
+            st.session_state.response_cache_mode = current_cache_mode()
+            st.radio(
+                "缓存模式",
+                list(RESPONSE_CACHE_MODES),
+                key="response_cache_mode",
+                on_change=change_cache_mode,
+                horizontal=True,
+                help="读写：相同模型与输入的智能体步骤直接复用已保存的回复，某一步失败后重问时只重跑失败及其后的步骤；"
+                     "回放：只使用缓存，未命中的步骤报错且不调用模型，适合演示与回归对比",
+            )
+            cache_stats = response_cache.stats()
+            if cache_stats:
+                st.caption(
+                    f"{cache_stats['entries']} 条，{cache_stats['bytes'] / (1 << 20):.1f} / "
+                    f"{cache_stats['max_bytes'] / (1 << 20):.0f} MB；本进程命中 {cache_stats['hits']} 次，"
+                    f"未命中 {cache_stats['misses']} 次，淘汰 {cache_stats['evictions']} 条"
+                )
+                if st.button("清空缓存", use_container_width=True):
+                    response_cache.get_cache().clear()
+                    st.rerun()
     st.divider()
     
    
@@ -360,6 +782,67 @@ with st.sidebar:
         help="选择参与问答流程的智能体成员"
     )
     st.session_state.agents_activated = selected_agents
+
+    with st.expander("智能体参数", expanded=False):
+        st.caption("评审步骤只需给出判断与 1-2 句理由，调低 max_tokens 可明显缩短耗时；模型留空则使用主模型/评审模型")
+        edited_rows = st.data_editor(
+            profiles_to_rows(st.session_state.agent_profiles),
+            column_config={
+                "智能体": st.column_config.TextColumn(disabled=True),
+                "模型": st.column_config.SelectboxColumn(options=[""] + RECOMMENDED_CHAT_MODELS),
+                "max_tokens": st.column_config.NumberColumn(min_value=16, max_value=8192, step=16),
+                "temperature": st.column_config.NumberColumn(min_value=0.0, max_value=2.0, step=0.1),
+                "stop": st.column_config.TextColumn(help="多个停止序列用 | 分隔"),
+            },
+            hide_index=True,
+            use_container_width=True,
+            key="agent_profile_editor",
+        )
+        try:
+            profiles = rows_to_profiles(edited_rows)
+            if st.session_state.multi_agent is not None:
+                st.session_state.agent_profiles = st.session_state.multi_agent.set_agent_profiles(profiles)
+            else:
+                st.session_state.agent_profiles = merge_agent_profiles(profiles)
+        except ValueError as e:
+            st.error(f"智能体参数无效：{e}")
+        if st.button("恢复默认参数", use_container_width=True):
+            st.session_state.agent_profiles = default_agent_profiles()
+            st.session_state.pop("agent_profile_editor", None)
+            if st.session_state.multi_agent is not None:
+                st.session_state.multi_agent.set_agent_profiles()
+            st.rerun()
+        st.session_state.deadline_s = st.number_input(
+            "时间预算（秒）",
+            min_value=0,
+            max_value=900,
+            step=10,
+            value=st.session_state.deadline_s,
+            help="每个问题的总耗时上限，0 为不限时；时间不足时跳过评审步骤，整合也来不及时直接给出检索专员的回答",
+        )
+        if not SERVICE_URL:
+            st.session_state.speculative = st.checkbox(
+                "推测式整合",
+                value=st.session_state.speculative,
+                help="要点提取后，整合专家草稿与四个评审并行生成；评审未指出不当拒绝、矛盾/缺失或幻觉时直接采用草稿，否则按评审意见重新整合",
+            )
+            if st.session_state.multi_agent is not None:
+                st.session_state.multi_agent.speculative = st.session_state.speculative
+                stats = st.session_state.multi_agent.get_speculation_stats()
+                if stats["runs"]:
+                    st.caption(f"草稿采用率：{stats['accepted']}/{stats['runs']}（{stats['acceptance_rate']:.0%}）")
+            st.session_state.hedge = st.checkbox(
+                "对冲请求",
+                value=st.session_state.hedge,
+                help="某次模型调用超过该模型近期 p95 延迟仍未返回时，向另一个端点再发一次，取先返回的结果；"
+                     "对冲请求不超过总请求的 10%",
+            )
+            router = getattr(st.session_state.multi_agent, "router", None)
+            if router is not None:
+                if st.session_state.hedge and router.hedging is None:
+                    router.hedging = HedgePolicy()
+                elif not st.session_state.hedge:
+                    router.hedging = None
     
     st.divider()
     
@@ -408,15 +891,40 @@ with col_main:
                         st.write(f"**系统回答**: {chat['content']}")
                         if "timestamp" in chat:
                             st.caption(f"时间: {chat['timestamp']}")
+                        memory_info = chat.get("conversation")
+                        if memory_info and memory_info.get("reused_retrieval"):
+                            st.caption("同一主题追问，已复用上一轮检索结果")
+                        queries = chat.get("retrieval_queries")
+                        if queries:
+                            st.caption("复合问题已拆分检索：" + "；".join(queries[1:]))
+                        speculation = chat.get("speculation")
+                        if speculation:
+                            st.caption(
+                                "推测式整合：评审未发现问题，已采用并行生成的草稿" if speculation["accepted"]
+                                else f"推测式整合：{'、'.join(speculation['flags'])}指出问题，已按评审意见重新整合"
+                            )
+                        budget = chat.get("deadline")
+                        if budget and budget["skipped"]:
+                            st.caption(
+                                f"时间预算 {budget['budget_s']:g} 秒（用时 {budget['elapsed_s']:.1f} 秒），已跳过："
+                                + "、".join(f"{item['step']}（{item['reason']}）" for item in budget["skipped"])
+                            )
                         
                       
-                        if "agents" in chat:
+                        if "agents_blob" in chat:
                             with st.expander("查看智能体分析详情", expanded=False):
-                                for agent_name, response in chat["agents"].items():
+                                for agent_name, response in chat_agents(chat).items():
                                     if agent_name in st.session_state.agents_activated:
                                         st.markdown(f"**{agent_name}**:")
                                         st.info(response)
                                         st.divider()
+                                total_usage = (chat.get("token_usage") or {}).get("合计")
+                                if total_usage and total_usage["calls"]:
+                                    st.caption(
+                                        f"Token 用量：输入 {total_usage['prompt_tokens']}"
+                                        f"（前缀缓存命中 {total_usage['cached_tokens']}）"
+                                        f" / 输出 {total_usage['completion_tokens']}，共 {total_usage['calls']} 次调用"
+                                    )
         
         # 输入区域
         with st.form(key="chat_form", clear_on_submit=True):
@@ -443,35 +951,56 @@ with col_main:
             # 文件上传
             uploaded_file = st.file_uploader(
                 "",
-                type=["pdf", "txt", "md", "docx", "xlsx", "json"],
+                type=["pdf", "txt", "md", "docx", "xlsx", "xls", "csv", "json"],
                 accept_multiple_files=True,
                 help="上传文档将添加到RAG知识库中"
             )
             
             if uploaded_file:
                 new_texts = []
+                new_tables = []
+                # 服务模式的知识库不支持列存储，表格仍转为文本入库
+                table_mode = hasattr(st.session_state.rag_system, "ingest_tables")
                 for file in uploaded_file:
                     if file.name not in [f["name"] for f in st.session_state.uploaded_files]:
-                        content, err = extract_file_content(file)
+                        as_table = table_mode and is_table_file(file.name)
+                        if as_table:
+                            content, err = extract_file_tables(file)
+                        else:
+                            content, err = extract_file_content(file)
                         if content is None:
                             st.warning(f"{file.name} 解析失败: {err}")
                             continue
+                        digest = BLOB_STORE.put_bytes(file.getvalue()) if as_table else BLOB_STORE.put_text(content)
+                        if digest in [f["sha256"] for f in st.session_state.uploaded_files]:
+                            st.info(f"{file.name} 与已上传文档内容相同，已跳过")
+                            continue
                         st.session_state.uploaded_files.append({
                             "name": file.name,
                             "size": file.size,
                             "type": file.type,
                             "upload_time": datetime.now().strftime("%H:%M"),
-                            "content": content
+                            "sha256": digest,
+                            "kind": "table" if as_table else "text",
                         })
-                        new_texts.append(content)
+                        if as_table:
+                            new_tables.extend(content)
+                        else:
+                            new_texts.append(content)
                         st.success(f"已上传: {file.name}")
                 # 写入向量库
-                if new_texts:
+                if new_texts or new_tables:
                     if st.session_state.rag_system is not None:
-                        summary = st.session_state.rag_system.ingest_texts(new_texts)
-                        show_ingest_summary(summary)
+                        try:
+                            start_ingest(
+                                st.session_state.rag_system, new_texts, new_tables,
+                                f"{len(new_texts) + len(new_tables)} 个新文档",
+                            )
+                        except APIError as e:
+                            st.error(f"文档索引失败：{e}")
                     else:
                         st.warning("系统未初始化，无法索引文档")
+            show_ingest_jobs()
                       
         
         # 处理用户提交
@@ -494,7 +1023,13 @@ with col_main:
                     with processing_placeholder:
                         with st.spinner("多智能体协作处理中...(响应可能需要几分钟，请耐心等待)"):
                             # 处理问题
-                            result = process_question(st.session_state.multi_agent, user_input.strip())
+                            result = process_question(
+                                st.session_state.multi_agent,
+                                user_input.strip(),
+                                conversation=st.session_state.conversation
+                                if st.session_state.use_conversation_memory else None,
+                                deadline=st.session_state.deadline_s,
+                            )
                     
                     # 获取最终状态并更新session_state
                     final_status = result.get("agent_status") or pending_agent_status()
@@ -512,10 +1047,17 @@ with col_main:
                         st.session_state.chat_history.append({
                             "role": "assistant",
                             "content": result["final_result"],
-                            "agents": {k: v for k, v in agents_responses.items() 
-                                      if k in st.session_state.agents_activated},
+                            "agents_blob": BLOB_STORE.put_json({
+                                k: v for k, v in agents_responses.items()
+                                if k in st.session_state.agents_activated
+                            }),
                             "timestamp": datetime.now().strftime("%H:%M"),
-                            "agent_status": final_status
+                            "agent_status": final_status,
+                            "conversation": result.get("conversation"),
+                            "token_usage": result.get("token_usage"),
+                            "speculation": result.get("speculation"),
+                            "retrieval_queries": result.get("retrieval_queries"),
+                            "deadline": result.get("deadline"),
                         })
                     else:
                         st.session_state.processing = False
@@ -629,15 +1171,14 @@ with col_agents:
                     with st.spinner("正在重新索引..."):
                         # 如果有RAG系统实例，重新索引
                         if st.session_state.rag_system is not None:
-                            texts = [f.get("content","") for f in st.session_state.uploaded_files if f.get("content")]
-                            if texts:
-                                st.session_state.rag_system.reset_storage()
-                                summary = st.session_state.rag_system.ingest_texts(texts)
-                                added = summary.get("added", 0) if isinstance(summary, dict) else 0
-                                if added > 0:
-                                    st.success(f"知识库索引更新完成，共 {added} 条片段")
-                                if isinstance(summary, dict) and summary.get("errors"):
-                                    st.warning("部分文本未成功索引：\n" + "\n".join(summary["errors"]))
+                            texts = document_texts()
+                            tables = document_tables()
+                            if texts or tables:
+                                try:
+                                    st.session_state.rag_system.reset_storage()
+                                    start_ingest(st.session_state.rag_system, texts, tables, "重新索引")
+                                except APIError as e:
+                                    st.error(f"重新索引失败：{e}")
                             else:
                                 st.warning("未找到可索引的文本内容")
                         else:
@@ -658,12 +1199,9 @@ with col_agents:
         if st.button("导出对话JSON", use_container_width=True, 
                     help="导出完整的对话记录为JSON格式"):
             if st.session_state.chat_history:
-                chat_json = json.dumps(st.session_state.chat_history, 
-                                    ensure_ascii=False, indent=2)
-                
                 st.download_button(
                     label="下载JSON文件",
-                    data=chat_json,
+                    data=export_file(lambda out: write_json_array(out, exported_chats())),
                     file_name=f"eda_chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
                     mime="application/json",
                     use_container_width=True
@@ -676,13 +1214,14 @@ with col_agents:
                 final_responses = [chat["content"] for chat in st.session_state.chat_history 
                                 if chat["role"] == "assistant"]
                 if final_responses:
-                    txt_content = "\n\n" + "="*50 + "\n\n".join(
-                        [f"回答 {i+1}:\n{resp}" for i, resp in enumerate(final_responses)]
-                    )
-                    
+                    def write_responses(out):
+                        out.write("\n\n" + "=" * 50)
+                        for i, resp in enumerate(final_responses):
+                            out.write(("\n\n" if i else "") + f"回答 {i+1}:\n{resp}")
+
                     st.download_button(
                         label="下载TXT文件",
-                        data=txt_content,
+                        data=export_file(write_responses),
                         file_name=f"eda_responses_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
                         mime="text/plain",
                         use_container_width=True
@@ -692,22 +1231,24 @@ with col_agents:
         if st.button("导出分析报告", use_container_width=True,
                     help="导出智能体分析报告"):
             if st.session_state.chat_history:
-                # 创建分析报告
-                report = {
-                    "系统信息": {
-                        "生成时间": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "活跃智能体": st.session_state.agents_activated,
-                        "对话总数": len(st.session_state.chat_history),
-                        "知识文档数": len(st.session_state.uploaded_files)
-                    },
-                    "对话记录": st.session_state.chat_history
+                # 创建分析报告：系统信息在前，对话记录逐条从磁盘读取写出
+                system_info = {
+                    "生成时间": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "活跃智能体": st.session_state.agents_activated,
+                    "对话总数": len(st.session_state.chat_history),
+                    "知识文档数": len(st.session_state.uploaded_files)
                 }
-                
-                report_json = json.dumps(report, ensure_ascii=False, indent=2)
-                
+
+                def write_report(out):
+                    out.write('{\n"系统信息": ')
+                    json.dump(system_info, out, ensure_ascii=False, indent=2)
+                    out.write(',\n"对话记录": ')
+                    write_json_array(out, exported_chats())
+                    out.write("\n}")
+
                 st.download_button(
                     label="下载报告",
-                    data=report_json,
+                    data=export_file(write_report),
                     file_name=f"eda_analysis_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
                     mime="application/json",
                     use_container_width=True
@@ -718,6 +1259,12 @@ with col_agents:
                     help="清空当前对话记录"):
             if st.session_state.chat_history:
                 st.session_state.chat_history = []
+                st.session_state.conversation.clear()
+                if isinstance(st.session_state.multi_agent, ServiceClient):
+                    try:
+                        st.session_state.multi_agent.clear_session()
+                    except APIError as e:
+                        st.warning(f"服务端会话清理失败：{e}")
                 st.success("对话记录已清空")
                 st.rerun()
 
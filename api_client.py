@@ -0,0 +1,476 @@
+"""OpenAI 兼容接口的 HTTP 客户端：keep-alive 连接池复用、单次调用超时与取消（同步 / asyncio）、自适应限流节奏。
+
+处于 deadlines.start() 的时间预算内时，每次调用的超时不超过剩余时间；预算用完后抛出 DeadlineExceeded（不计为端点故障）。
+向量接口以 base64 传输 float32（响应约为十进制 JSON 的 1/3），直接解码为 numpy 数组；安装 orjson 时用其解析响应。
+"""
+
+import asyncio
+import base64
+import json
+import re
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import httpx
+import numpy as np
+
+import deadlines
+from deadlines import DeadlineExceeded
+from tracing import current_span, span
+
+DEFAULT_TIMEOUT = 120.0
+EMBEDDING_TIMEOUT = 30.0
+POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60.0)
+
+# 自适应节奏：有余量时不等待；429 时请求间隔翻倍，成功后逐步回落
+MIN_BACKOFF_INTERVAL = 0.5
+MAX_PACING_INTERVAL = 10.0
+MAX_PACING_WAIT = 30.0
+PACING_DECAY = 0.5
+# 剩余配额低于该比例时按“剩余时间 / 剩余次数”均匀摊开请求
+LOW_QUOTA_RATIO = 0.1
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 可选 orjson：解析大段数字数组快数倍，未安装时退回标准库
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# 不接受 base64 的 (地址, 模型) 改用 float，进程内记住，不再重复试探
+EMBEDDING_ENCODING = "base64"
+_float_embedding_models = set()
+_float_embedding_lock = threading.Lock()
+# 只有错误信息提到编码格式时才视为不支持 base64；输入过长、模型名错误等普通校验错误照常抛出
+_BASE64_REJECTION = re.compile(r"encoding_format|base64", re.I)
+
+
+class APIError(Exception):
+    """接口返回非 200 状态码或响应格式异常。"""
+
+    def __init__(self, message, status_code=None, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = dict(headers or {})
+
+
+def _header(headers, *names):
+    if not headers:
+        return None
+    for name in names:
+        value = headers.get(name)
+        if value is None:
+            value = headers.get(name.lower())
+        if value is not None:
+            return str(value).strip()
+    return None
+
+
+def parse_retry_after(headers):
+    """解析 Retry-After（秒数或 HTTP 日期），返回需等待的秒数。"""
+    value = _header(headers, "Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_duration(value):
+    """解析 "1s" / "6m0s" / "20ms" / "0.5" 形式的时长（秒）。"""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def parse_rate_limit(headers):
+    """读取 x-ratelimit-* / ratelimit-* 响应头，返回 (剩余次数, 总次数, 重置秒数)，缺失项为 None。"""
+    def number(*names):
+        value = _header(headers, *names)
+        try:
+            return int(float(value)) if value is not None else None
+        except ValueError:
+            return None
+
+    remaining = number("x-ratelimit-remaining-requests", "x-ratelimit-remaining", "ratelimit-remaining")
+    limit = number("x-ratelimit-limit-requests", "x-ratelimit-limit", "ratelimit-limit")
+    reset = _parse_duration(_header(headers, "x-ratelimit-reset-requests", "x-ratelimit-reset", "ratelimit-reset"))
+    return remaining, limit, reset
+
+
+class AdaptivePacer:
+    """按 (地址, 密钥, 模型) 维护请求节奏：根据 429、Retry-After 与限流响应头决定下一次请求前的等待。"""
+
+    def __init__(self, name=""):
+        self.name = name
+        self.interval = 0.0
+        self.blocked_until = 0.0
+        self.next_slot = 0.0
+        self.remaining = None
+        self.limit = None
+        self.throttled = 0
+        self.waits = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """预留下一个请求时段，返回调用方需要等待的秒数（通常为 0）；需等待超过 max_wait 时不占用时段，返回 None。"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.blocked_until, self.next_slot)
+            wait = max(min(start - now, MAX_PACING_WAIT), 0.0)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self.next_slot = start + self.interval
+            if wait > 0:
+                self.waits += 1
+                self.waited += wait
+            return wait
+
+    def _reserve_within_deadline(self):
+        # 限流等待不超过本次问答的剩余时间；等不起时直接放弃，不睡眠也不占用时段
+        wait = self.reserve(deadlines.remaining())
+        if wait is None:
+            raise DeadlineExceeded("限流等待超过剩余时间预算，请求未发出")
+        return wait
+
+    def acquire(self):
+        wait = self._reserve_within_deadline()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self):
+        wait = self._reserve_within_deadline()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def observe(self, status_code, headers):
+        """根据响应状态与响应头调整节奏。"""
+        retry_after = parse_retry_after(headers)
+        remaining, limit, reset = parse_rate_limit(headers)
+        with self._lock:
+            now = time.monotonic()
+            if remaining is not None:
+                self.remaining = remaining
+            if limit is not None:
+                self.limit = limit
+            if status_code == 429:
+                self.throttled += 1
+                self.interval = min(max(self.interval * 2, MIN_BACKOFF_INTERVAL), MAX_PACING_INTERVAL)
+                pause = retry_after if retry_after is not None else self.interval
+                self.blocked_until = max(self.blocked_until, now + pause)
+                return
+            if retry_after is not None:
+                # 503 等响应也可能带 Retry-After
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            low_quota = remaining is not None and (
+                remaining <= 0 or (limit and remaining <= limit * LOW_QUOTA_RATIO)
+            )
+            if low_quota and reset:
+                if remaining <= 0:
+                    self.blocked_until = max(self.blocked_until, now + reset)
+                self.interval = min(reset / max(remaining, 1), MAX_PACING_INTERVAL)
+            elif self.interval:
+                self.interval *= PACING_DECAY
+                if self.interval < 0.05:
+                    self.interval = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "pacer": self.name,
+                "interval": round(self.interval, 3),
+                "blocked_for": round(max(self.blocked_until - now, 0.0), 1),
+                "remaining": self.remaining,
+                "limit": self.limit,
+                "throttled": self.throttled,
+                "waits": self.waits,
+                "waited": round(self.waited, 2),
+            }
+
+
+_pacers = {}
+_pacers_lock = threading.Lock()
+
+
+def get_pacer(api_url, api_key, model):
+    """同步与异步客户端共享的限流节奏（配额按地址、密钥与模型计算）。"""
+    key = (str(api_url).rstrip("/"), api_key, model)
+    with _pacers_lock:
+        if key not in _pacers:
+            _pacers[key] = AdaptivePacer(f"{model}#{str(api_key)[-4:]}")
+        return _pacers[key]
+
+
+def pacing_stats():
+    """返回所有限流节奏的当前状态。"""
+    with _pacers_lock:
+        pacers = list(_pacers.values())
+    return [pacer.snapshot() for pacer in pacers]
+
+
+def resolve_endpoint(api_url, path):
+    """将基础地址与接口路径拼接；已包含该路径时原样返回。"""
+    base = str(api_url).rstrip("/")
+    return base if base.endswith(f"/{path}") else f"{base}/{path}"
+
+
+def _auth_headers(api_key):
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+
+
+def _check_response(response):
+    if response.status_code != 200:
+        raise APIError(
+            f"HTTP {response.status_code}: {response.text[:200]}",
+            status_code=response.status_code,
+            headers=response.headers,
+        )
+    try:
+        return _json_loads(response.content)
+    except ValueError as e:
+        raise APIError(f"响应不是合法 JSON: {response.text[:200]}", response.status_code, response.headers) from e
+
+
+def parse_chat_response(payload, response=None, latency=0.0):
+    """提取回答文本与用量；choices 为空时抛出 APIError。"""
+    choices = payload.get("choices") if isinstance(payload, dict) else None
+    if not choices:
+        raise APIError(
+            f"模型返回格式异常（choices 为空）: {str(payload)[:200]}",
+            status_code=getattr(response, "status_code", None),
+            headers=getattr(response, "headers", None),
+        )
+    message = choices[0].get("message") or {}
+    return {
+        "content": message.get("content") or "",
+        "finish_reason": choices[0].get("finish_reason"),
+        "model": payload.get("model"),
+        "usage": payload.get("usage") or {},
+        "latency": latency,
+    }
+
+
+def _decode_embedding(value):
+    """base64 字符串（小端 float32）或数字列表 → float32 数组。"""
+    if isinstance(value, str):
+        try:
+            return np.frombuffer(base64.b64decode(value), dtype="<f4")
+        except ValueError as e:
+            raise APIError(f"Embedding 向量不是合法的 base64 float32: {value[:50]}") from e
+    return np.asarray(value, dtype=np.float32)
+
+
+def parse_embedding_response(payload):
+    """兼容 OpenAI（data）与 DashScope（output.embeddings）两种返回格式；向量为 float 列表或 base64 均可，返回 float32 数组列表。"""
+    if "output" in payload:
+        items = payload.get("output", {}).get("embeddings", [])
+    elif "data" in payload:
+        items = payload.get("data", [])
+    else:
+        raise APIError(f"Embedding 响应格式异常: {str(payload)[:200]}")
+    return [
+        _decode_embedding(item["embedding"])
+        for item in items
+        if isinstance(item, dict) and item.get("embedding") is not None and len(item["embedding"])
+    ]
+
+
+def _chat_payload(model, messages, params):
+    payload = {"model": model, "messages": messages}
+    payload.update({key: value for key, value in params.items() if value is not None})
+    return payload
+
+
+def _http_span(kind, api_url, model, **attributes):
+    """每次模型 HTTP 调用一个 client span；重试与故障转移表现为同级的多个 span。"""
+    host = urlparse(str(api_url)).netloc
+    return span(f"{kind} {model}", {"server.address": host, "model": model, **attributes}, kind="client")
+
+
+def _usage_attributes(result):
+    usage = result.get("usage") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+    }
+
+
+def _embedding_key(api_url, model):
+    return str(api_url).rstrip("/"), str(model)
+
+
+def _embedding_payload(api_url, model, inputs):
+    floats = _embedding_key(api_url, model) in _float_embedding_models
+    return {"model": model, "input": list(inputs), "encoding_format": "float" if floats else EMBEDDING_ENCODING}
+
+
+def _rejects_base64(api_url, payload, error):
+    """base64 请求返回 400/422 且错误信息指向编码格式时，记住该模型不支持 base64，改用 float 重试一次。"""
+    if payload["encoding_format"] != EMBEDDING_ENCODING or error.status_code not in (400, 422):
+        return False
+    if not _BASE64_REJECTION.search(str(error)):
+        return False
+    current_span().set_attribute("encoding_fallback", "float")
+    with _float_embedding_lock:
+        _float_embedding_models.add(_embedding_key(api_url, payload["model"]))
+    return True
+
+
+class ApiClient:
+    """同步客户端；同一 (地址, 密钥) 共享一个连接池，线程安全。"""
+
+    def __init__(self, api_url, api_key, timeout=DEFAULT_TIMEOUT):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self._client = httpx.Client(headers=_auth_headers(api_key), limits=POOL_LIMITS, timeout=timeout)
+
+    def _post(self, path, payload, timeout):
+        pacer = get_pacer(self.api_url, self.api_key, payload["model"])
+        current_span().set_attribute("pacing_wait_s", round(pacer.acquire(), 3))
+        timeout = deadlines.cap_timeout(self.timeout if timeout is None else timeout)
+        try:
+            response = self._client.post(resolve_endpoint(self.api_url, path), json=payload, timeout=timeout)
+        except httpx.HTTPError as e:
+            if deadlines.expired():
+                raise DeadlineExceeded(f"时间预算用完，请求已中止（{timeout:.1f}s）") from e
+            raise APIError(f"网络请求失败: {e!r}") from e
+        pacer.observe(response.status_code, response.headers)
+        current_span().set_attribute("http.status_code", response.status_code)
+        return response, _check_response(response)
+
+    def chat(self, model, messages, timeout=None, **params):
+        with _http_span("chat", self.api_url, model) as http_span:
+            start = time.perf_counter()
+            response, payload = self._post("chat/completions", _chat_payload(model, messages, params), timeout)
+            result = parse_chat_response(payload, response, time.perf_counter() - start)
+            http_span.set_attributes(_usage_attributes(result))
+            return result
+
+    def embeddings(self, model, inputs, timeout=EMBEDDING_TIMEOUT):
+        with _http_span("embeddings", self.api_url, model, inputs=len(inputs)) as http_span:
+            request = _embedding_payload(self.api_url, model, inputs)
+            http_span.set_attribute("encoding_format", request["encoding_format"])
+            try:
+                _, payload = self._post("embeddings", request, timeout)
+            except APIError as e:
+                if not _rejects_base64(self.api_url, request, e):
+                    raise
+                _, payload = self._post("embeddings", _embedding_payload(self.api_url, model, inputs), timeout)
+            return parse_embedding_response(payload)
+
+    def warm(self, timeout=3.0):
+        """预先建立 TCP/TLS 连接放入连接池；失败不影响后续调用。"""
+        try:
+            self._client.get(resolve_endpoint(self.api_url, "models"), timeout=timeout)
+            return True
+        except httpx.HTTPError:
+            return False
+
+    def close(self):
+        self._client.close()
+
+
+class AsyncApiClient:
+    """asyncio 客户端；httpx.AsyncClient 绑定事件循环，需通过 get_async_client 在协程内获取。"""
+
+    def __init__(self, api_url, api_key, timeout=DEFAULT_TIMEOUT):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self._client = httpx.AsyncClient(headers=_auth_headers(api_key), limits=POOL_LIMITS, timeout=timeout)
+
+    async def _post(self, path, payload, timeout):
+        pacer = get_pacer(self.api_url, self.api_key, payload["model"])
+        current_span().set_attribute("pacing_wait_s", round(await pacer.aacquire(), 3))
+        timeout = deadlines.cap_timeout(self.timeout if timeout is None else timeout)
+        # wait_for 限制整次调用耗时；任务被取消时 httpx 会关闭对应连接
+        try:
+            response = await asyncio.wait_for(
+                self._client.post(resolve_endpoint(self.api_url, path), json=payload, timeout=timeout),
+                timeout=timeout,
+            )
+        except (asyncio.TimeoutError, httpx.HTTPError) as e:
+            if deadlines.expired():
+                raise DeadlineExceeded(f"时间预算用完，请求已中止（{timeout:.1f}s）") from e
+            if isinstance(e, asyncio.TimeoutError):
+                raise APIError(f"请求超时（{timeout}s）") from e
+            raise APIError(f"网络请求失败: {e!r}") from e
+        pacer.observe(response.status_code, response.headers)
+        current_span().set_attribute("http.status_code", response.status_code)
+        return response, _check_response(response)
+
+    async def chat(self, model, messages, timeout=None, **params):
+        with _http_span("chat", self.api_url, model) as http_span:
+            start = time.perf_counter()
+            response, payload = await self._post(
+                "chat/completions", _chat_payload(model, messages, params), timeout
+            )
+            result = parse_chat_response(payload, response, time.perf_counter() - start)
+            http_span.set_attributes(_usage_attributes(result))
+            return result
+
+    async def embeddings(self, model, inputs, timeout=EMBEDDING_TIMEOUT):
+        with _http_span("embeddings", self.api_url, model, inputs=len(inputs)) as http_span:
+            request = _embedding_payload(self.api_url, model, inputs)
+            http_span.set_attribute("encoding_format", request["encoding_format"])
+            try:
+                _, payload = await self._post("embeddings", request, timeout)
+            except APIError as e:
+                if not _rejects_base64(self.api_url, request, e):
+                    raise
+                _, payload = await self._post("embeddings", _embedding_payload(self.api_url, model, inputs), timeout)
+            return parse_embedding_response(payload)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client(api_url, api_key):
+    """返回进程内共享的同步客户端。"""
+    key = (str(api_url).rstrip("/"), api_key)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = ApiClient(api_url, api_key)
+        return _clients[key]
+
+
+def get_async_client(api_url, api_key):
+    """返回当前事件循环内共享的异步客户端，必须在协程中调用。"""
+    loop = asyncio.get_running_loop()
+    key = (str(api_url).rstrip("/"), api_key)
+    per_loop = _async_clients.setdefault(loop, {})
+    if key not in per_loop:
+        per_loop[key] = AsyncApiClient(api_url, api_key)
+    return per_loop[key]
@@ -0,0 +1,245 @@
+"""检索质量与延迟评测：遍历 VectorStorage 配置，输出 recall@k、MRR、入库吞吐、索引内存与查询延迟（JSON）。
+
+--prefix-dims 同时评测两阶段向量检索：prefix_recall@k 为前缀粗排 + 全维重排的向量路 top_k 与全维精确 top_k 的重合率，
+vector_scan_bytes 为每次查询需要扫描的向量矩阵大小。
+
+数据集为 JSON 文件：
+    {
+      "documents": ["文档全文", ...],
+      "queries": [{"question": "...", "relevant": ["相关片段中必含的原文", ...]}, ...]
+    }
+检索到的文本块包含某条 relevant 原文即视为命中该条，标注与分块大小无关。
+未指定数据集时使用内置的小样例；默认使用确定性的哈希向量（embeddings.HashingEmbedder），无需网络。
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from embeddings import EMBEDDING_ENV, HASHING_DIM, HashingEmbedder, build_embedder
+from hybrid_index import HybridIndex
+from multi_agent_backend import (
+    DEFAULT_API_URL,
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_EMBEDDING_MODEL,
+    VectorStorage,
+    load_key,
+)
+
+FAKE_EMBEDDING_DIM = HASHING_DIM
+
+SAMPLE_DATASET = {
+    "documents": [
+        "# 时序约束\n\n## 时钟定义\n"
+        "create_clock -name clk -period 10 [get_ports clk] 用于定义主时钟，周期单位为纳秒。\n"
+        "set_clock_uncertainty 0.2 [get_clocks clk] 为时钟增加不确定性余量，覆盖抖动与偏斜。\n\n"
+        "## 输入输出延迟\n"
+        "set_input_delay 2 -clock clk [all_inputs] 描述外部器件到输入端口的延迟。\n"
+        "set_output_delay 3 -clock clk [all_outputs] 描述输出端口到下游器件的延迟。\n",
+        "# 布线规则\n\n## 差分对\n"
+        "差分对走线需保持等长等距，长度误差一般控制在 5 mil 以内，并尽量避免跨分割平面。\n\n"
+        "## 电源完整性\n"
+        "电源网络应采用宽走线或铺铜，去耦电容尽量靠近芯片电源引脚放置，以降低回路电感。\n",
+        "# 静态时序分析\n\n"
+        "建立时间检查要求数据在时钟有效沿之前稳定，保持时间检查要求数据在时钟沿之后保持稳定。\n"
+        "时序违例时可通过插入缓冲器、调整驱动强度或优化逻辑级数修复。\n\n"
+        "# 物理设计流程\n\n"
+        "物理设计依次包括布图规划、布局、时钟树综合、布线与签核，每一步都需检查时序与拥塞。\n",
+    ],
+    "queries": [
+        {"question": "如何定义主时钟？", "relevant": ["create_clock -name clk"]},
+        {"question": "时钟不确定性怎么设置", "relevant": ["set_clock_uncertainty"]},
+        {"question": "输出延迟约束命令", "relevant": ["set_output_delay"]},
+        {"question": "差分对走线有什么要求？", "relevant": ["差分对走线需保持等长等距"]},
+        {"question": "去耦电容应该放在哪里", "relevant": ["去耦电容尽量靠近"]},
+        {"question": "建立时间和保持时间检查", "relevant": ["建立时间检查要求"]},
+        {"question": "时序违例如何修复", "relevant": ["时序违例时可通过插入缓冲器"]},
+        {"question": "物理设计流程包括哪些步骤", "relevant": ["布图规划、布局、时钟树综合"]},
+    ],
+}
+
+
+# 离线评测用的 embedder，兼容旧引用
+FakeEmbedder = HashingEmbedder
+
+
+def load_dataset(path=None):
+    if not path:
+        return SAMPLE_DATASET
+    with open(path, "r", encoding="utf-8") as f:
+        dataset = json.load(f)
+    if not dataset.get("documents") or not dataset.get("queries"):
+        raise ValueError("数据集需包含非空的 documents 与 queries")
+    return dataset
+
+
+def _first_hit(texts, relevant):
+    """返回第一个命中 relevant 的名次（从 1 开始），未命中为 None。"""
+    for rank, text in enumerate(texts, start=1):
+        if any(snippet in text for snippet in relevant):
+            return rank
+    return None
+
+
+def _percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3) if samples else None
+
+
+def build_storage(dataset, chunk_size, chunk_overlap, weight, embedder, api_key=None, api_url=DEFAULT_API_URL):
+    """入库并构建索引，返回 (storage, 入库统计)。"""
+    storage = VectorStorage(
+        api_key=api_key,
+        model_type=DEFAULT_EMBEDDING_MODEL,
+        url=api_url,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        weight=weight,
+        embedder=embedder,
+    )
+    start = time.perf_counter()
+    summary = storage.ingest_texts(dataset["documents"])
+    ingest_seconds = time.perf_counter() - start
+    # 入库时已在发布前构建索引；这里按已发布版本的内容重新构建一次，单独计量构建耗时与内存
+    items = list(storage.version)
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = HybridIndex(chunks=[item[1] for item in items], vectors=[item[0] for item in items])
+    build_seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    chars = sum(len(str(text)) for text in dataset["documents"])
+    return storage, {
+        "chunks": len(index),
+        "errors": summary["errors"],
+        "ingest_seconds": round(ingest_seconds, 4),
+        "ingest_chunks_per_s": round(len(index) / ingest_seconds, 1) if ingest_seconds else None,
+        "ingest_chars_per_s": round(chars / ingest_seconds, 1) if ingest_seconds else None,
+        "index_build_seconds": round(build_seconds, 4),
+        "index_memory_bytes": int(peak),
+        "vector_bytes": int(index.matrix.nbytes),
+    }
+
+
+def evaluate(storage, queries, top_k):
+    """逐条查询，统计 recall@k、MRR 与延迟分位数。"""
+    latencies = []
+    hits = 0
+    found = 0
+    total = 0
+    reciprocal_ranks = []
+    for query in queries:
+        relevant = list(query["relevant"])
+        start = time.perf_counter()
+        texts = [item["text"] for item in storage.retrieve_candidates(query["question"], top_k=top_k)]
+        latencies.append(time.perf_counter() - start)
+        rank = _first_hit(texts, relevant)
+        hits += rank is not None
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        found += sum(any(snippet in text for text in texts) for snippet in relevant)
+        total += len(relevant)
+    count = len(queries)
+    return {
+        f"recall@{top_k}": round(found / total, 4) if total else None,
+        f"hit_rate@{top_k}": round(hits / count, 4) if count else None,
+        "mrr": round(sum(reciprocal_ranks) / count, 4) if count else None,
+        "latency_p50_ms": _percentile_ms(latencies, 50),
+        "latency_p99_ms": _percentile_ms(latencies, 99),
+        "queries": count,
+    }
+
+
+def run_benchmark(dataset, chunk_sizes, top_ks, weights, chunk_overlap=DEFAULT_CHUNK_OVERLAP,
+                  embedder=None, api_key=None, api_url=DEFAULT_API_URL, repeat=1, prefix_dims=(0,)):
+    """遍历 chunk_size × weight × prefix_dim × top_k，返回每个配置一条结果的列表；prefix_dim 为 0 表示全维检索。"""
+    results = []
+    for chunk_size, weight in itertools.product(chunk_sizes, weights):
+        storage, ingest = build_storage(
+            dataset, chunk_size, chunk_overlap, weight, embedder, api_key=api_key, api_url=api_url
+        )
+        query_vectors = None
+        for prefix_dim in prefix_dims:
+            storage.prefix_dim = prefix_dim or None
+            index = storage._get_index()
+            if index.prefix_matrix is not None and query_vectors is None:
+                query_vectors = storage._post_embeddings([query["question"] for query in dataset["queries"]])
+            for top_k in top_ks:
+                metrics = evaluate(storage, dataset["queries"] * repeat, top_k)
+                metrics["queries"] = len(dataset["queries"])
+                results.append({
+                    "chunk_size": chunk_size,
+                    "chunk_overlap": chunk_overlap,
+                    "weight": weight,
+                    "top_k": top_k,
+                    "prefix_dim": index.prefix_dim,
+                    **ingest,
+                    "vector_scan_bytes": int((index.matrix if index.prefix_matrix is None else index.prefix_matrix).nbytes),
+                    f"prefix_recall@{top_k}": round(index.prefix_recall(query_vectors, top_k), 4)
+                    if index.prefix_matrix is not None else 1.0,
+                    **metrics,
+                })
+    return results
+
+
+def _numbers(text, cast):
+    return [cast(item) for item in str(text).split(",") if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VectorStorage 检索质量与延迟评测")
+    parser.add_argument("--dataset", help="数据集 JSON 路径；缺省使用内置样例")
+    parser.add_argument("--chunk-sizes", default="200,400,800", help="逗号分隔")
+    parser.add_argument("--chunk-overlap", type=int, default=DEFAULT_CHUNK_OVERLAP)
+    parser.add_argument("--top-k", default="1,3,5", help="逗号分隔")
+    parser.add_argument("--weights", default="0.0,0.7,1.0", help="向量路 RRF 权重，1.0 为纯向量，0.0 为纯 BM25")
+    parser.add_argument("--embeddings", choices=("fake", "api", "onnx"), default="fake",
+                        help="fake：确定性哈希向量（离线）；api：调用 embedding 接口（读取 api_key.env）；"
+                             "onnx：本地 ONNX 向量模型（目录由 EDA_QA_ONNX_MODEL 指定）")
+    parser.add_argument("--dim", type=int, default=FAKE_EMBEDDING_DIM, help="哈希向量维度")
+    parser.add_argument("--prefix-dims", default="0",
+                        help="两阶段检索的粗排维度，逗号分隔（如 0,128,256），0 为全维检索")
+    parser.add_argument("--api-url", default=DEFAULT_API_URL)
+    parser.add_argument("--repeat", type=int, default=1, help="每个查询重复次数，用于稳定延迟分位数")
+    parser.add_argument("--output", help="结果写入该文件；缺省输出到标准输出")
+    args = parser.parse_args(argv)
+
+    if args.embeddings == "onnx":
+        embedder = build_embedder("onnx")
+    else:
+        embedder = FakeEmbedder(args.dim) if args.embeddings == "fake" else None
+    api_key = load_key() if args.embeddings == "api" else None
+    if args.embeddings == "api" and not api_key:
+        parser.error("--embeddings api 需要在 api_key.env 中配置 API_KEY")
+    if args.embeddings == "api" and (os.getenv(EMBEDDING_ENV) or "remote") != "remote":
+        parser.error(f"--embeddings api 与环境变量 {EMBEDDING_ENV}={os.getenv(EMBEDDING_ENV)} 冲突")
+    report = {
+        "embeddings": args.embeddings if embedder is None else embedder.model_name,
+        "dataset": args.dataset or "builtin-sample",
+        "results": run_benchmark(
+            load_dataset(args.dataset),
+            _numbers(args.chunk_sizes, int),
+            _numbers(args.top_k, int),
+            _numbers(args.weights, float),
+            chunk_overlap=args.chunk_overlap,
+            embedder=embedder,
+            api_key=api_key,
+            api_url=args.api_url,
+            repeat=max(args.repeat, 1),
+            prefix_dims=_numbers(args.prefix_dims, int) or [0],
+        ),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""内容寻址的本地 blob 存储：文档全文与智能体输出按 SHA-256 落盘，会话状态中只保留哈希与元数据。"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+DEFAULT_BLOB_DIR = ".eda_qa_blobs"
+BLOB_DIR_ENV = "EDA_QA_BLOB_DIR"
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+_BLOCK_SIZE = 1 << 20
+
+
+class BlobStore:
+    """相同内容只存一份，多个会话上传同一文档时共享；写入先落临时文件再原子替换。"""
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.getenv(BLOB_DIR_ENV, DEFAULT_BLOB_DIR))
+
+    def _path(self, digest):
+        if not _DIGEST.match(str(digest)):
+            raise ValueError(f"无效的 blob 哈希：{digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def exists(self, digest):
+        return os.path.exists(self._path(digest))
+
+    def size(self, digest):
+        return os.path.getsize(self._path(digest))
+
+    def _write(self, fill):
+        """fill(二进制文件) 写入临时文件，按内容哈希落到最终位置；已存在则丢弃临时文件。"""
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            sha = hashlib.sha256()
+            with os.fdopen(fd, "w+b") as f:
+                fill(f)
+                f.seek(0)
+                for block in iter(lambda: f.read(_BLOCK_SIZE), b""):
+                    sha.update(block)
+            digest = sha.hexdigest()
+            path = self._path(digest)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            return digest
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_bytes(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        if self.exists(digest):
+            return digest
+        return self._write(lambda f: f.write(data))
+
+    def put_stream(self, write):
+        """write(文本流) 逐段写出内容（如导出文件），整体不在内存中拼接。"""
+        def fill(f):
+            with open(f.fileno(), "w", encoding="utf-8", closefd=False) as text:
+                write(text)
+
+        return self._write(fill)
+
+    def put_text(self, text):
+        return self.put_bytes(str(text).encode("utf-8"))
+
+    def put_json(self, obj):
+        # 键排序保证相同内容得到相同哈希
+        return self.put_text(json.dumps(obj, ensure_ascii=False, sort_keys=True))
+
+    def open(self, digest):
+        return open(self._path(digest), "rb")
+
+    def get_bytes(self, digest):
+        with self.open(digest) as f:
+            return f.read()
+
+    def get_text(self, digest):
+        return self.get_bytes(digest).decode("utf-8")
+
+    def get_json(self, digest):
+        with self.open(digest) as f:
+            return json.load(f)
+
+
+def write_json_array(text, items):
+    """以 JSON 数组形式逐项写出 items（可为生成器）。"""
+    text.write("[")
+    for i, item in enumerate(items):
+        text.write(",\n" if i else "\n")
+        json.dump(item, text, ensure_ascii=False, indent=2)
+    text.write("\n]")
@@ -0,0 +1,128 @@
+"""多轮对话记忆：在 token 预算内保留滚动摘要，追问同一主题时复用上一轮检索结果。"""
+
+import re
+
+from hybrid_index import tokenize
+from reranker import estimate_tokens, select_within_budget
+
+DEFAULT_MEMORY_TOKEN_BUDGET = 600
+DEFAULT_RECENT_TURNS = 2
+# 问题词项被上一轮问题与检索片段覆盖的比例达到该值时视为同一主题
+REUSE_COVERAGE = 0.6
+SHORT_FOLLOW_UP_TOKENS = 16
+
+_FOLLOW_UP_MARKERS = ("它", "这个", "那个", "上述", "上面", "刚才", "前面", "继续", "还有", "另外", "那么", "其中", "该")
+_STOP_TERMS = {"什么", "如何", "怎么", "为什", "是否", "可以", "一下", "哪些", "有没", "没有", "请问", "这个", "那个"}
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;\n])")
+
+
+def _terms(text):
+    return {term for term in tokenize(text) if term not in _STOP_TERMS}
+
+
+def _first_sentence(text, limit=80):
+    text = str(text).strip()
+    sentence = next((s.strip() for s in _SENTENCE_END.split(text) if s.strip()), "")
+    return sentence[:limit]
+
+
+def with_context(question, context):
+    """把对话背景拼到问题前；无背景时原样返回。"""
+    if not context:
+        return question
+    return f"对话背景（此前对话摘要）：\n{context}\n\n当前问题：{question}"
+
+
+class ConversationMemory:
+    """单个会话的记忆：最近几轮保留要点，更早的轮次压缩为一行摘要，整体不超过 token_budget。"""
+
+    def __init__(self, token_budget=DEFAULT_MEMORY_TOKEN_BUDGET, recent_turns=DEFAULT_RECENT_TURNS):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.clear()
+
+    def clear(self):
+        self.turns = []
+        self.summary = []
+        self.last_question = ""
+        self.last_candidates = None
+        self.reused = 0
+
+    def __len__(self):
+        return len(self.summary) + len(self.turns)
+
+    def is_follow_up(self, question):
+        """判断是否为同一主题的追问：短问题带指代词，或词项大多已被上一轮覆盖。"""
+        if not self.last_question:
+            return False
+        question = str(question)
+        if estimate_tokens(question) <= SHORT_FOLLOW_UP_TOKENS and any(m in question for m in _FOLLOW_UP_MARKERS):
+            return True
+        terms = _terms(question)
+        if not terms:
+            return False
+        covered = _terms(self.last_question)
+        for item in self.last_candidates or []:
+            covered |= _terms(item["text"] if isinstance(item, dict) else item)
+        return len(terms & covered) / len(terms) >= REUSE_COVERAGE
+
+    def reusable_candidates(self, question):
+        """同一主题追问时返回上一轮的检索候选，否则返回 None。"""
+        if self.last_candidates and self.is_follow_up(question):
+            self.reused += 1
+            return list(self.last_candidates)
+        return None
+
+    def retrieval_query(self, question):
+        """追问需重新检索时带上上一轮问题，补全被省略的主语。"""
+        if self.is_follow_up(question):
+            return f"{self.last_question} {question}"
+        return question
+
+    def _render_turn(self, turn):
+        return f"问：{turn['question']}\n要点：{turn['points']}"
+
+    def context(self):
+        """返回注入提示词的对话背景文本。"""
+        parts = []
+        if self.summary:
+            parts.append("更早的对话：\n" + "\n".join(f"- {line}" for line in self.summary))
+        parts.extend(self._render_turn(turn) for turn in self.turns)
+        return "\n".join(parts)
+
+    def _fold_oldest_turn(self):
+        turn = self.turns.pop(0)
+        self.summary.append(f"{turn['question'][:60]}：{_first_sentence(turn['points'])}")
+
+    def _compress(self):
+        while len(self.turns) > self.recent_turns:
+            self._fold_oldest_turn()
+        while self.turns and estimate_tokens(self.context()) > self.token_budget:
+            if len(self.turns) > 1:
+                self._fold_oldest_turn()
+            elif self.summary:
+                self.summary.pop(0)
+            else:
+                # 只剩一轮仍超预算时截断要点
+                turn = self.turns[0]
+                budget = max(self.token_budget - estimate_tokens(turn["question"]), 1)
+                turn["points"] = "".join(select_within_budget([turn["points"]], budget))
+                break
+        while self.summary and estimate_tokens(self.context()) > self.token_budget:
+            self.summary.pop(0)
+
+    def record(self, question, answer, key_points="", candidates=None):
+        """记录一轮问答；要点优先使用关键信息提取专家的输出，缺失时取回答首句。"""
+        points = str(key_points or "").strip() or _first_sentence(answer, limit=200)
+        self.turns.append({"question": str(question).strip(), "points": points})
+        self.last_question = str(question).strip()
+        self.last_candidates = list(candidates) if candidates else None
+        self._compress()
+
+    def snapshot(self):
+        return {
+            "turns": len(self),
+            "context_tokens": estimate_tokens(self.context()),
+            "token_budget": self.token_budget,
+            "reused_retrievals": self.reused,
+        }
@@ -0,0 +1,142 @@
+"""端到端时间预算：contextvars 传递本次问答的截止时间，检索、各智能体步骤与每次 HTTP 调用按剩余时间设置超时。
+
+环境变量 EDA_QA_DEADLINE 为每个问题的默认预算（秒），未设置时不限时。
+用法：
+    with deadlines.start(60):
+        ...                                  # 其中的 HTTP 调用超时不超过剩余时间
+        with deadlines.limit(fraction=0.2):  # 子预算：最多用总预算的 20%
+            ...
+        with deadlines.limit(reserve=15):    # 子预算：为后续步骤留出 15 秒
+            ...
+子预算的截止时间不晚于外层；跨 await 与经 contextvars.copy_context() 进入线程池时同样有效。
+"""
+
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+DEADLINE_ENV = "EDA_QA_DEADLINE"
+
+_current = contextvars.ContextVar("eda_qa_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """时间预算已用完。"""
+
+
+class Deadline:
+    """一个截止时间；子预算共享根预算的总时长与跳过记录。"""
+
+    def __init__(self, seconds, expires=None, parent=None):
+        self.seconds = float(seconds)
+        self.started = time.monotonic() if parent is None else parent.started
+        self.expires = self.started + self.seconds if expires is None else expires
+        self.skipped = [] if parent is None else parent.skipped
+
+    def remaining(self):
+        return max(self.expires - time.monotonic(), 0.0)
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+def default_seconds():
+    try:
+        return float(os.getenv(DEADLINE_ENV) or 0) or None
+    except ValueError:
+        return None
+
+
+@contextmanager
+def start(seconds):
+    """开始一次限时调用；seconds 为空或 0 时不限时（yield None）。已在限时范围内时取两者中较早的截止时间。"""
+    if not seconds or seconds <= 0:
+        yield None
+        return
+    outer = _current.get()
+    deadline = Deadline(seconds)
+    if outer is not None and outer.expires < deadline.expires:
+        deadline.expires = outer.expires
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def limit(fraction=None, reserve=0.0):
+    """在当前预算内划出子预算：最多占总预算的 fraction，并为之后的步骤留出 reserve 秒；未限时时为空操作。"""
+    outer = _current.get()
+    if outer is None:
+        yield None
+        return
+    expires = outer.expires - reserve
+    if fraction is not None:
+        expires = min(expires, time.monotonic() + outer.seconds * fraction)
+    child = Deadline(outer.seconds, expires=min(expires, outer.expires), parent=outer)
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def remaining():
+    """剩余秒数；未限时返回 None。"""
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def expired():
+    deadline = _current.get()
+    return deadline is not None and deadline.expired
+
+
+def share(fraction):
+    """总预算的 fraction（秒）；未限时返回 0。"""
+    deadline = _current.get()
+    return deadline.seconds * fraction if deadline is not None else 0.0
+
+
+def short_of(seconds):
+    """剩余时间不足 seconds 秒时返回 True；未限时永远为 False。"""
+    left = remaining()
+    return left is not None and left < seconds
+
+
+def cap_timeout(timeout):
+    """HTTP 调用的超时：不超过剩余时间；预算已用完时抛出 DeadlineExceeded，不再发出请求。"""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("已超出本次问答的时间预算")
+    return left if timeout is None else min(timeout, left)
+
+
+def record_skip(step, reason):
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.skipped.append({"step": step, "reason": reason, "at_s": round(deadline.elapsed(), 3)})
+
+
+def report():
+    """{"budget_s", "elapsed_s", "skipped"}；未限时返回 None。"""
+    deadline = _current.get()
+    if deadline is None:
+        return None
+    return {
+        "budget_s": deadline.seconds,
+        "elapsed_s": round(deadline.elapsed(), 3),
+        "skipped": list(deadline.skipped),
+    }
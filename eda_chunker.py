@@ -0,0 +1,259 @@
+"""面向 EDA 文档的结构感知分块：保留标题、Tcl/SDC 命令块与表格行的完整性。"""
+
+import re
+
+DEFAULT_CHUNK_SIZE = 800
+DEFAULT_CHUNK_OVERLAP = 50
+
+BLOCK_HEADING = "heading"
+BLOCK_CODE = "code"
+BLOCK_TABLE = "table"
+BLOCK_TEXT = "text"
+
+_MD_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+\S")
+# 只把“1.2 / 3.1.4”这类多级编号与“第X章”视为标题；“1. 运行布局”等步骤列表仍是正文
+_NUM_HEADING = re.compile(r"^\s*(\d+(\.\d+){1,3}\.?|第[一二三四五六七八九十百\d]+[章节部分])\s*\S.{0,60}$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_MD_TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$")
+# 零宽切分：句间空白与换行留在下一句开头，按原样拼接可还原原文
+_SENTENCE_END = re.compile(r"(?<=[。！？；.!?;])")
+# Tcl/SDC 常见命令前缀，用于识别命令块
+_TCL_COMMAND = re.compile(
+    r"^\s*(set_\w+|create_\w+|get_\w+|report_\w+|read_\w+|write_\w+|remove_\w+|"
+    r"current_\w+|define_\w+|group_path|check_\w+|compile\w*|place_\w+|route_\w+)\b"
+)
+# 通用 Tcl 关键字需带有 $ { [ 等语法字符，避免误判英文正文
+_TCL_KEYWORD = re.compile(r"^\s*(proc|set|foreach|if|for|while|source|puts|return|lappend|expr)\s+.*[${\[]")
+
+
+def _looks_like_csv(line):
+    return line.count(",") >= 2 or line.count("\t") >= 2
+
+
+def _brace_delta(line):
+    return line.count("{") - line.count("}") + line.count("[") - line.count("]")
+
+
+def _is_command(line):
+    # 含中文句读的行视为说明文字，即使以命令名开头
+    matched = _TCL_COMMAND.match(line) or _TCL_KEYWORD.match(line)
+    return bool(matched) and not any(mark in line for mark in "。，：")
+
+
+def _is_heading(line):
+    if _MD_HEADING.match(line):
+        return True
+    stripped = line.strip()
+    if not stripped or len(stripped) > 60 or stripped.endswith(("。", "，", ",", ";", "；")):
+        return False
+    return bool(_NUM_HEADING.match(stripped)) and not _looks_like_csv(stripped)
+
+
+def split_blocks(text):
+    """按结构切分为 (类型, 文本) 块列表，块内不会被后续打包拆散（超长时除外）。"""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    blocks = []
+    i = 0
+    n = len(lines)
+    while i < n:
+        line = lines[i]
+        if not line.strip():
+            i += 1
+            continue
+        if _FENCE.match(line):
+            fence = _FENCE.match(line).group(1)
+            j = i + 1
+            while j < n and not lines[j].strip().startswith(fence):
+                j += 1
+            blocks.append((BLOCK_CODE, "\n".join(lines[i:j + 1])))
+            i = j + 1
+            continue
+        if _is_heading(line):
+            blocks.append((BLOCK_HEADING, line.strip()))
+            i += 1
+            continue
+        if _MD_TABLE_ROW.match(line):
+            j = i
+            while j < n and _MD_TABLE_ROW.match(lines[j]):
+                j += 1
+            blocks.append((BLOCK_TABLE, "\n".join(lines[i:j])))
+            i = j
+            continue
+        if _looks_like_csv(line) and i + 1 < n and _looks_like_csv(lines[i + 1]):
+            j = i
+            while j < n and lines[j].strip() and _looks_like_csv(lines[j]):
+                j += 1
+            blocks.append((BLOCK_TABLE, "\n".join(lines[i:j])))
+            i = j
+            continue
+        if _is_command(line):
+            j = i
+            depth = 0
+            while j < n:
+                current = lines[j]
+                if depth <= 0 and j > i and not _is_command(current):
+                    # 续行（反斜杠）或空行之外的普通文本结束命令块
+                    if not lines[j - 1].rstrip().endswith("\\"):
+                        break
+                if depth <= 0 and not current.strip() and not lines[j - 1].rstrip().endswith("\\"):
+                    break
+                depth += _brace_delta(current)
+                j += 1
+            blocks.append((BLOCK_CODE, "\n".join(lines[i:j]).strip("\n")))
+            i = j
+            continue
+        j = i
+        while (
+            j < n
+            and lines[j].strip()
+            and not _FENCE.match(lines[j])
+            and not _MD_TABLE_ROW.match(lines[j])
+            and not (j + 1 < n and _looks_like_csv(lines[j]) and _looks_like_csv(lines[j + 1]))
+            and not (j > i and (_is_heading(lines[j]) or _is_command(lines[j])))
+        ):
+            j += 1
+        blocks.append((BLOCK_TEXT, "\n".join(lines[i:j])))
+        i = j
+    return blocks
+
+
+def _split_statements(code):
+    """将命令块按完整语句（括号平衡且无续行）切分。"""
+    statements = []
+    current = []
+    depth = 0
+    for line in code.split("\n"):
+        current.append(line)
+        depth += _brace_delta(line)
+        if depth <= 0 and not line.rstrip().endswith("\\"):
+            statements.append("\n".join(current))
+            current = []
+            depth = 0
+    if current:
+        statements.append("\n".join(current))
+    return statements
+
+
+def _hard_split(text, size, overlap):
+    step = max(size - overlap, 1)
+    return [text[start:start + size] for start in range(0, len(text), step) if text[start:start + size].strip()]
+
+
+class EDAChunker:
+    """结构感知分块器：先按结构切块，再在 chunk_size 内贪心合并。"""
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, chunk_overlap=DEFAULT_CHUNK_OVERLAP):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size 必须为正数")
+        if chunk_overlap < 0 or chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap 必须满足 0 <= overlap < chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def _split_oversized(self, kind, text):
+        size = self.chunk_size
+        if kind == BLOCK_TABLE:
+            rows = text.split("\n")
+            # Markdown 表格的表头包含分隔行，拆分后每块都重复表头
+            header_rows = 2 if len(rows) > 1 and set(rows[1].replace("|", "").strip()) <= set("-: ") else 1
+            header = "\n".join(rows[:header_rows])
+            body = rows[header_rows:]
+            pieces, current = [], header
+            for row in body:
+                if len(current) + len(row) + 1 > size and current != header:
+                    pieces.append(current)
+                    current = header
+                current = f"{current}\n{row}"
+            pieces.append(current)
+            return [p for piece in pieces for p in (_hard_split(piece, size, self.chunk_overlap) if len(piece) > size else [piece])]
+        if kind == BLOCK_CODE:
+            units = _split_statements(text)
+        else:
+            units = [s for s in _SENTENCE_END.split(text) if s]
+        joiner = "\n" if kind == BLOCK_CODE else ""
+        pieces, current = [], []
+        for unit in units:
+            if len(unit) > size:
+                if current:
+                    pieces.append(joiner.join(current))
+                    current = []
+                pieces.extend(_hard_split(unit, size, self.chunk_overlap))
+                continue
+            if current and len(joiner.join(current + [unit])) > size:
+                pieces.append(joiner.join(current))
+                # 文本以完整句子作为尾部重叠（不超过 chunk_overlap），命令块按语句对齐不重叠
+                tail = []
+                if kind == BLOCK_TEXT:
+                    for sentence in reversed(current):
+                        if len("".join(tail)) + len(sentence) > self.chunk_overlap:
+                            break
+                        tail.insert(0, sentence)
+                current = tail if len("".join(tail + [unit])) <= size else []
+            current.append(unit)
+        if current:
+            pieces.append(joiner.join(current))
+        return pieces
+
+    def split(self, text):
+        """返回分块后的文本列表。"""
+        chunks = []
+        current = ""
+        heading = ""
+        for kind, block in split_blocks(text):
+            if kind == BLOCK_HEADING:
+                if current.strip() and current.strip() != heading:
+                    chunks.append(current)
+                    heading = block
+                elif heading and current.strip() == heading and len(heading) + 1 + len(block) <= self.chunk_size // 2:
+                    # 连续标题（章 → 节）合并为一个标题前缀，不丢弃上一级标题
+                    heading = f"{heading}\n{block}"
+                else:
+                    heading = block
+                current = heading
+                continue
+            parts = [block] if len(block) <= self.chunk_size else self._split_oversized(kind, block)
+            for part in parts:
+                if current and len(current) + 2 + len(part) <= self.chunk_size:
+                    current = f"{current}\n\n{part}"
+                    continue
+                if current.strip() and current.strip() != heading:
+                    chunks.append(current)
+                # 续块携带所属标题，保持上下文但不超过 chunk_size
+                if heading and len(heading) + 2 + len(part) <= self.chunk_size:
+                    current = f"{heading}\n\n{part}"
+                else:
+                    current = part
+        if current.strip() and current.strip() != heading:
+            chunks.append(current)
+        return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def chunk_stats(chunks):
+    """统计分块数量与长度分布。"""
+    lengths = [len(chunk) for chunk in chunks]
+    if not lengths:
+        return {"count": 0, "total_chars": 0, "avg_chars": 0, "min_chars": 0, "max_chars": 0}
+    return {
+        "count": len(lengths),
+        "total_chars": sum(lengths),
+        "avg_chars": round(sum(lengths) / len(lengths), 1),
+        "min_chars": min(lengths),
+        "max_chars": max(lengths),
+    }
+
+
+def merge_chunk_stats(total, stats):
+    """累加多份文本的分块统计。"""
+    if not total or not total.get("count"):
+        return dict(stats)
+    if not stats.get("count"):
+        return dict(total)
+    count = total["count"] + stats["count"]
+    chars = total["total_chars"] + stats["total_chars"]
+    return {
+        "count": count,
+        "total_chars": chars,
+        "avg_chars": round(chars / count, 1),
+        "min_chars": min(total["min_chars"], stats["min_chars"]),
+        "max_chars": max(total["max_chars"], stats["max_chars"]),
+    }
@@ -0,0 +1,161 @@
+"""向量化提供方：VectorStorage.embedder 的可选实现，本地 CPU 计算，不经过远程 embedding 接口。
+
+环境变量 EDA_QA_EMBEDDINGS 选择默认提供方：
+    remote    （默认）调用 OpenAI 兼容的 /embeddings 接口，由 VectorStorage 内置的同步 / 异步客户端完成
+    hashing   特征哈希向量，纯 numpy、无需模型，适合离线演示与评测
+    onnx      本地 ONNX 向量模型，目录由 EDA_QA_ONNX_MODEL 指定（含 model.onnx 与 tokenizer.json），
+              需安装 onnxruntime 与 tokenizers
+不同提供方的向量不在同一空间，model_name 会代替向量模型名参与索引 / 快照的一致性检查。
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from hybrid_index import tokenize
+
+EMBEDDING_ENV = "EDA_QA_EMBEDDINGS"
+ONNX_MODEL_ENV = "EDA_QA_ONNX_MODEL"
+EMBEDDING_KINDS = ["remote", "hashing", "onnx"]
+HASHING_DIM = 256
+DEFAULT_BATCH_SIZE = 32
+EMBEDDING_WORKERS = 4
+ONNX_POOLING = ("mean", "cls", "last")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS, thread_name_prefix="embed")
+        return _pool
+
+
+def hash_embedding(text, dim=HASHING_DIM):
+    """确定性的特征哈希向量：词项经 MD5 映射到带符号的桶，跨进程、跨平台结果一致。"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokenize(text):
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    return vector
+
+
+class BaseEmbedder:
+    """提供方基类：子类实现 _embed_batch(texts) -> (n, dim) 数组；调用时按 batch_size 分批，多批在线程池中并行。"""
+
+    model_name = None
+    batch_size = DEFAULT_BATCH_SIZE
+
+    def _embed_batch(self, texts):
+        raise NotImplementedError
+
+    def embed(self, texts):
+        texts = [str(text) for text in texts]
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            results = [self._embed_batch(batches[0])]
+        else:
+            results = list(_get_pool().map(self._embed_batch, batches))
+        return [np.asarray(vector, dtype=np.float32) for result in results for vector in result]
+
+    def __call__(self, texts):
+        return self.embed(texts)
+
+
+class HashingEmbedder(BaseEmbedder):
+    """特征哈希向量（与评测脚本的离线向量相同），只捕捉词项重合，语义召回弱于模型向量。"""
+
+    def __init__(self, dim=HASHING_DIM):
+        self.dim = dim
+        self.model_name = f"hashing-{dim}"
+
+    def _embed_batch(self, texts):
+        return [hash_embedding(text, self.dim) for text in texts]
+
+
+class OnnxEmbedder(BaseEmbedder):
+    """本地 ONNX 向量模型（如导出的 bge-small-zh、Qwen3-Embedding）；pooling 为 mean / cls / last，
+    模型输出已是句向量（二维）时直接使用。onnxruntime 会话可被多个线程同时调用。"""
+
+    def __init__(self, model_dir, pooling="mean", max_length=512, batch_size=16, model_name=None, threads=None):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("本地 ONNX 向量模型需要安装 onnxruntime 与 tokenizers") from e
+        if pooling not in ONNX_POOLING:
+            raise ValueError(f"未知的池化方式：{pooling}，可选 {', '.join(ONNX_POOLING)}")
+        self.pooling = pooling
+        self.batch_size = batch_size
+        self.model_name = model_name or f"onnx:{os.path.basename(os.path.normpath(model_dir))}"
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.no_padding()
+        options = ort.SessionOptions()
+        # 多批并行时每个会话调用分到的线程数，避免超订 CPU
+        options.intra_op_num_threads = threads or max((os.cpu_count() or 1) // EMBEDDING_WORKERS, 1)
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+
+    def _embed_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        length = max(len(encoding.ids) for encoding in encodings)
+        ids = np.zeros((len(texts), length), dtype=np.int64)
+        mask = np.zeros((len(texts), length), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            ids[row, :len(encoding.ids)] = encoding.ids
+            mask[row, :len(encoding.ids)] = 1
+        feeds = {
+            "input_ids": ids,
+            "attention_mask": mask,
+            "token_type_ids": np.zeros_like(ids),
+            "position_ids": np.broadcast_to(np.arange(length, dtype=np.int64), ids.shape).copy(),
+        }
+        hidden = self.session.run(None, {name: value for name, value in feeds.items() if name in self.input_names})[0]
+        if hidden.ndim == 2:
+            vectors = hidden
+        elif self.pooling == "cls":
+            vectors = hidden[:, 0]
+        elif self.pooling == "last":
+            # 右侧填充，取每行最后一个有效 token
+            vectors = hidden[np.arange(len(texts)), mask.sum(axis=1) - 1]
+        else:
+            vectors = (hidden * mask[..., None]).sum(axis=1) / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+def build_embedder(kind=None, model_dir=None):
+    """按名称创建（并在进程内复用）提供方；remote 或空值返回 None，表示使用 VectorStorage 内置的远程接口。"""
+    kind = (kind or "remote").strip().lower()
+    if kind == "remote":
+        return None
+    if kind == "hashing":
+        key = (kind, None)
+    elif kind == "onnx":
+        model_dir = model_dir or os.getenv(ONNX_MODEL_ENV)
+        if not model_dir:
+            raise ValueError(f"使用 onnx 向量模型需设置 {ONNX_MODEL_ENV} 为模型目录")
+        key = (kind, os.path.abspath(model_dir))
+    else:
+        raise ValueError(f"未知的向量提供方：{kind}，可选 {', '.join(EMBEDDING_KINDS)}")
+    with _embedders_lock:
+        if key not in _embedders:
+            _embedders[key] = HashingEmbedder() if kind == "hashing" else OnnxEmbedder(model_dir)
+        return _embedders[key]
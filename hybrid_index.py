@@ -0,0 +1,168 @@
+"""向量 + BM25 混合检索索引，使用加权 RRF（Reciprocal Rank Fusion）融合两路排名。"""
+
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+RANK_SMOOTHING_FACTOR = 60
+# 两阶段检索：先在向量前 prefix_dim 维上粗排，取 top_k × PREFIX_CANDIDATE_FACTOR（至少 MIN_PREFIX_CANDIDATES）个候选用全维重排
+PREFIX_CANDIDATE_FACTOR = 10
+MIN_PREFIX_CANDIDATES = 100
+
+_ASCII_TOKEN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+(?:\.\d+)?")
+_CJK_RUN = re.compile(r"[\u4e00-\u9fff]+")
+
+
+def tokenize(text):
+    """英文与 Tcl/SDC 标识符按词切分（小写），中文按相邻二字切分。"""
+    text = str(text)
+    tokens = [token.lower() for token in _ASCII_TOKEN.findall(text)]
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25:
+    """基于倒排表的 BM25 打分。"""
+
+    def __init__(self, docs_tokens, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_count = len(docs_tokens)
+        self.doc_lengths = np.array([len(tokens) for tokens in docs_tokens], dtype=np.float32)
+        self.avg_length = float(self.doc_lengths.mean()) if self.doc_count else 0.0
+        self.postings = {}
+        for doc_id, tokens in enumerate(docs_tokens):
+            for term, freq in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((doc_id, freq))
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+
+    def scores(self, query_tokens):
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        if not self.doc_count or not self.avg_length:
+            return scores
+        for term in set(query_tokens):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_id, freq in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        return scores
+
+
+def _ranks(scores, order=None):
+    """返回每个文档在降序排列中的名次（从 1 开始）；order 为已排好的文档顺序时直接使用。"""
+    if order is None:
+        order = np.argsort(-scores, kind="stable")
+    ranks = np.empty(len(scores), dtype=np.float32)
+    ranks[order] = np.arange(1, len(scores) + 1, dtype=np.float32)
+    return ranks
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class HybridIndex:
+    """一次构建、多次查询的混合索引；weight 为向量路的 RRF 权重（1.0 为纯向量，0.0 为纯 BM25）。
+
+    prefix_dim 开启两阶段向量检索（Matryoshka 截断维度，如 Qwen3-Embedding 的前 128 / 256 维）：
+    粗排只扫描紧凑的前缀矩阵，候选再用全维向量重排。
+    """
+
+    prefix_dim = None
+    prefix_matrix = None
+
+    def __init__(self, chunks, vectors, prefix_dim=None):
+        self.chunks = list(chunks)
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or len(matrix) != len(self.chunks):
+            raise ValueError("向量数量与文本块数量不一致")
+        self.matrix = _normalize_rows(matrix)
+        self.bm25 = BM25([tokenize(chunk) for chunk in self.chunks])
+        self.set_prefix_dim(prefix_dim)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def set_prefix_dim(self, prefix_dim):
+        """设置粗排维度；为空或不小于全维时关闭两阶段检索。前缀重新归一化后单独存为连续矩阵。"""
+        prefix_dim = int(prefix_dim or 0)
+        if prefix_dim <= 0 or prefix_dim >= self.matrix.shape[1]:
+            self.prefix_dim = None
+            self.prefix_matrix = None
+            return
+        if prefix_dim != self.prefix_dim:
+            self.prefix_matrix = np.ascontiguousarray(_normalize_rows(np.asarray(self.matrix[:, :prefix_dim])))
+            self.prefix_dim = prefix_dim
+
+    def _vector_scores(self, query, top_k):
+        """向量路得分与名次。两阶段时候选按全维相似度排在最前，其余文档沿用前缀相似度的顺序。"""
+        norm = np.linalg.norm(query)
+        query = query / norm if norm else query
+        if self.prefix_matrix is None:
+            similarity = self.matrix @ query
+            return similarity, _ranks(similarity)
+        prefix = query[:self.prefix_dim]
+        prefix_norm = np.linalg.norm(prefix)
+        similarity = self.prefix_matrix @ (prefix / prefix_norm if prefix_norm else prefix)
+        count = min(max(top_k * PREFIX_CANDIDATE_FACTOR, MIN_PREFIX_CANDIDATES), len(similarity))
+        # 排序后按行号顺序读取候选行，快照以内存映射加载时不会触及其余全维向量
+        candidates = np.sort(np.argpartition(-similarity, count - 1)[:count])
+        exact = np.asarray(self.matrix[candidates]) @ query
+        similarity[candidates] = exact
+        rest = np.ones(len(similarity), dtype=bool)
+        rest[candidates] = False
+        remaining = np.flatnonzero(rest)
+        order = np.concatenate([
+            candidates[np.argsort(-exact, kind="stable")],
+            remaining[np.argsort(-similarity[remaining], kind="stable")],
+        ])
+        return similarity, _ranks(similarity, order)
+
+    def prefix_recall(self, query_vectors, top_k=10):
+        """两阶段向量检索的 top_k 与全维精确 top_k 的平均重合率；未开启两阶段时为 1.0。"""
+        if self.prefix_matrix is None or not len(self.chunks):
+            return 1.0
+        k = min(top_k, len(self.chunks))
+        overlaps = []
+        for query_vector in query_vectors:
+            query = np.asarray(query_vector, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            exact = np.argsort(-(self.matrix @ (query / norm if norm else query)), kind="stable")[:k]
+            _, ranks = self._vector_scores(query, top_k)
+            overlaps.append(len(set(exact.tolist()) & set(np.flatnonzero(ranks <= k).tolist())) / k)
+        return float(np.mean(overlaps)) if overlaps else 1.0
+
+    def search(self, query_vector, query_text, top_k=3, weight=0.7):
+        """返回按融合得分降序的 [{"index", "text", "score", "similarity"}]。"""
+        if not self.chunks:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        similarity, ranks = self._vector_scores(query, top_k)
+        fused = weight / (RANK_SMOOTHING_FACTOR + ranks)
+        if weight < 1.0:
+            lexical = self.bm25.scores(tokenize(query_text))
+            fused += (1.0 - weight) / (RANK_SMOOTHING_FACTOR + _ranks(lexical))
+        top = np.argsort(-fused, kind="stable")[:top_k]
+        return [
+            {
+                "index": int(idx),
+                "text": self.chunks[idx],
+                "score": float(fused[idx]),
+                "similarity": float(similarity[idx]),
+            }
+            for idx in top
+        ]
@@ -0,0 +1,241 @@
+"""只读索引快照：向量矩阵、BM25 倒排表与文本块写成不可变的版本目录，以内存映射方式只读加载。
+
+多个 Streamlit / 服务进程（以及挂载同一共享目录的多台机器）加载同一版本时共用操作系统页缓存中的一份数据，
+不再各自持有整份知识库。目录结构：
+    <root>/CURRENT              当前版本名，发布新版本时原子替换
+    <root>/v000001/manifest.json  格式版本、向量模型、块数、维度、BM25 参数、引用的表格
+    <root>/v000001/*.npy|*.bin    vectors（已归一化）、文本块、倒排表
+"""
+
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from hybrid_index import HybridIndex
+from table_store import table_ids
+
+SNAPSHOT_DIR_ENV = "EDA_QA_SNAPSHOT_DIR"
+DEFAULT_SNAPSHOT_DIR = "index_snapshots"
+FORMAT_VERSION = 1
+KEEP_VERSIONS = 3
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+_VERSION = re.compile(r"^v(\d{6})$")
+
+
+def list_versions(root):
+    """已发布的版本名（从旧到新）。"""
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if _VERSION.match(name))
+
+
+def current_version(root):
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    return version if _VERSION.match(version) else None
+
+
+def _postings_arrays(bm25):
+    """倒排表展平为 (词项列表, 区间偏移, 文档号, 词频)；已是快照时直接复用其数组。"""
+    if isinstance(bm25, MappedBM25):
+        return list(bm25.vocabulary), bm25.term_offsets, bm25.docs, bm25.freqs
+    terms = sorted(bm25.postings)
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(bm25.postings[term]) for term in terms])
+    total = int(term_offsets[-1])
+    docs = np.fromiter((doc_id for term in terms for doc_id, _ in bm25.postings[term]), dtype=np.int32, count=total)
+    freqs = np.fromiter((freq for term in terms for _, freq in bm25.postings[term]), dtype=np.float32, count=total)
+    return terms, term_offsets, docs, freqs
+
+
+def _write_files(directory, index, model):
+    """把 HybridIndex 的各部分写入 directory，返回 manifest。"""
+    count = len(index)
+    np.save(os.path.join(directory, "vectors.npy"), np.ascontiguousarray(index.matrix, dtype=np.float32))
+
+    encoded = [str(chunk).encode("utf-8") for chunk in index.chunks]
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(data) for data in encoded])
+    with open(os.path.join(directory, "chunks.bin"), "wb") as f:
+        for data in encoded:
+            f.write(data)
+    np.save(os.path.join(directory, "chunk_offsets.npy"), offsets)
+
+    bm25 = index.bm25
+    terms, term_offsets, docs, freqs = _postings_arrays(bm25)
+    np.save(os.path.join(directory, "term_offsets.npy"), term_offsets)
+    np.save(os.path.join(directory, "postings_docs.npy"), docs)
+    np.save(os.path.join(directory, "postings_freqs.npy"), freqs)
+    np.save(os.path.join(directory, "doc_lengths.npy"), np.asarray(bm25.doc_lengths, dtype=np.float32))
+    with open(os.path.join(directory, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "model": str(model),
+        "chunks": count,
+        "dim": int(index.matrix.shape[1]),
+        "terms": len(terms),
+        "k1": bm25.k1,
+        "b": bm25.b,
+        "tables": sorted({table_id for chunk in index.chunks for table_id in table_ids(chunk)}),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def _set_current(root, version):
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix=".current-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+
+def _prune(root, keep):
+    """删除较旧的版本；仍被其他进程映射的文件在 Windows 上删除失败时跳过，下次发布再清理。"""
+    current = current_version(root)
+    for version in list_versions(root)[:-keep]:
+        if version != current:
+            shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+def publish(index, root, model, keep=KEEP_VERSIONS):
+    """把已构建的 HybridIndex 发布为新版本：先写入临时目录，整体改名为版本目录后再原子切换 CURRENT。"""
+    if not len(index):
+        raise ValueError("知识库为空，无法发布快照")
+    os.makedirs(root, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=root, prefix=".publish-")
+    try:
+        manifest = _write_files(tmp_dir, index, model)
+        # 多个进程同时发布时版本号可能冲突，改名失败则顺延
+        for _ in range(10):
+            versions = list_versions(root)
+            number = int(_VERSION.match(versions[-1]).group(1)) + 1 if versions else 1
+            version = f"v{number:06d}"
+            try:
+                os.rename(tmp_dir, os.path.join(root, version))
+                break
+            except OSError:
+                continue
+        else:
+            raise OSError("快照版本号冲突，发布失败")
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    _set_current(root, version)
+    _prune(root, keep)
+    return {**manifest, "version": version}
+
+
+class ChunkView:
+    """按需从内存映射的 chunks.bin 解码文本块，行为类似只读列表。"""
+
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return bytes(self._data[start:end]).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class MappedBM25:
+    """与 hybrid_index.BM25 打分一致，倒排表为内存映射的扁平数组（按词项的区间切片）。"""
+
+    def __init__(self, terms, term_offsets, docs, freqs, doc_lengths, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.docs = docs
+        self.freqs = freqs
+        self.doc_lengths = doc_lengths
+        self.doc_count = len(doc_lengths)
+        self.avg_length = float(doc_lengths.mean()) if self.doc_count else 0.0
+
+    def scores(self, query_tokens):
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        if not self.doc_count or not self.avg_length:
+            return scores
+        for term in set(query_tokens):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+            docs, freqs = self.docs[start:end], self.freqs[start:end]
+            df = end - start
+            idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_length)
+            scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + norm)
+        return scores
+
+
+class SnapshotIndex(HybridIndex):
+    """内存映射加载的只读 HybridIndex；search 与普通索引相同。"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"不支持的快照格式：{self.manifest.get('format')}")
+        self.directory = directory
+        self.version = os.path.basename(os.path.normpath(directory))
+
+        def mapped(name):
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+
+        self.matrix = mapped("vectors.npy")
+        chunk_path = os.path.join(directory, "chunks.bin")
+        # 长度为 0 的文件无法映射
+        chunk_data = np.memmap(chunk_path, dtype=np.uint8, mode="r") if os.path.getsize(chunk_path) else b""
+        self.chunks = ChunkView(chunk_data, mapped("chunk_offsets.npy"))
+        with open(os.path.join(directory, "terms.json"), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        self.bm25 = MappedBM25(
+            terms,
+            mapped("term_offsets.npy"),
+            mapped("postings_docs.npy"),
+            mapped("postings_freqs.npy"),
+            mapped("doc_lengths.npy"),
+            k1=self.manifest["k1"],
+            b=self.manifest["b"],
+        )
+        if len(self.chunks) != self.manifest["chunks"] or self.matrix.shape[0] != self.manifest["chunks"]:
+            raise ValueError(f"快照 {self.version} 不完整")
+
+    @property
+    def model(self):
+        return self.manifest["model"]
+
+
+def open_snapshot(root, version=None):
+    """打开指定版本（缺省为 CURRENT）；没有已发布版本时返回 None。"""
+    version = version or current_version(root)
+    if version is None:
+        return None
+    return SnapshotIndex(os.path.join(root, version))
@@ -0,0 +1,381 @@
+"""多端点 / 多模型路由：按观测延迟选择端点，429/5xx/choices 为空时熔断并自动故障转移，可选对冲请求削减长尾延迟。"""
+
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import numpy as np
+
+from api_client import APIError, get_async_client, get_client, get_pacer, parse_retry_after
+
+TIER_DEFAULT = "default"
+TIER_LIGHT = "light"
+# 仅供显式指定该模型的智能体使用，不参与默认/轻量层级的选择
+TIER_PINNED = "pinned"
+
+# 这些错误与具体端点/模型/密钥相关，换一个端点可能成功
+FAILOVER_STATUS = {401, 403, 404, 408, 409, 425, 429, 500, 502, 503, 504}
+AUTH_STATUS = {401, 403}
+HEDGE_ENV = "EDA_QA_HEDGE"
+HEDGE_WORKERS = 16
+
+
+def _should_failover(exc):
+    # status_code 为空表示网络错误、超时或 choices 为空
+    return exc.status_code is None or exc.status_code in FAILOVER_STATUS or exc.status_code == 200
+
+
+class Endpoint:
+    """一个 (地址, 密钥, 模型) 组合及其健康状态。"""
+
+    def __init__(self, api_url, api_key, model, tier=TIER_DEFAULT):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.tier = tier
+        self.ewma_latency = None
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        host = urlparse(str(self.api_url)).netloc or str(self.api_url)
+        return f"{self.model}@{host}#{str(self.api_key)[-4:]}"
+
+    def is_open(self, now=None):
+        return (now or time.monotonic()) < self.open_until
+
+    def record_success(self, latency, alpha=0.3):
+        with self._lock:
+            self.calls += 1
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+            if self.ewma_latency is None:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency = alpha * latency + (1 - alpha) * self.ewma_latency
+
+    def record_failure(self, exc, failure_threshold, cooldown):
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+            self.consecutive_failures += 1
+            retry_after = parse_retry_after(exc.headers)
+            if exc.status_code in AUTH_STATUS:
+                pause = cooldown * 10
+            elif retry_after is not None:
+                pause = retry_after
+            elif exc.status_code == 429 or self.consecutive_failures >= failure_threshold:
+                # 连续失败时指数退避，上限 10 倍冷却时间
+                pause = cooldown * min(2 ** max(self.consecutive_failures - failure_threshold, 0), 10)
+            else:
+                return
+            self.open_until = max(self.open_until, time.monotonic() + pause)
+
+    def snapshot(self):
+        pacing = get_pacer(self.api_url, self.api_key, self.model).snapshot()
+        now = time.monotonic()
+        return {
+            "endpoint": self.name,
+            "model": self.model,
+            "tier": self.tier,
+            "ewma_latency": round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+            "calls": self.calls,
+            "errors": self.errors,
+            "circuit": "open" if self.is_open(now) else "closed",
+            "open_for": round(max(self.open_until - now, 0.0), 1),
+            "pacing_interval": pacing["interval"],
+            "paced_for": pacing["blocked_for"],
+            "quota_remaining": pacing["remaining"],
+        }
+
+
+class HedgePolicy:
+    """对冲请求：调用耗时超过该模型近期延迟的 percentile 分位数仍未返回时，向另一个端点（只有一个端点时为同一端点）
+    再发一次，取先成功的结果并取消另一个。budget 为对冲请求占总请求数的上限（令牌桶，最多积攒 burst 次），避免放大负载。"""
+
+    def __init__(self, percentile=95, budget=0.1, burst=5, min_samples=20, window=200, min_delay=0.5):
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = {}
+        self._window = window
+        self._tokens = float(burst)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def record(self, model, latency):
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=self._window)).append(latency)
+
+    def delay(self, model):
+        """触发对冲前的等待时间；该模型样本不足时返回 None（不对冲）。每次调用计一次请求并补充预算。"""
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self._tokens + self.budget, self.burst)
+            samples = self._latencies.get(model)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            return max(float(np.percentile(samples, self.percentile)), self.min_delay)
+
+    def try_acquire(self):
+        with self._lock:
+            if self._tokens < 1.0:
+                self.skipped += 1
+                return False
+            self._tokens -= 1.0
+            self.hedged += 1
+            return True
+
+    def record_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self):
+        with self._lock:
+            thresholds = {
+                model: round(max(float(np.percentile(samples, self.percentile)), self.min_delay), 3)
+                for model, samples in self._latencies.items()
+                if len(samples) >= self.min_samples
+            }
+            return {
+                "percentile": self.percentile,
+                "budget": self.budget,
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "skipped_by_budget": self.skipped,
+                "hedge_rate": round(self.hedged / self.requests, 3) if self.requests else None,
+                "thresholds": thresholds,
+            }
+
+
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _get_hedge_pool():
+    # 同步调用的对冲在线程池中进行；落败的请求无法中断，结果被丢弃
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+        return _hedge_pool
+
+
+class ModelRouter:
+    """在多个端点间分发对话请求；延迟最低的健康端点优先，少量随机探索以刷新延迟估计。"""
+
+    def __init__(self, endpoints, failure_threshold=3, cooldown=30.0, explore=0.1, max_attempts=4, hedging=None):
+        if not endpoints:
+            raise ValueError("至少需要一个模型端点")
+        self.endpoints = list(endpoints)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.explore = explore
+        # 全局限流时逐个试遍所有端点只会放大压力，故障转移次数设上限
+        self.max_attempts = max_attempts
+        # HedgePolicy 实例；为 None 时不对冲
+        self.hedging = hedging
+
+    def candidates(self, tier=None, model=None):
+        """按优先级返回候选端点：匹配模型/层级的健康端点 → 其他健康端点 → 熔断中的端点。"""
+        pool = [ep for ep in self.endpoints if model is None or ep.model == model]
+        pool = [ep for ep in pool if ep.tier == (tier or TIER_DEFAULT)] or pool or self.endpoints
+        now = time.monotonic()
+        healthy = [ep for ep in pool if not ep.is_open(now)]
+        # 未测过延迟的端点视为 0，保证每个端点都能被试到
+        healthy.sort(key=lambda ep: ep.ewma_latency or 0.0)
+        if len(healthy) > 1 and random.random() < self.explore:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        others = [ep for ep in self.endpoints if ep not in pool and not ep.is_open(now)]
+        others.sort(key=lambda ep: ep.ewma_latency or 0.0)
+        tripped = sorted((ep for ep in self.endpoints if ep.is_open(now)), key=lambda ep: ep.open_until)
+        return (healthy + others + tripped)[:self.max_attempts]
+
+    def _attempts(self, tier, model, throttled):
+        """依次产出候选端点；候选用尽后重试被限流的端点（等待由限流节奏负责），总次数不超过 max_attempts。"""
+        queue = self.candidates(tier, model)
+        for attempt in range(self.max_attempts):
+            if attempt < len(queue):
+                yield queue[attempt]
+            elif throttled:
+                yield throttled.pop(0)
+            else:
+                return
+
+    def _on_error(self, endpoint, exc, errors, throttled):
+        endpoint.record_failure(exc, self.failure_threshold, self.cooldown)
+        errors.append(f"{endpoint.name}: {exc}")
+        print(f"模型端点 {endpoint.name} 调用失败，尝试下一个：{exc}")
+        if exc.status_code == 429:
+            throttled.append(endpoint)
+        return _should_failover(exc)
+
+    def _exhausted(self, errors, last_exc):
+        raise APIError(
+            "所有模型端点均不可用：" + "；".join(errors),
+            status_code=last_exc.status_code if last_exc else None,
+            headers=last_exc.headers if last_exc else None,
+        )
+
+    def _backup(self, endpoint, tier, model):
+        """对冲请求的目标：同层级中另一个健康端点，没有时用同一端点。"""
+        others = [ep for ep in self.candidates(tier, model) if ep is not endpoint and not ep.is_open()]
+        return others[0] if others else endpoint
+
+    def _settle(self, outcomes, errors, throttled):
+        """处理一次（可能含对冲的）调用的结果：有成功的返回它，失败的逐个记录；都失败且不应故障转移时抛出。"""
+        winner = next(((ep, result) for ep, result, exc in outcomes if exc is None), None)
+        for endpoint, _, exc in outcomes:
+            if exc is not None and not self._on_error(endpoint, exc, errors, throttled) and winner is None:
+                raise exc
+        if winner is None:
+            return None
+        endpoint, result = winner
+        endpoint.record_success(result["latency"])
+        if self.hedging is not None:
+            self.hedging.record(endpoint.model, result["latency"])
+        result["endpoint"] = endpoint.name
+        return result
+
+    @staticmethod
+    def _request(endpoint, messages, timeout, params):
+        try:
+            result = get_client(endpoint.api_url, endpoint.api_key).chat(
+                endpoint.model, messages, timeout=timeout, **params
+            )
+            return endpoint, result, None
+        except APIError as e:
+            return endpoint, None, e
+
+    @staticmethod
+    async def _arequest(endpoint, messages, timeout, params):
+        try:
+            result = await get_async_client(endpoint.api_url, endpoint.api_key).chat(
+                endpoint.model, messages, timeout=timeout, **params
+            )
+            return endpoint, result, None
+        except APIError as e:
+            return endpoint, None, e
+
+    def _call(self, endpoint, tier, model, messages, timeout, params):
+        delay = self.hedging.delay(endpoint.model) if self.hedging is not None else None
+        if delay is None:
+            return [self._request(endpoint, messages, timeout, params)]
+        pool = _get_hedge_pool()
+        primary = pool.submit(contextvars.copy_context().run, self._request, endpoint, messages, timeout, params)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.hedging.try_acquire():
+            return [primary.result()]
+        backup = self._backup(endpoint, tier, model)
+        hedge = pool.submit(contextvars.copy_context().run, self._request, backup, messages, timeout, params)
+        outcomes = []
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcome = future.result()
+                outcomes.append(outcome)
+                if outcome[2] is None:
+                    if future is hedge:
+                        self.hedging.record_win()
+                    # 同步请求无法中途取消，落败的调用在后台结束后被丢弃
+                    for other in pending:
+                        other.cancel()
+                    return outcomes
+        return outcomes
+
+    async def _acall(self, endpoint, tier, model, messages, timeout, params):
+        delay = self.hedging.delay(endpoint.model) if self.hedging is not None else None
+        if delay is None:
+            return [await self._arequest(endpoint, messages, timeout, params)]
+        primary = asyncio.ensure_future(self._arequest(endpoint, messages, timeout, params))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self.hedging.try_acquire():
+                return [await primary]
+            hedge = asyncio.ensure_future(self._arequest(self._backup(endpoint, tier, model), messages, timeout, params))
+            tasks.append(hedge)
+            outcomes = []
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    outcome = task.result()
+                    outcomes.append(outcome)
+                    if outcome[2] is None:
+                        if task is hedge:
+                            self.hedging.record_win()
+                        return outcomes
+            return outcomes
+        finally:
+            # 取消落败（或调用方被取消时仍在进行）的请求，httpx 会关闭对应连接
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def complete(self, messages, tier=None, model=None, timeout=None, **params):
+        errors = []
+        throttled = []
+        last_exc = None
+        for endpoint in self._attempts(tier, model, throttled):
+            outcomes = self._call(endpoint, tier, model, messages, timeout, params)
+            last_exc = next((exc for _, _, exc in outcomes if exc is not None), last_exc)
+            result = self._settle(outcomes, errors, throttled)
+            if result is not None:
+                return result
+        self._exhausted(errors, last_exc)
+
+    async def acomplete(self, messages, tier=None, model=None, timeout=None, **params):
+        errors = []
+        throttled = []
+        last_exc = None
+        for endpoint in self._attempts(tier, model, throttled):
+            outcomes = await self._acall(endpoint, tier, model, messages, timeout, params)
+            last_exc = next((exc for _, _, exc in outcomes if exc is not None), last_exc)
+            result = self._settle(outcomes, errors, throttled)
+            if result is not None:
+                return result
+        self._exhausted(errors, last_exc)
+
+    def add_model(self, model, tier=TIER_PINNED):
+        """为尚未配置的模型按现有 (地址, 密钥) 组合生成端点；已存在时不重复添加。"""
+        if any(ep.model == model for ep in self.endpoints):
+            return False
+        pairs = dict.fromkeys((ep.api_url, ep.api_key) for ep in self.endpoints)
+        self.endpoints.extend(Endpoint(url, key, model, tier=tier) for url, key in pairs)
+        return True
+
+    def stats(self):
+        return [ep.snapshot() for ep in self.endpoints]
+
+
+def build_router(api_url, api_keys, model, fallback_models=(), light_models=(), hedging=None):
+    """每个密钥 × 每个模型生成一个端点；light_models 供轻量评审步骤使用；hedging 为 HedgePolicy 时开启对冲请求。"""
+    keys = list(dict.fromkeys(key.strip() for key in api_keys if key and key.strip()))
+    if not keys:
+        raise ValueError("API密钥不能为空")
+    models = [model] + [m for m in fallback_models if m and m != model]
+    endpoints = [Endpoint(api_url, key, name) for name in models for key in keys]
+    endpoints += [
+        Endpoint(api_url, key, name, tier=TIER_LIGHT)
+        for name in dict.fromkeys(light_models)
+        if name
+        for key in keys
+    ]
+    return ModelRouter(endpoints, hedging=hedging)
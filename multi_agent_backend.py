@@ -1,16 +1,50 @@
 """EDA 多智能体 RAG 后端。"""
 
-import os
 import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import contextvars
+import copy
+import json
+import os
+import re
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from camel.agents import ChatAgent
-from camel.messages import BaseMessage
-from camel.models import ModelFactory
-from camel.retrievers import HybridRetriever
-from camel.types import ModelPlatformType, RoleType
+import numpy as np
+
+# camel 导入链较重（约 1 秒），仅在未配置 HTTP 端点、需回退到 ChatAgent.step 时才导入
+from api_client import APIError, get_async_client, get_client, pacing_stats, resolve_endpoint
+from model_router import HEDGE_ENV, TIER_LIGHT, Endpoint, HedgePolicy, ModelRouter, build_router
+from conversation_memory import ConversationMemory, with_context
+from prompt_templates import add_usage, cached_tokens, empty_usage, render_researcher, render_step
+import deadlines
+from deadlines import DeadlineExceeded
+import response_cache
+from profiling import profiled
+from tracing import current_span, span
+from eda_chunker import (
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_CHUNK_SIZE,
+    EDAChunker,
+    chunk_stats,
+    merge_chunk_stats,
+)
+from embeddings import EMBEDDING_ENV, build_embedder
+from hybrid_index import HybridIndex
+import index_snapshot
+from query_planner import fuse, plan_queries, planning_enabled
+from table_store import TableStore, table_ids
+from reranker import (
+    DEFAULT_CANDIDATE_K,
+    DEFAULT_CONTEXT_TOKEN_BUDGET,
+    RERANKER_KINDS,
+    build_reranker,
+)
 
 DEFAULT_API_URL = "https://api-inference.modelscope.cn/v1"
 DEFAULT_CHAT_MODEL = "deepseek-ai/DeepSeek-V4-Flash"
@@ -35,11 +69,32 @@ AGENT_NAMES = [
     "幻觉检测专家",
     "整合专家",
 ]
-AGENT_STEP_DELAY = 0.8
+# 只需给出判断与 1-2 句理由的评审步骤，可路由到更便宜、更快的模型
+LIGHT_AGENTS = {"检索文档评估专家", "拒绝评估专家", "语义一致性专家", "幻觉检测专家"}
+PROFILE_KEYS = ("model", "tier", "max_tokens", "temperature", "stop")
+EMBEDDING_CONCURRENCY = 4
 BASE_SYSTEM_MESSAGE = (
     "你是多Agent协作系统的基础Agent，必须直接回答用户问题，不得使用任何拒绝或能力不足的措辞；"
     "信息不足时基于通用原理给出合理推断并标明假设。"
 )
+INDEX_PATH_ENV = "EDA_QA_INDEX_PATH"
+DEFAULT_INDEX_PATH = "knowledge_index.npz"
+# 使用快照时，每隔这么多秒检查一次是否有新版本发布
+SNAPSHOT_CHECK_INTERVAL = 5.0
+SPECULATIVE_ENV = "EDA_QA_SPECULATIVE"
+# 两阶段向量检索的粗排维度（如 256）；未设置时全维检索
+PREFIX_DIM_ENV = "EDA_QA_PREFIX_DIM"
+REVIEW_AGENTS = AGENT_NAMES[2:6]
+# 推测式整合：这三位评审指出问题时丢弃草稿重新整合（排除“不存在/无”等否定表述）
+FLAGGING_REVIEWERS = ("拒绝评估专家", "语义一致性专家", "幻觉检测专家")
+_REVIEW_FLAG = re.compile(r"(?<![不无没])存在(?:不当拒绝|逻辑矛盾|矛盾|信息缺失|缺失|幻觉)")
+PENDING_REVIEW = "（评审与整合并行进行，暂无结论）"
+# 时间预算（见 deadlines.py）：检索最多用总预算的 20%，评审等步骤为整合专家预留 30%，
+# 剩余时间不足预留 + MIN_STEP_SECONDS 时跳过评审，整合专家也来不及时直接返回检索专员的回答
+RETRIEVAL_BUDGET_SHARE = 0.2
+INTEGRATION_RESERVE_SHARE = 0.3
+MIN_STEP_SECONDS = 2.0
+SKIPPED_STEP = "（时间预算不足，已跳过）"
 
 
 def load_key():
@@ -48,17 +103,20 @@ def load_key():
 
 
 def _resolve_embeddings_url(api_url):
-    base = str(api_url).rstrip("/")
-    return base if base.endswith("/embeddings") else f"{base}/embeddings"
+    return resolve_endpoint(api_url, "embeddings")
 
 
 def _format_agent_error(exc):
     err = str(exc)
+    if isinstance(exc, DeadlineExceeded):
+        return f"超出时间预算：{exc}"
     if "429" in err or "rate limit" in err.lower():
         return (
             f"API 请求过于频繁或被限流（429）。请等待 1–2 分钟后重试，或更换对话模型。详情：{exc}"
         )
-    if "NoneType" in err and "iterable" in err:
+    if "所有模型端点均不可用" in err and "429" not in err:
+        return f"所有模型端点均调用失败，请检查 API 密钥或在侧栏增加备用模型。详情：{exc}"
+    if ("NoneType" in err and "iterable" in err) or "choices 为空" in err:
         return (
             f"模型返回格式异常（choices 为空）。请重置系统并改用推荐模型，"
             f"如 {DEFAULT_CHAT_MODEL}。详情：{exc}"
@@ -66,175 +124,746 @@ def _format_agent_error(exc):
     return err
 
 
+def review_flags(review_responses):
+    """返回结论中指出不当拒绝、矛盾/缺失或幻觉的评审专家。"""
+    return [
+        name for name in FLAGGING_REVIEWERS
+        if _REVIEW_FLAG.search(str(review_responses.get(name, "")))
+    ]
+
+
 def _initial_agent_status():
     return {name: "pending" for name in AGENT_NAMES}
 
 
+def default_agent_profiles():
+    """各智能体默认调用参数；model/temperature 为 None 时使用主模型与服务端默认值。"""
+    profiles = {}
+    for name in AGENT_NAMES:
+        if name in LIGHT_AGENTS:
+            # 评审只输出结论与 1-2 句理由，预留少量余量给推理型模型
+            profile = {"tier": TIER_LIGHT, "max_tokens": 384, "temperature": 0.1}
+        elif name == "关键信息提取专家":
+            profile = {"tier": None, "max_tokens": 512, "temperature": 0.2}
+        else:
+            profile = {"tier": None, "max_tokens": 2048, "temperature": None}
+        profiles[name] = {"model": None, "stop": None, **profile}
+    return profiles
+
+
+def merge_agent_profiles(overrides=None):
+    """以默认参数为基础合并覆盖项；未知智能体或字段抛出 ValueError。"""
+    profiles = default_agent_profiles()
+    for name, override in (overrides or {}).items():
+        if name not in profiles:
+            raise ValueError(f"未知智能体：{name}")
+        unknown = set(override) - set(PROFILE_KEYS)
+        if unknown:
+            raise ValueError(f"{name} 含未知参数：{', '.join(sorted(unknown))}")
+        profiles[name].update(override)
+        stop = profiles[name].get("stop")
+        if isinstance(stop, str):
+            profiles[name]["stop"] = [item for item in stop.split("|") if item] or None
+    return profiles
+
+
+class KnowledgeVersion:
+    """知识库的一个不可变版本：只读快照 + 此后新增的 (向量, 文本块)。
+
+    检索始终读取某一时刻的版本，入库 / 清空 / 加载只会发布新版本，不修改正在被读取的版本。
+    """
+
+    def __init__(self, number=0, snapshot=None, items=()):
+        self.number = number
+        self.snapshot = snapshot
+        self.items = tuple(items)
+        self._index = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return (len(self.snapshot) if self.snapshot is not None else 0) + len(self.items)
+
+    def extend(self, items):
+        return KnowledgeVersion(self.number + 1, self.snapshot, self.items + tuple(items))
+
+    def __iter__(self):
+        """(向量, 文本块)：快照部分（已归一化的向量）在前，之后新增的块在后。"""
+        if self.snapshot is not None:
+            yield from zip(self.snapshot.matrix, self.snapshot.chunks)
+        yield from self.items
+
+    def index(self, prefix_dim=None):
+        snapshot = self.snapshot
+        if snapshot is not None and not self.items:
+            snapshot.set_prefix_dim(prefix_dim)
+            return snapshot
+        # 在快照之上新增内容时需要在本进程内合并出一份私有索引，重新发布快照后恢复共享；同一版本只构建一次
+        with self._lock:
+            if self._index is None:
+                with span("build_index", {"chunks": len(self), "version": self.number}):
+                    items = list(self)
+                    self._index = HybridIndex(
+                        chunks=[item[1] for item in items],
+                        vectors=[item[0] for item in items],
+                        prefix_dim=prefix_dim,
+                    )
+        self._index.set_prefix_dim(prefix_dim)
+        return self._index
+
+
+_ingest_pool = None
+_ingest_pool_lock = threading.Lock()
+
+
+def _get_ingest_pool():
+    # 后台入库单线程按提交顺序执行，每次提交发布一个新版本，不与前台检索争抢更多 CPU
+    global _ingest_pool
+    with _ingest_pool_lock:
+        if _ingest_pool is None:
+            _ingest_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        return _ingest_pool
+
+
 class VectorStorage:
-    """文本分块、向量化与 hybrid 检索。"""
+    """文本分块、向量化与 hybrid 检索；embedder(文本列表) -> 向量列表 可替换远程 embedding 接口（如离线评测）。
+
+    未传 embedder 时按 EDA_QA_EMBEDDINGS 选择提供方（见 embeddings.py），提供方的 model_name 代替 model_type 记入索引。
+
+    prefix_dim 开启两阶段向量检索（先比较向量前 prefix_dim 维，再用全维重排候选），缺省读取 EDA_QA_PREFIX_DIM。
 
-    def __init__(self, api_key, model_type, url, chunk_size=300):
+    线程安全：知识库内容是不可变的 KnowledgeVersion，检索读取调用时的版本，不加锁；
+    入库在锁外完成分块与向量化，随后在写锁内基于最新版本构建好索引再原子替换，清空 / 加载 / 发布快照同样持写锁。
+    """
+
+    def __init__(self, api_key, model_type, url, chunk_size=DEFAULT_CHUNK_SIZE,
+                 chunk_overlap=DEFAULT_CHUNK_OVERLAP, weight=0.7, embedder=None, prefix_dim=None):
+        if embedder is None:
+            embedder = build_embedder(os.getenv(EMBEDDING_ENV))
         self.api_key = api_key
-        self.model_type = model_type
+        self.model_type = getattr(embedder, "model_name", None) or model_type
         self.url = url
         self.chunk_size = chunk_size
-        self.storage_content = []
+        self.chunk_overlap = chunk_overlap
+        self.weight = weight
+        self.embedder = embedder
+        self.prefix_dim = prefix_dim if prefix_dim is not None else int(os.getenv(PREFIX_DIM_ENV) or 0) or None
+        self._version = KnowledgeVersion()
+        self._write_lock = threading.RLock()
+        # 清空知识库时递增；清空前开始的入库结果不再发布
+        self._epoch = 0
+        self.snapshot_root = None
+        self._snapshot_checked = 0.0
+        # Excel / CSV 表格按列存放，向量库中只有表结构与行摘要
+        self.tables = TableStore()
+
+    def __len__(self):
+        return len(self._version)
+
+    @property
+    def version(self):
+        """当前发布的版本；检索期间持有同一版本即可得到一致的结果。"""
+        return self._version
+
+    @property
+    def snapshot(self):
+        return self._version.snapshot
+
+    @property
+    def storage_content(self):
+        """加载快照后只包含此后新增的块，快照部分以内存映射只读共享。"""
+        return self._version.items
+
+    def _replace(self, snapshot=None, items=()):
+        # 调用方持有写锁
+        self._version = KnowledgeVersion(self._version.number + 1, snapshot, items)
 
     def reset_storage(self):
-        self.storage_content = []
+        with self._write_lock:
+            self._epoch += 1
+            self._replace()
+            self.snapshot_root = None
+            self.tables.clear()
 
-    def _chunk_text(self, text, chunk_size=None):
+    def _chunk_text(self, text, chunk_size=None, chunk_overlap=None):
         size = chunk_size or self.chunk_size
-        splitter = RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=50)
-        return splitter.split_text(text)
+        overlap = self.chunk_overlap if chunk_overlap is None else chunk_overlap
+        chunker = EDAChunker(chunk_size=size, chunk_overlap=min(overlap, size - 1))
+        return chunker.split(text)
 
     def _post_embeddings(self, text_chunks):
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "model": self.model_type,
-            "input": text_chunks,
-            "encoding_format": "float",
-        }
-        response = requests.post(
-            _resolve_embeddings_url(self.url),
-            headers=headers,
-            json=payload,
-            timeout=30,
-        )
-        if response.status_code != 200:
-            print(f"Embedding 请求失败: {response.status_code} {response.text[:200]}")
-            return []
-        result = response.json()
-        if "output" in result:
-            embeds = result.get("output", {}).get("embeddings", [])
-            vectors = [
-                item.get("embedding")
-                for item in embeds
-                if isinstance(item, dict) and item.get("embedding")
-            ]
-        elif "data" in result:
-            vectors = [
-                item.get("embedding")
-                for item in result.get("data", [])
-                if isinstance(item, dict) and item.get("embedding")
-            ]
+        with span("embed", {"inputs": len(text_chunks), "chars": sum(map(len, text_chunks))}) as embed_span:
+            if self.embedder is not None:
+                return self.embedder(text_chunks)
+            try:
+                return get_client(self.url, self.api_key).embeddings(self.model_type, text_chunks)
+            except (APIError, DeadlineExceeded) as e:
+                embed_span.record_exception(e)
+                print(f"Embedding 请求失败: {e}")
+                return []
+
+    async def _apost_embeddings(self, text_chunks):
+        with span("embed", {"inputs": len(text_chunks), "chars": sum(map(len, text_chunks))}) as embed_span:
+            if self.embedder is not None:
+                # 本地向量化是 CPU 计算，放到线程中执行以免阻塞事件循环
+                return await asyncio.to_thread(self.embedder, text_chunks)
+            try:
+                client = get_async_client(self.url, self.api_key)
+                return await client.embeddings(self.model_type, text_chunks)
+            except (APIError, DeadlineExceeded) as e:
+                embed_span.record_exception(e)
+                print(f"Embedding 请求失败: {e}")
+                return []
+
+    def _record_ingest(self, summary, idx, chunks, embeddings, pending):
+        if embeddings:
+            pending.extend(zip(embeddings, chunks))
+            summary["added"] += len(chunks)
+            summary["chunk_stats"] = merge_chunk_stats(summary["chunk_stats"], chunk_stats(chunks))
         else:
-            print(f"Embedding 响应格式异常: {result}")
-            return []
-        return vectors if vectors else []
+            summary["errors"].append(
+                f"第{idx + 1}条向量生成失败，可能是 API Key/额度/模型不可用"
+            )
 
-    def _save_vectors(self, vectors, chunks):
-        for vector, chunk in zip(vectors, chunks):
-            self.storage_content.append((vector, chunk))
+    def _publish(self, summary, pending, epoch):
+        """在写锁内把新增块接到最新版本之后，构建好索引再替换，检索不会看到半成品。"""
+        if not pending:
+            return summary
+        with self._write_lock:
+            if epoch != self._epoch:
+                summary["errors"].append(f"入库期间知识库已被清空，本批 {summary['added']} 个片段未写入")
+                summary["added"] = 0
+                return summary
+            version = self._version.extend(pending)
+            version.index(self.prefix_dim)
+            self._version = version
+        summary["version"] = version.number
+        return summary
 
-    def ingest_texts(self, texts, chunk_size=None):
-        summary = {"added": 0, "errors": []}
+    @profiled("ingest_texts")
+    def ingest_texts(self, texts, chunk_size=None, chunk_overlap=None):
+        summary = {"added": 0, "errors": [], "chunk_stats": chunk_stats([])}
         if not texts:
             return summary
+        epoch = self._epoch
+        pending = []
+        with span("ingest", {"texts": len(texts)}) as ingest_span:
+            for idx, text in enumerate(texts):
+                if not text or not str(text).strip():
+                    summary["errors"].append(f"第{idx + 1}条文本为空")
+                    continue
+                chunks = self._chunk_text(str(text), chunk_size, chunk_overlap)
+                self._record_ingest(summary, idx, chunks, self._post_embeddings(chunks), pending)
+            self._publish(summary, pending, epoch)
+            ingest_span.set_attributes({"chunks_added": summary["added"], "errors": len(summary["errors"])})
+        return summary
+
+    @profiled("ingest_tables")
+    def ingest_tables(self, tables):
+        """tables 为 [(表名, pyarrow.Table)]：表格写入列存储，只向量化表结构摘要与行摘要。"""
+        summary = {"added": 0, "errors": [], "chunk_stats": chunk_stats([]), "tables": 0, "rows": 0}
+        epoch = self._epoch
+        pending = []
+        with span("ingest", {"tables": len(tables)}) as ingest_span:
+            for idx, (name, table) in enumerate(tables):
+                table_id = self.tables.add(name, table)
+                texts = self.tables.summaries(table_id)
+                before = summary["added"]
+                self._record_ingest(summary, idx, texts, self._post_embeddings(texts), pending)
+                if summary["added"] > before:
+                    summary["tables"] += 1
+                    summary["rows"] += table.num_rows
+            self._publish(summary, pending, epoch)
+            ingest_span.set_attributes({"chunks_added": summary["added"], "errors": len(summary["errors"])})
+        return summary
+
+    def submit_ingest(self, texts=None, tables=None, chunk_size=None, chunk_overlap=None):
+        """后台入库：返回 concurrent.futures.Future，结果为合并后的入库摘要；期间检索照常读取已发布的版本。
+        在提交线程复制 contextvars，入库沿用调用方的链路与时间预算。"""
+        def run():
+            summary = {"added": 0, "errors": [], "chunk_stats": chunk_stats([])}
+            parts = []
+            if texts:
+                parts.append(self.ingest_texts(texts, chunk_size, chunk_overlap))
+            if tables:
+                parts.append(self.ingest_tables(tables))
+            for part in parts:
+                summary["added"] += part["added"]
+                summary["errors"] += part["errors"]
+                summary["chunk_stats"] = merge_chunk_stats(summary["chunk_stats"], part["chunk_stats"])
+                for key in ("tables", "rows", "version"):
+                    if key in part:
+                        summary[key] = part[key]
+            return summary
+
+        return _get_ingest_pool().submit(contextvars.copy_context().run, run)
+
+    def lookup_tables(self, user_query, candidates):
+        """候选中引用了表格时，按问题对这些表做精确的列过滤查询，返回查询结果文本。"""
+        found = []
+        for item in candidates:
+            text = item["text"] if isinstance(item, dict) else item
+            found.extend(table_ids(text))
+        results = []
+        for table_id in dict.fromkeys(found):
+            try:
+                result = self.tables.lookup(table_id, user_query)
+            except (OSError, ValueError) as e:
+                print(f"表格 {table_id} 查询失败：{e}")
+                continue
+            if result is not None:
+                results.append(result["text"])
+        return results
+
+    async def aingest_texts(self, texts, chunk_size=None, chunk_overlap=None,
+                            concurrency=EMBEDDING_CONCURRENCY):
+        """异步入库：各文本的向量请求并发执行（受 concurrency 限制），按原顺序写入；索引在线程中构建后发布。"""
+        summary = {"added": 0, "errors": [], "chunk_stats": chunk_stats([])}
+        if not texts:
+            return summary
+        epoch = self._epoch
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def embed(chunks):
+            async with semaphore:
+                return await self._apost_embeddings(chunks)
+
+        jobs = []
         for idx, text in enumerate(texts):
             if not text or not str(text).strip():
                 summary["errors"].append(f"第{idx + 1}条文本为空")
                 continue
-            chunks = self._chunk_text(str(text), chunk_size)
-            embeddings = self._post_embeddings(chunks)
-            if embeddings:
-                self._save_vectors(embeddings, chunks)
-                summary["added"] += len(chunks)
-            else:
-                summary["errors"].append(
-                    f"第{idx + 1}条向量生成失败，可能是 API Key/额度/模型不可用"
-                )
+            jobs.append((idx, self._chunk_text(str(text), chunk_size, chunk_overlap)))
+        with span("ingest", {"texts": len(texts)}) as ingest_span:
+            results = await asyncio.gather(*(embed(chunks) for _, chunks in jobs))
+            pending = []
+            for (idx, chunks), embeddings in zip(jobs, results):
+                self._record_ingest(summary, idx, chunks, embeddings, pending)
+            await asyncio.to_thread(self._publish, summary, pending, epoch)
+            ingest_span.set_attributes({"chunks_added": summary["added"], "errors": len(summary["errors"])})
         return summary
 
-    def retrieve(self, user_query, top_k=3):
-        if not self.storage_content:
-            return []
-        chunks = [item[1] for item in self.storage_content]
-        vectors = [item[0] for item in self.storage_content]
-        query_vectors = self._post_embeddings([user_query])
+    def _get_index(self, version=None):
+        # 每个版本的索引只构建一次（入库时已在发布前构建），之后复用直到知识库变化
+        return (version or self._version).index(self.prefix_dim)
+
+    def _search_span(self, version, queries, top_k):
+        return span("retrieve", {"top_k": top_k, "chunks": len(version), "version": version.number,
+                                 "queries": len(queries), "prefix_dim": self.prefix_dim})
+
+    def _search(self, version, query_vectors, user_query, top_k, retrieve_span):
         if not query_vectors:
             return []
-        retriever = HybridRetriever(
-            texts=chunks,
-            embeddings=vectors,
-            embedding_model=self.model_type,
-            top_k=top_k,
-            weight=0.7,
+        candidates = self._get_index(version).search(
+            query_vectors[0], user_query, top_k=top_k, weight=self.weight
         )
-        return retriever.retrieve(query=user_query, query_embedding=query_vectors[0])
+        retrieve_span.set_attribute("candidates", len(candidates))
+        return candidates
+
+    def retrieve_candidates(self, user_query, top_k=3):
+        """返回带融合得分的候选 [{"index", "text", "score", "similarity"}]。"""
+        self.refresh_snapshot()
+        version = self._version
+        if not len(version):
+            return []
+        with self._search_span(version, [user_query], top_k) as retrieve_span:
+            return self._search(version, self._post_embeddings([user_query]), user_query, top_k, retrieve_span)
+
+    async def aretrieve_candidates(self, user_query, top_k=3):
+        self.refresh_snapshot()
+        version = self._version
+        if not len(version):
+            return []
+        with self._search_span(version, [user_query], top_k) as retrieve_span:
+            query_vectors = await self._apost_embeddings([user_query])
+            return self._search(version, query_vectors, user_query, top_k, retrieve_span)
+
+    def retrieve_multi(self, queries, top_k=3):
+        """多个子查询（见 query_planner）：一次批量向量化，在同一版本上并行检索，按 RRF 合并为 top_k 个候选。"""
+        queries = list(queries)
+        if len(queries) == 1:
+            return self.retrieve_candidates(queries[0], top_k)
+        self.refresh_snapshot()
+        version = self._version
+        if not len(version):
+            return []
+        with self._search_span(version, queries, top_k) as retrieve_span:
+            query_vectors = self._post_embeddings(queries)
+            if len(query_vectors) != len(queries):
+                return []
+            index = self._get_index(version)
+            with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+                futures = [
+                    pool.submit(contextvars.copy_context().run, index.search, vector, query, top_k, self.weight)
+                    for vector, query in zip(query_vectors, queries)
+                ]
+                candidates = fuse([future.result() for future in futures], top_k)
+            retrieve_span.set_attribute("candidates", len(candidates))
+            return candidates
+
+    async def aretrieve_multi(self, queries, top_k=3):
+        queries = list(queries)
+        if len(queries) == 1:
+            return await self.aretrieve_candidates(queries[0], top_k)
+        self.refresh_snapshot()
+        version = self._version
+        if not len(version):
+            return []
+        with self._search_span(version, queries, top_k) as retrieve_span:
+            query_vectors = await self._apost_embeddings(queries)
+            if len(query_vectors) != len(queries):
+                return []
+            index = self._get_index(version)
+            results = await asyncio.gather(*(
+                asyncio.to_thread(index.search, vector, query, top_k, self.weight)
+                for vector, query in zip(query_vectors, queries)
+            ))
+            candidates = fuse(results, top_k)
+            retrieve_span.set_attribute("candidates", len(candidates))
+            return candidates
+
+    def retrieve(self, user_query, top_k=3):
+        return [item["text"] for item in self.retrieve_candidates(user_query, top_k)]
+
+    def save(self, path):
+        """把向量与分块持久化为 .npz，供下次启动时预热加载。"""
+        items = list(self._version)
+        vectors = np.asarray([item[0] for item in items], dtype=np.float32)
+        chunks = json.dumps([item[1] for item in items], ensure_ascii=False)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, vectors=vectors, chunks=np.array(chunks), model=np.array(str(self.model_type)))
+        os.replace(tmp_path, path)
+        return len(items)
+
+    def load(self, path):
+        """加载 save() 写出的索引并立即构建检索结构；向量模型不一致时拒绝加载，返回加载的块数。"""
+        with np.load(path) as data:
+            model = str(data["model"])
+            if model != str(self.model_type):
+                raise ValueError(f"索引由 {model} 生成，与当前向量模型 {self.model_type} 不一致")
+            chunks = json.loads(str(data["chunks"]))
+            vectors = data["vectors"]
+        version = KnowledgeVersion(items=zip(list(vectors), chunks))
+        version.index(self.prefix_dim)
+        with self._write_lock:
+            version.number = self._version.number + 1
+            self._version = version
+            self.snapshot_root = None
+        return len(chunks)
+
+    def publish_snapshot(self, root=None, keep=index_snapshot.KEEP_VERSIONS):
+        """把当前知识库发布为新的只读快照版本，随后本实例也改为映射该版本；返回 manifest（含 version）。
+
+        发布期间持写锁，入库的结果等发布完成后接在新快照之后，不会丢失。
+        """
+        with self._write_lock:
+            root = root or self.snapshot_root or os.getenv(
+                index_snapshot.SNAPSHOT_DIR_ENV, index_snapshot.DEFAULT_SNAPSHOT_DIR
+            )
+            if not len(self):
+                raise ValueError("知识库为空，无法发布快照")
+            manifest = index_snapshot.publish(self._get_index(), root, self.model_type, keep=keep)
+            self.load_snapshot(root, manifest["version"])
+        return manifest
+
+    def load_snapshot(self, root=None, version=None):
+        """以内存映射方式加载快照（缺省为 CURRENT 指向的版本），返回块数；没有已发布版本时返回 0。"""
+        root = root or os.getenv(index_snapshot.SNAPSHOT_DIR_ENV, index_snapshot.DEFAULT_SNAPSHOT_DIR)
+        snapshot = index_snapshot.open_snapshot(root, version)
+        if snapshot is None:
+            return 0
+        if snapshot.model != str(self.model_type):
+            raise ValueError(f"快照由 {snapshot.model} 生成，与当前向量模型 {self.model_type} 不一致")
+        snapshot.set_prefix_dim(self.prefix_dim)
+        with self._write_lock:
+            self._replace(snapshot)
+            self.snapshot_root = root
+            self._snapshot_checked = time.monotonic()
+        return len(snapshot)
+
+    def refresh_snapshot(self, force=False):
+        """其他进程发布了新版本时切换过去；本实例在快照之上有未发布的新增内容时不切换。"""
+        if self.snapshot_root is None or self._version.items:
+            return False
+        now = time.monotonic()
+        if not force and now - self._snapshot_checked < SNAPSHOT_CHECK_INTERVAL:
+            return False
+        self._snapshot_checked = now
+        version = index_snapshot.current_version(self.snapshot_root)
+        if version is None or (self.snapshot is not None and version == self.snapshot.version):
+            return False
+        # 正在写入时（入库发布、发布快照）跳过本次检查，不阻塞检索
+        if not self._write_lock.acquire(blocking=False):
+            return False
+        try:
+            if self._version.items:
+                return False
+            self.load_snapshot(self.snapshot_root, version)
+        except (OSError, ValueError) as e:
+            print(f"快照 {version} 加载失败，继续使用当前版本：{e}")
+            return False
+        finally:
+            self._write_lock.release()
+        print(f"已切换到索引快照 {version}")
+        return True
+
+    def clone(self):
+        """浅拷贝：共享当前版本（含已构建的索引与只读快照），后续入库互不影响。"""
+        other = copy.copy(self)
+        other._write_lock = threading.RLock()
+        return other
+
+    async def aretrieve(self, user_query, top_k=3):
+        return [item["text"] for item in await self.aretrieve_candidates(user_query, top_k)]
 
 
 # 兼容旧引用
 Vector_Storage = VectorStorage
 
 
-class FunctionAgent(ChatAgent):
-    def __init__(self, agent_name, model, system_message):
-        super().__init__(model=model, system_message=system_message)
+class ChatModelConfig:
+    """对话模型配置；对应的 camel 模型在首次回退调用时才创建。"""
+
+    def __init__(self, model_type, url, api_key, model_config_dict=None):
+        self.model_type = model_type
+        self.url = url
+        self.api_key = api_key
+        self.model_config_dict = dict(model_config_dict or {})
+        self._backend = None
+
+    def create(self):
+        if self._backend is None:
+            from camel.models import ModelFactory
+            from camel.types import ModelPlatformType
+
+            self._backend = ModelFactory.create(
+                model_type=self.model_type,
+                url=self.url,
+                api_key=self.api_key,
+                model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
+                model_config_dict=self.model_config_dict,
+            )
+        return self._backend
+
+
+class FunctionAgent:
+    def __init__(self, agent_name, model, system_message, api_url=None, api_key=None, router=None):
         self.agent_name = agent_name
         self.model = model
+        # 兼容 camel BaseMessage 与纯文本两种系统提示
+        self.system_message = getattr(system_message, "content", system_message)
+        self.api_url = api_url
+        self.api_key = api_key
+        if router is None and api_url and api_key:
+            router = ModelRouter([Endpoint(api_url, api_key, str(model.model_type))])
+        self.router = router
+        self._chat_agent = None
+
+    def _chat_messages(self, input_text):
+        return [
+            {"role": "system", "content": self.system_message},
+            {"role": "user", "content": input_text},
+        ]
+
+    def _step_once(self, input_text):
+        # 未配置端点时沿用 camel ChatAgent.step
+        from camel.agents import ChatAgent
+        from camel.messages import BaseMessage
+        from camel.types import RoleType
 
-    def run(self, input_text):
+        if self._chat_agent is None:
+            model = self.model.create() if isinstance(self.model, ChatModelConfig) else self.model
+            self._chat_agent = ChatAgent(model=model, system_message=self.system_message)
+        user_msg = BaseMessage(
+            role_name="user",
+            role_type=RoleType.USER,
+            content=input_text,
+            meta_dict={},
+        )
+        self._chat_agent.memory.clear()
+        response = self._chat_agent.step(user_msg)
+        return response.msgs[0].content if (response and response.msgs) else None
+
+    @staticmethod
+    def _empty_response():
+        return {
+            "status": "failure",
+            "response": f"模型返回为空，请更换对话模型（推荐 {DEFAULT_CHAT_MODEL}）",
+        }
+
+    def _call_options(self, profile):
+        profile = profile or {}
+        options = dict(self.model.model_config_dict)
+        for key in ("max_tokens", "temperature", "stop"):
+            if profile.get(key) is not None:
+                options[key] = profile[key]
+        options["tier"] = profile.get("tier")
+        options["model"] = profile.get("model")
+        return options
+
+    def _cache_lookup(self, messages, options):
+        """按请求的模型、完整消息与生成参数查回复缓存；返回 (缓存键, 模型名, 命中时的结果)。"""
+        model = options.get("model") or getattr(self.model, "model_type", self.model)
+        params = {key: value for key, value in options.items() if key != "model"}
+        key, entry = response_cache.lookup(model, messages, params)
+        if key is not None:
+            current_span().set_attribute("response_cache", "hit" if entry else "miss")
+        if not entry:
+            return key, model, None
+        # 命中缓存不消耗 token，不计入用量
+        return key, model, {"status": "success", "response": entry["content"], "usage": None, "cached": True}
+
+    def run(self, input_text, profile=None):
         try:
             if not input_text or not str(input_text).strip():
                 raise ValueError("输入内容不能为空")
-            user_msg = BaseMessage(
-                role_name="user",
-                role_type=RoleType.USER,
-                content=str(input_text).strip(),
-                meta_dict={},
-            )
-            self.memory.clear()
-            response = self.step(user_msg)
-            if not response or not response.msgs:
-                return {
-                    "status": "failure",
-                    "response": f"模型返回为空，请更换对话模型（推荐 {DEFAULT_CHAT_MODEL}）",
-                }
-            return {"status": "success", "response": response.msgs[0].content}
+            text = str(input_text).strip()
+            messages, options = self._chat_messages(text), self._call_options(profile)
+            key, model, cached = self._cache_lookup(messages, options)
+            if cached:
+                return cached
+            usage = None
+            if self.router is None:
+                content = self._step_once(text)
+            else:
+                result = self.router.complete(messages, **options)
+                content, usage = result["content"], result.get("usage")
+            if not content:
+                return self._empty_response()
+            response_cache.store(key, model, content, usage)
+            return {"status": "success", "response": content, "usage": usage}
+        except Exception as e:
+            print(f"Error:{e}")
+            return {"status": "failure", "response": _format_agent_error(e)}
+
+    async def arun(self, input_text, profile=None, timeout=None):
+        """异步单轮调用：经路由直接请求 OpenAI 兼容接口，不读写共享 memory，可并发执行。"""
+        try:
+            if not input_text or not str(input_text).strip():
+                raise ValueError("输入内容不能为空")
+            messages, options = self._chat_messages(str(input_text).strip()), self._call_options(profile)
+            key, model, cached = self._cache_lookup(messages, options)
+            if cached:
+                return cached
+            if self.router is None:
+                raise ValueError("未配置模型端点，无法异步调用")
+            result = await self.router.acomplete(messages, timeout=timeout, **options)
+            if not result["content"]:
+                return self._empty_response()
+            response_cache.store(key, model, result["content"], result.get("usage"))
+            return {"status": "success", "response": result["content"], "usage": result.get("usage")}
         except Exception as e:
             print(f"Error:{e}")
             return {"status": "failure", "response": _format_agent_error(e)}
 
 
 class RAGAgent(FunctionAgent):
-    def __init__(self, agent_name, model, system_message, rag_system):
-        super().__init__(agent_name=agent_name, model=model, system_message=system_message)
+    def __init__(self, agent_name, model, system_message, rag_system, reranker=None,
+                 top_k=3, candidate_k=DEFAULT_CANDIDATE_K,
+                 context_token_budget=DEFAULT_CONTEXT_TOKEN_BUDGET, api_url=None, api_key=None,
+                 router=None):
+        super().__init__(
+            agent_name=agent_name,
+            model=model,
+            system_message=system_message,
+            api_url=api_url,
+            api_key=api_key,
+            router=router,
+        )
         self.rag_system = rag_system
+        self.reranker = reranker
+        self.top_k = top_k
+        self.candidate_k = candidate_k
+        self.context_token_budget = context_token_budget
+
+    @property
+    def fetch_k(self):
+        # 启用重排时过量召回，再由重排器精选
+        return max(self.candidate_k, self.top_k) if self.reranker else self.top_k
+
+    def select_context(self, input_text, candidates=None):
+        if candidates is None:
+            candidates = self.rag_system.retrieve_candidates(input_text, top_k=self.fetch_k)
+        candidates = [
+            item if isinstance(item, dict) else {"text": str(item), "score": 0.0}
+            for item in candidates
+        ]
+        # 命中表格摘要时先做精确的表格查询，结果排在检索片段之前
+        lookup = getattr(self.rag_system, "lookup_tables", None)
+        table_results = lookup(input_text, candidates) if lookup is not None else []
+        if self.reranker is None:
+            return table_results + [item["text"] for item in candidates[:self.top_k]]
+        return table_results + self.reranker.rerank(
+            input_text,
+            candidates,
+            top_k=self.top_k,
+            token_budget=self.context_token_budget,
+        )
+
+    def _compose_prompt(self, input_text, rag_result, conversation_context=""):
+        if not rag_result:
+            raise ValueError("未检索到相关结果")
+        context = "\n".join(
+            f"参考内容{i + 1}：{chunk}" for i, chunk in enumerate(rag_result)
+        )
+        background = f"对话背景：\n{conversation_context}\n" if conversation_context else ""
+        return f"{background}用户问题：{input_text}\n{context}"
+
+    def run(self, input_text, candidates=None, profile=None, conversation_context=""):
+        try:
+            prompt = self._compose_prompt(
+                input_text, self.select_context(input_text, candidates), conversation_context
+            )
+            return super().run(prompt, profile=profile)
+        except Exception as e:
+            print(f"Error:{e}")
+            return {"status": "failure", "response": str(e)}
 
-    def run(self, input_text):
+    async def arun(self, input_text, candidates=None, profile=None, timeout=None, conversation_context=""):
         try:
-            rag_result = self.rag_system.retrieve(input_text)
-            if not rag_result:
-                raise ValueError("未检索到相关结果")
-            context = "\n".join(
-                f"参考内容{i + 1}：{chunk}" for i, chunk in enumerate(rag_result)
+            if candidates is None:
+                candidates = await self.rag_system.aretrieve_candidates(input_text, top_k=self.fetch_k)
+            prompt = self._compose_prompt(
+                input_text, self.select_context(input_text, candidates), conversation_context
             )
-            return super().run(f"用户问题：{input_text}\n{context}")
+            return await super().arun(prompt, profile=profile, timeout=timeout)
         except Exception as e:
             print(f"Error:{e}")
             return {"status": "failure", "response": str(e)}
 
 
 class Workforce(FunctionAgent):
-    def __init__(self, agent_name, model_type, url, api_key):
-        model = ModelFactory.create(
-            model_type=model_type,
-            url=url,
+    def __init__(self, agent_name, model_type, url, api_key, router=None):
+        model = ChatModelConfig(model_type, url, api_key, model_config_dict={"max_tokens": 2048})
+        super().__init__(
+            agent_name=agent_name,
+            model=model,
+            system_message=BASE_SYSTEM_MESSAGE,
+            api_url=url,
             api_key=api_key,
-            model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
-            model_config_dict={"max_tokens": 2048},
+            router=router,
         )
-        super().__init__(agent_name=agent_name, model=model, system_message=BASE_SYSTEM_MESSAGE)
 
-    def input_output(self, prev_response, current_prompt):
+    @staticmethod
+    def _compose_input(prev_response, current_prompt):
+        # 固定的任务说明在前、上一个 Agent 的回复在后，便于服务端复用提示词前缀
         prev_response = str(prev_response).strip() if prev_response else ""
         current_prompt = str(current_prompt).strip() if current_prompt else ""
-        full_text = f"上一个Agent的回复：{prev_response}\n当前任务：{current_prompt}"
-        res = super().run(full_text)
+        if not prev_response:
+            return current_prompt
+        return f"当前任务：{current_prompt}\n上一个Agent的回复：{prev_response}"
+
+    def input_output(self, prev_response, current_prompt, profile=None):
+        res = super().run(self._compose_input(prev_response, current_prompt), profile=profile)
+        self.last_usage = res.get("usage")
+        if res["status"] == "success":
+            return res["response"]
+        return f"失败：{res['response']}"
+
+    async def ainput_output(self, prev_response, current_prompt, profile=None):
+        res = await FunctionAgent.arun(
+            self, self._compose_input(prev_response, current_prompt), profile=profile
+        )
+        self.last_usage = res.get("usage")
         if res["status"] == "success":
             return res["response"]
         return f"失败：{res['response']}"
@@ -243,13 +872,32 @@ class Workforce(FunctionAgent):
 class MultiAgents(Workforce):
     """七智能体流水线：检索 → 提取 → 评估 → 整合。"""
 
-    def __init__(self, agent_name, model_type, url, api_key):
-        super().__init__(agent_name=agent_name, model_type=model_type, url=url, api_key=api_key)
+    def __init__(self, agent_name, model_type, url, api_key, reranker="lexical", router=None,
+                 agent_profiles=None, rag_system=None, speculative=False):
+        super().__init__(
+            agent_name=agent_name,
+            model_type=model_type,
+            url=url,
+            api_key=api_key,
+            router=router,
+        )
         self.model_type = model_type
         self.history_list = []
         self.agent_name = agent_name
         self.agent_status = _initial_agent_status()
-        self.rag_system = VectorStorage(
+        self.token_usage = {}
+        self.last_usage = None
+        # 可选回调 (智能体名, 状态)，供服务模式推送进度
+        self.status_listener = None
+        # 推测式整合：草稿与评审并行；统计在 _fork 出的副本间共享
+        self.speculative = speculative
+        self.speculation_stats = {"runs": 0, "accepted": 0}
+        self.last_speculation = None
+        # 复合问题拆成子查询分别检索（见 query_planner.py）；last_queries 为本轮实际使用的子查询
+        self.query_planning = planning_enabled()
+        self.last_queries = None
+        self.set_agent_profiles(agent_profiles)
+        self.rag_system = rag_system or VectorStorage(
             api_key=api_key,
             model_type=DEFAULT_EMBEDDING_MODEL,
             url=url,
@@ -259,168 +907,425 @@ class MultiAgents(Workforce):
             model=self.model,
             system_message="你是RAG检索专员，基于知识库回答问题",
             rag_system=self.rag_system,
+            reranker=build_reranker(reranker) if isinstance(reranker, str) else reranker,
+            api_url=url,
+            api_key=api_key,
+            router=self.router,
         )
 
     def get_agent_status(self):
         return self.agent_status.copy()
 
+    def set_agent_profiles(self, overrides=None):
+        """设置各智能体的模型、max_tokens、temperature 与 stop；未设置的字段使用默认值。"""
+        profiles = merge_agent_profiles(overrides)
+        for profile in profiles.values():
+            # 指定了路由器中尚不存在的模型时，复用已有地址与密钥生成端点
+            if profile.get("model") and self.router is not None:
+                self.router.add_model(profile["model"])
+        self.agent_profiles = profiles
+        return profiles
+
+    def get_agent_profiles(self):
+        return {name: dict(profile) for name, profile in self.agent_profiles.items()}
+
     def _update_agent_status(self, agent_name, status):
         if agent_name in self.agent_status:
             self.agent_status[agent_name] = status
+            if self.status_listener is not None:
+                self.status_listener(agent_name, status)
+
+    def _record_usage(self, agent_name, usage):
+        if usage is not None:
+            add_usage(self.token_usage.setdefault(agent_name, empty_usage()), usage)
+            current_span().set_attributes({
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "completion_tokens": usage.get("completion_tokens"),
+                "cached_tokens": cached_tokens(usage),
+            })
+
+    def get_token_usage(self):
+        """各步骤及合计的 token 用量；cached_tokens 为命中服务端前缀缓存的输入 token 数。"""
+        usage = {name: dict(item) for name, item in self.token_usage.items()}
+        total = empty_usage()
+        for item in self.token_usage.values():
+            for key in total:
+                total[key] += item[key]
+        usage["合计"] = total
+        return usage
 
     def _append_history(self, text):
         self.history_list.append(text)
         return text
 
+    def _fork(self):
+        """并发问答用的副本：共享模型、HTTP 连接池与知识库，流水线状态独立。"""
+        run = copy.copy(self)
+        run.history_list = []
+        run.agent_status = _initial_agent_status()
+        run.token_usage = {}
+        run.last_speculation = None
+        return run
+
+    def get_speculation_stats(self):
+        runs, accepted = self.speculation_stats["runs"], self.speculation_stats["accepted"]
+        return {"runs": runs, "accepted": accepted, "acceptance_rate": round(accepted / runs, 3) if runs else None}
+
+    def _researcher_prompt(self, input_text):
+        return "", render_researcher(input_text)
+
+    def _key_point_prompt(self, agent_response, input_text=""):
+        return "", render_step("关键信息提取专家", input_text, agent_response)
+
+    def _review_prompt(self, role, input_text, previous):
+        return "", render_step(role, input_text, self.history_list[0], previous=previous)
+
+    def _retrieval_quality_prompt(self, input_text):
+        return self._review_prompt("检索文档评估专家", input_text, self.history_list[1])
+
+    def _rejection_evaluation_prompt(self, input_text):
+        return self._review_prompt("拒绝评估专家", input_text, self.history_list[2])
+
+    def _semantic_consistency_prompt(self, input_text):
+        return self._review_prompt("语义一致性专家", input_text, self.history_list[3])
+
+    def _hallucination_detection_prompt(self, input_text):
+        return self._review_prompt("幻觉检测专家", input_text, self.history_list[4])
+
+    def _integration_prompt(self, input_text, context=""):
+        # 推测式草稿生成时评审尚未完成，对应位置填占位说明
+        replies = "\n".join(
+            f"{name}回复：{str(self.history_list[idx]).strip() if idx < len(self.history_list) else PENDING_REVIEW}"
+            for idx, name in enumerate(AGENT_NAMES[1:6], start=1)
+        )
+        # 多轮对话背景放在共享上下文之后，不破坏与评审步骤一致的前缀
+        if context:
+            replies = f"{replies}\n对话背景（此前对话摘要）：\n{context}"
+        return render_step("整合专家", input_text, self.history_list[0], extra=replies)
+
     def _researcher_agent(self, input_text):
-        prompt = f"""
-        角色：你是EDA（电子设计自动化）领域的资深专家。
-        强制要求：
-        1. 必须直接回答用户问题，严禁出现“无法回答”“作为语言模型”等拒绝或能力不足的措辞。
-        2. 优先基于检索/知识库内容；如信息不足，结合EDA通用原理与合理推断给出可执行建议，可标注假设来源，但不能拒绝。
-        3. 回答需聚焦电子设计/布线/EDA范畴，不讨论无关领域，不添加开场寒暄。
-        用户问题：{input_text.strip()}
-        """
-        return self._append_history(self.input_output("", prompt))
-
-    def _key_point_extractor(self, agent_response):
-        prompt = f"""
-        你是关键信息提取专家，负责从检索专员的回复中提取核心关键词/关键信息点。
-        要求：
-        1. 提取结果需精准对应用户问题，不遗漏核心要点；
-        2. 以简洁的列表或短语形式呈现，无需完整句子；
-        3. 去除冗余信息，只保留关键概念、数据、结论。
-        检索专员回复：{str(agent_response).strip()}"""
-        return self._append_history(self.input_output(agent_response, prompt))
-
-    def _retrieval_quality_agent(self, input_text):
-        prompt = f"""
-        你是检索文档评估专家，负责评测关键信息与用户问题的相关性。
-        要求：
-        1. 基于关键信息提取结果，判断其与用户问题的匹配程度；
-        2. 给出明确的相关性评级（高/中/低）；
-        3. 简要说明评级理由（1-2句话即可）。
-        关键信息提取专家回复：{str(self.history_list[1]).strip()}
-        用户问题：{input_text.strip()}
-        """
-        return self._append_history(self.input_output(self.history_list[1], prompt))
-
-    def _rejection_evaluation_agent(self, input_text):
-        prompt = f"""
-        你是拒绝评估专家，负责检测检索专员的回答是否存在“不当拒绝”。
-        要求：
-        1. 不当拒绝定义：用户问题合理但未给出有效回答、故意回避核心问题、无理由拒绝回答；
-        2. 给出明确判断结果（存在不当拒绝/无不当拒绝）；
-        3. 简要说明判断依据（1-2句话即可）。
-        用户问题：{input_text.strip()}
-        检索专员回复：{str(self.history_list[0]).strip()}"""
-        return self._append_history(self.input_output(self.history_list[2], prompt))
-
-    def _semantic_consistency_agent(self, input_text):
-        prompt = f"""
-        你是语义一致性检测专家，负责校验检索专员的回答是否存在逻辑矛盾或信息缺失。
-        要求：
-        1. 逻辑矛盾：回答内部观点冲突、数据前后不一致；
-        2. 信息缺失：未覆盖用户问题的核心要点（需结合问题判断）；
-        3. 给出明确判断结果（无矛盾无缺失/存在矛盾/存在缺失）；
-        4. 简要说明判断依据（1-2句话即可）。
-        用户问题：{input_text.strip()}
-        检索专员回复：{str(self.history_list[0]).strip()}"""
-        return self._append_history(self.input_output(self.history_list[3], prompt))
-
-    def _hallucination_detection_agent(self, input_text):
-        prompt = f"""
-        你是幻觉检测专家，负责检测检索专员的回答是否包含虚构信息（幻觉）。
-        要求：
-        1. 幻觉定义：不存在的事实、虚假数据、未证实的观点、错误的概念关联；
-        2. 给出明确判断结果（无幻觉/存在幻觉）；
-        3. 若存在幻觉，简要指出虚构内容（1-2句话即可）。
-        用户问题：{input_text.strip()}
-        检索专员回复：{str(self.history_list[0]).strip()}"""
-        return self._append_history(self.input_output(self.history_list[4], prompt))
-
-    def _integration_agent(self, input_text):
-        prompt = f"""
-        你是整合专家，负责基于所有智能体的回复，生成最终的专业回答。
-        强制要求：
-        1. 必须给出最终答案，严禁使用“无法回答/作为语言模型”等拒绝措辞。
-        2. 优先采纳检索专员内容并融合关键信息提取要点；如信息不足，基于EDA常识给出合理推断并标注假设来源，不得拒绝。
-        3. 语言流畅、逻辑清晰，输出聚焦电子设计自动化（EDA）范畴，不扩展无关内容。
-        4. 若上游存在不当拒绝/矛盾/幻觉，需在回答中修正并给出更可靠表述。
-        检索专员回复：{str(self.history_list[0]).strip()}
-        关键信息提取专家回复：{str(self.history_list[1]).strip()}
-        检索文档评估专家回复：{str(self.history_list[2]).strip()}
-        拒绝评估专家回复：{str(self.history_list[3]).strip()}
-        语义一致性检测专家回复：{str(self.history_list[4]).strip()}
-        幻觉检测专家回复：{str(self.history_list[5]).strip()}
-        用户问题：{input_text.strip()}"""
-        user_msg = BaseMessage(
-            role_name="user",
-            role_type=RoleType.USER,
-            content=prompt.strip(),
-            meta_dict={},
+        return self._append_history(
+            self.input_output(*self._researcher_prompt(input_text), profile=self.agent_profiles["检索专员"])
+        )
+
+    def _integration_result(self, res):
+        self._record_usage("整合专家", res.get("usage"))
+        return self._integration_text(res)
+
+    def _integration_text(self, res):
+        if res["status"] == "success":
+            return self._append_history(res["response"] or "整合失败，无有效回复")
+        print(f"IntegrationAgent Error:{res['response']}")
+        return self._append_history(f"整合失败：{res['response']}")
+
+    def _integration_agent(self, input_text, context=""):
+        return self._integration_result(
+            FunctionAgent.run(
+                self, self._integration_prompt(input_text, context), profile=self.agent_profiles["整合专家"]
+            )
+        )
+
+    async def _aintegration_agent(self, input_text, context=""):
+        return self._integration_result(
+            await FunctionAgent.arun(
+                self, self._integration_prompt(input_text, context), profile=self.agent_profiles["整合专家"]
+            )
         )
-        try:
-            self.memory.clear()
-            response = self.step(user_msg)
-            result = response.msgs[0].content if (response and response.msgs) else "整合失败，无有效回复"
-        except Exception as e:
-            print(f"IntegrationAgent Error:{e}")
-            result = f"整合失败：{_format_agent_error(e)}"
-        return self._append_history(result)
 
     def _log_step(self, step_no, agent_name, response_text):
         print(f"【{step_no} {agent_name}】：{response_text}\n")
 
-    def _run_primary_agent(self, user_question, use_rag):
+    def _record_primary_result(self, rag_response, log_name):
         agent_name = "检索专员"
-        self._update_agent_status(agent_name, "running")
-        try:
-            if use_rag:
-                rag_response = self.rag_agent.run(user_question)
-                if rag_response["status"] != "success":
-                    res1 = f"RAG检索失败：{rag_response['response']}"
-                    self._update_agent_status(agent_name, "failed")
-                else:
-                    res1 = rag_response["response"]
-                    self._update_agent_status(agent_name, "completed")
-                self.history_list.append(res1)
-                self._log_step("1/7", "RAG检索员", res1)
-                return res1
-            res1 = self._researcher_agent(user_question)
-            self._update_agent_status(agent_name, "completed")
-            self._log_step("1/7", "检索专员", res1)
-            return res1
-        except Exception:
+        self._record_usage(agent_name, rag_response.get("usage"))
+        if rag_response["status"] != "success":
+            res1 = f"RAG检索失败：{rag_response['response']}"
             self._update_agent_status(agent_name, "failed")
-            raise
-
-    def _run_followup_agents(self, user_question):
-        steps = [
-            ("关键信息提取专家", "2/7", "要点提取专家", lambda: self._key_point_extractor(self.history_list[0])),
-            ("检索文档评估专家", "3/7", "检索质量专家", lambda: self._retrieval_quality_agent(user_question)),
-            ("拒绝评估专家", "4/7", "拒绝评估专家", lambda: self._rejection_evaluation_agent(user_question)),
-            ("语义一致性专家", "5/7", "语义一致性专家", lambda: self._semantic_consistency_agent(user_question)),
-            ("幻觉检测专家", "6/7", "幻觉检测专家", lambda: self._hallucination_detection_agent(user_question)),
-            ("整合专家", "7/7", "最终整合专家", lambda: self._integration_agent(user_question)),
-        ]
-        final_res = None
-        for agent_name, step_no, log_name, runner in steps:
+        else:
+            res1 = rag_response["response"]
+            self._update_agent_status(agent_name, "completed")
+        self.history_list.append(res1)
+        self._log_step("1/7", log_name, res1)
+        return res1
+
+    def _run_primary_agent(self, user_question, rag_result, context=""):
+        agent_name = "检索专员"
+        with span(f"agent {agent_name}", {"step": "1/7", "rag": bool(rag_result)}):
             self._update_agent_status(agent_name, "running")
             try:
-                result = runner()
-                if agent_name == "整合专家":
-                    result = self._enforce_no_refusal(result, user_question)
+                if rag_result:
+                    return self._record_primary_result(
+                        self.rag_agent.run(
+                            user_question,
+                            candidates=rag_result,
+                            profile=self.agent_profiles[agent_name],
+                            conversation_context=context,
+                        ),
+                        "RAG检索员",
+                    )
+                res1 = self._researcher_agent(with_context(user_question, context))
+                self._record_usage(agent_name, self.last_usage)
                 self._update_agent_status(agent_name, "completed")
-                self._log_step(step_no, log_name, result)
-                final_res = result
-                if agent_name != "整合专家":
-                    time.sleep(AGENT_STEP_DELAY)
+                self._log_step("1/7", "检索专员", res1)
+                return res1
             except Exception:
                 self._update_agent_status(agent_name, "failed")
                 raise
+
+    async def _arun_primary_agent(self, user_question, rag_result, context=""):
+        agent_name = "检索专员"
+        with span(f"agent {agent_name}", {"step": "1/7", "rag": bool(rag_result)}):
+            self._update_agent_status(agent_name, "running")
+            try:
+                if rag_result:
+                    return self._record_primary_result(
+                        await self.rag_agent.arun(
+                            user_question,
+                            candidates=rag_result,
+                            profile=self.agent_profiles[agent_name],
+                            conversation_context=context,
+                        ),
+                        "RAG检索员",
+                    )
+                res1 = self._append_history(
+                    await self.ainput_output(
+                        *self._researcher_prompt(with_context(user_question, context)),
+                        profile=self.agent_profiles[agent_name],
+                    )
+                )
+                self._record_usage(agent_name, self.last_usage)
+                self._update_agent_status(agent_name, "completed")
+                self._log_step("1/7", "检索专员", res1)
+                return res1
+            except Exception:
+                self._update_agent_status(agent_name, "failed")
+                raise
+
+    def _followup_steps(self, user_question):
+        """(状态名, 步骤号, 日志名, 提示词构造函数)；构造函数按执行时的 history_list 取上游结果。"""
+        return [
+            ("关键信息提取专家", "2/7", "要点提取专家", lambda: self._key_point_prompt(self.history_list[0], user_question)),
+            ("检索文档评估专家", "3/7", "检索质量专家", lambda: self._retrieval_quality_prompt(user_question)),
+            ("拒绝评估专家", "4/7", "拒绝评估专家", lambda: self._rejection_evaluation_prompt(user_question)),
+            ("语义一致性专家", "5/7", "语义一致性专家", lambda: self._semantic_consistency_prompt(user_question)),
+            ("幻觉检测专家", "6/7", "幻觉检测专家", lambda: self._hallucination_detection_prompt(user_question)),
+            ("整合专家", "7/7", "最终整合专家", None),
+        ]
+
+    def _finish_step(self, agent_name, step_no, log_name, result, user_question):
+        if agent_name == "整合专家":
+            result = self._enforce_no_refusal(result, user_question)
+        self._update_agent_status(agent_name, "completed")
+        self._log_step(step_no, log_name, result)
+        return result
+
+    def _run_followup_step(self, step, user_question, context=""):
+        agent_name, step_no, log_name, build_prompt = step
+        with span(f"agent {agent_name}", {"step": step_no}):
+            self._update_agent_status(agent_name, "running")
+            try:
+                if build_prompt is None:
+                    result = self._integration_agent(user_question, context)
+                else:
+                    result = self._append_history(
+                        self.input_output(*build_prompt(), profile=self.agent_profiles[agent_name])
+                    )
+                    self._record_usage(agent_name, self.last_usage)
+                return self._finish_step(agent_name, step_no, log_name, result, user_question)
+            except Exception:
+                self._update_agent_status(agent_name, "failed")
+                raise
+
+    async def _arun_followup_step(self, step, user_question, context=""):
+        agent_name, step_no, log_name, build_prompt = step
+        with span(f"agent {agent_name}", {"step": step_no}):
+            self._update_agent_status(agent_name, "running")
+            try:
+                if build_prompt is None:
+                    result = await self._aintegration_agent(user_question, context)
+                else:
+                    result = self._append_history(
+                        await self.ainput_output(*build_prompt(), profile=self.agent_profiles[agent_name])
+                    )
+                    self._record_usage(agent_name, self.last_usage)
+                return self._finish_step(agent_name, step_no, log_name, result, user_question)
+            except Exception:
+                self._update_agent_status(agent_name, "failed")
+                raise
+
+    # 限时运行：评审等步骤在子预算内运行，为整合专家留出预留时间；未限时时与直接运行相同
+    def _step_plan(self, step):
+        """返回 (跳过原因或 None, 为后续步骤预留的秒数)。"""
+        if step[3] is None:
+            return ("剩余时间不足，返回检索专员的回答" if deadlines.short_of(MIN_STEP_SECONDS) else None), 0.0
+        reserve = deadlines.share(INTEGRATION_RESERVE_SHARE)
+        return ("剩余时间不足，优先保证整合" if deadlines.short_of(reserve + MIN_STEP_SECONDS) else None), reserve
+
+    def _skip_step(self, step, reason):
+        agent_name, step_no, log_name, build_prompt = step
+        if build_prompt is None:
+            return self._fallback_answer(step, reason)
+        deadlines.record_skip(agent_name, reason)
+        self._update_agent_status(agent_name, "skipped")
+        self._log_step(step_no, log_name, SKIPPED_STEP)
+        return self._append_history(SKIPPED_STEP)
+
+    def _fallback_answer(self, step, reason):
+        """整合专家来不及运行或超时失败时，以检索专员的回答作为最终回答。"""
+        agent_name, step_no, log_name, _ = step
+        deadlines.record_skip(agent_name, reason)
+        self._update_agent_status(agent_name, "skipped")
+        if len(self.history_list) < len(AGENT_NAMES):
+            self._append_history(SKIPPED_STEP)
+        answer = self.history_list[0]
+        self._log_step(step_no, log_name, answer)
+        return answer
+
+    def _budgeted_result(self, step, result):
+        if step[3] is None and deadlines.expired() and str(result).startswith("整合失败"):
+            return self._fallback_answer(step, "整合超时，返回检索专员的回答")
+        return result
+
+    def _run_budgeted_step(self, step, user_question, context=""):
+        reason, reserve = self._step_plan(step)
+        if reason:
+            return self._skip_step(step, reason)
+        with deadlines.limit(reserve=reserve):
+            return self._budgeted_result(step, self._run_followup_step(step, user_question, context))
+
+    async def _arun_budgeted_step(self, step, user_question, context=""):
+        reason, reserve = self._step_plan(step)
+        if reason:
+            return self._skip_step(step, reason)
+        with deadlines.limit(reserve=reserve):
+            return self._budgeted_result(step, await self._arun_followup_step(step, user_question, context))
+
+    def _speculating(self):
+        # 并行草稿与评审需经由路由器的连接池调用；没有路由器时共享的 camel 智能体不能并发使用
+        return self.speculative and self.router is not None
+
+    def _run_followup_agents(self, user_question, context=""):
+        steps = self._followup_steps(user_question)
+        if self._speculating():
+            return self._run_speculative_agents(steps, user_question, context)
+        final_res = None
+        for step in steps:
+            final_res = self._run_budgeted_step(step, user_question, context)
+        return final_res
+
+    async def _arun_followup_agents(self, user_question, context=""):
+        steps = self._followup_steps(user_question)
+        if self._speculating():
+            return await self._arun_speculative_agents(steps, user_question, context)
+        final_res = None
+        for step in steps:
+            final_res = await self._arun_budgeted_step(step, user_question, context)
         return final_res
 
+    # 推测式整合：要点提取完成后，整合草稿与四个评审并行；评审均未指出问题时直接采用草稿，
+    # 关键路径由 7 次串行调用缩短为 3 次。并行评审统一以要点提取结果作为“上一位专家回复”。
+    def _review_request(self, agent_name, user_question, reserve=0.0):
+        with span(f"agent {agent_name}", {"speculative": True}), deadlines.limit(reserve=reserve):
+            res = FunctionAgent.run(
+                self, self._review_prompt(agent_name, user_question, self.history_list[1])[1],
+                profile=self.agent_profiles[agent_name],
+            )
+            self._record_usage(agent_name, res.get("usage"))
+            return res
+
+    async def _areview_request(self, agent_name, user_question, reserve=0.0):
+        with span(f"agent {agent_name}", {"speculative": True}), deadlines.limit(reserve=reserve):
+            res = await FunctionAgent.arun(
+                self, self._review_prompt(agent_name, user_question, self.history_list[1])[1],
+                profile=self.agent_profiles[agent_name],
+            )
+            self._record_usage(agent_name, res.get("usage"))
+            return res
+
+    def _integration_request(self, user_question, context, draft):
+        with span("agent 整合专家", {"speculative": True, "draft": draft}):
+            res = FunctionAgent.run(
+                self, self._integration_prompt(user_question, context), profile=self.agent_profiles["整合专家"]
+            )
+            self._record_usage("整合专家", res.get("usage"))
+            return res
+
+    async def _aintegration_request(self, user_question, context, draft):
+        with span("agent 整合专家", {"speculative": True, "draft": draft}):
+            res = await FunctionAgent.arun(
+                self, self._integration_prompt(user_question, context), profile=self.agent_profiles["整合专家"]
+            )
+            self._record_usage("整合专家", res.get("usage"))
+            return res
+
+    def _start_speculation(self):
+        for agent_name in REVIEW_AGENTS + ["整合专家"]:
+            self._update_agent_status(agent_name, "running")
+
+    def _collect_reviews(self, steps, reviews, user_question):
+        """按原顺序写入评审结果，返回指出问题的评审专家。"""
+        for (agent_name, step_no, log_name, _), res in zip(steps[1:5], reviews):
+            text = res["response"] if res["status"] == "success" else f"失败：{res['response']}"
+            self._finish_step(agent_name, step_no, log_name, self._append_history(text), user_question)
+        flags = review_flags(dict(zip(REVIEW_AGENTS, self.history_list[2:6])))
+        self.speculation_stats["runs"] += 1
+        if not flags:
+            self.speculation_stats["accepted"] += 1
+        self.last_speculation = {"accepted": not flags, "flags": flags}
+        return flags
+
+    def _finish_speculation(self, steps, res, user_question):
+        agent_name, step_no, log_name, _ = steps[5]
+        result = self._finish_step(agent_name, step_no, log_name, self._integration_text(res), user_question)
+        return self._budgeted_result(steps[5], result)
+
+    def _skip_reviews(self, steps):
+        """限时且时间不足以并行评审时跳过四个评审，返回是否跳过。"""
+        reason, _ = self._step_plan(steps[1])
+        if reason:
+            for step in steps[1:5]:
+                self._skip_step(step, reason)
+        return bool(reason)
+
+    def _rework_allowed(self):
+        # 评审指出问题时需要重新整合；剩余时间不足则保留草稿
+        if deadlines.short_of(MIN_STEP_SECONDS):
+            deadlines.record_skip("整合专家", "剩余时间不足，未按评审意见重新整合，保留草稿")
+            return False
+        return True
+
+    def _run_speculative_agents(self, steps, user_question, context=""):
+        self._run_budgeted_step(steps[0], user_question, context)
+        if self._skip_reviews(steps):
+            return self._run_budgeted_step(steps[5], user_question, context)
+        self._start_speculation()
+        reserve = deadlines.share(INTEGRATION_RESERVE_SHARE)
+        with ThreadPoolExecutor(max_workers=len(REVIEW_AGENTS) + 1) as pool:
+            draft = pool.submit(contextvars.copy_context().run, self._integration_request, user_question, context, True)
+            reviews = [
+                pool.submit(contextvars.copy_context().run, self._review_request, agent_name, user_question, reserve)
+                for agent_name in REVIEW_AGENTS
+            ]
+            reviews = [future.result() for future in reviews]
+            res = draft.result()
+        if self._collect_reviews(steps, reviews, user_question) and self._rework_allowed():
+            res = self._integration_request(user_question, context, False)
+        return self._finish_speculation(steps, res, user_question)
+
+    async def _arun_speculative_agents(self, steps, user_question, context=""):
+        await self._arun_budgeted_step(steps[0], user_question, context)
+        if self._skip_reviews(steps):
+            return await self._arun_budgeted_step(steps[5], user_question, context)
+        self._start_speculation()
+        reserve = deadlines.share(INTEGRATION_RESERVE_SHARE)
+        res, *reviews = await asyncio.gather(
+            self._aintegration_request(user_question, context, True),
+            *(self._areview_request(agent_name, user_question, reserve) for agent_name in REVIEW_AGENTS),
+        )
+        if self._collect_reviews(steps, reviews, user_question) and self._rework_allowed():
+            res = await self._aintegration_request(user_question, context, False)
+        return self._finish_speculation(steps, res, user_question)
+
     def _enforce_no_refusal(self, text, user_question):
         refusal_terms = ["无法回答", "不能回答", "不具备相关", "语言模型", "不提供建议", "咨询专业人士"]
         if text and all(term not in text for term in refusal_terms):
@@ -445,45 +1350,184 @@ class MultiAgents(Workforce):
             if idx < len(self.history_list)
         }
 
-    def run_all_agents(self, user_question, rag_result):
+    def _pipeline_result(self, final_res):
+        return {
+            "final_result": final_res,
+            "model_history": self.history_list,
+            "agents_responses": self._collect_agent_responses(),
+            "agent_status": self.get_agent_status(),
+            "token_usage": self.get_token_usage(),
+            "speculation": self.last_speculation,
+            "retrieval_queries": self.last_queries,
+            "deadline": deadlines.report(),
+        }
+
+    def _check_primary(self, result):
+        # 检索专员在预算内未能完成时没有可用回答，整次问答按失败处理
+        if deadlines.expired() and str(result).startswith(("失败：", "RAG检索失败")):
+            self._update_agent_status("检索专员", "failed")
+            raise DeadlineExceeded("检索专员未能在时间预算内完成")
+
+    def run_all_agents(self, user_question, rag_result, context=""):
+        try:
+            self.history_list = []
+            self.agent_status = _initial_agent_status()
+            self.token_usage = {}
+            self.last_speculation = None
+            self._check_primary(self._run_primary_agent(user_question, rag_result, context))
+            return self._pipeline_result(self._run_followup_agents(user_question, context))
+        except Exception as e:
+            print(f"调度失败：{e}")
+            return self._pipeline_result(f"调度失败{str(e)}")
+
+    async def arun_all_agents(self, user_question, rag_result, context=""):
         try:
             self.history_list = []
             self.agent_status = _initial_agent_status()
-            self._run_primary_agent(user_question, bool(rag_result))
-            final_res = self._run_followup_agents(user_question)
-            return {
-                "final_result": final_res,
-                "model_history": self.history_list,
-                "agents_responses": self._collect_agent_responses(),
-                "agent_status": self.get_agent_status(),
-            }
+            self.token_usage = {}
+            self.last_speculation = None
+            self._check_primary(await self._arun_primary_agent(user_question, rag_result, context))
+            return self._pipeline_result(await self._arun_followup_agents(user_question, context))
         except Exception as e:
             print(f"调度失败：{e}")
-            return {
-                "final_result": f"调度失败{str(e)}",
-                "model_history": self.history_list,
-                "agents_responses": self._collect_agent_responses(),
-                "agent_status": self.get_agent_status(),
-            }
+            return self._pipeline_result(f"调度失败{str(e)}")
 
-    def auto_run(self, user_question):
-        rag_result = self.rag_system.retrieve(user_question)
-        return self.run_all_agents(user_question, rag_result)
+    @staticmethod
+    def _remember(conversation, user_question, result, rag_result, reused):
+        final_result = str(result.get("final_result", ""))
+        if not final_result.startswith("调度失败"):
+            conversation.record(
+                user_question,
+                final_result,
+                key_points=result["agents_responses"].get("关键信息提取专家", ""),
+                candidates=rag_result,
+            )
+        result["conversation"] = {**conversation.snapshot(), "reused_retrieval": reused}
+        return result
+
+    def _note_retrieval(self, budget, candidates):
+        if budget is not None and budget.expired and not candidates and len(self.rag_system):
+            deadlines.record_skip("知识库检索", "检索超时，未使用知识库")
+        return candidates
+
+    def _plan(self, query):
+        """复合问题的子查询；未开启、无需拆分或知识库不支持多查询时返回 None。"""
+        if not self.query_planning or not hasattr(self.rag_system, "retrieve_multi"):
+            return None
+        queries = plan_queries(query)
+        self.last_queries = queries if len(queries) > 1 else None
+        return self.last_queries
+
+    def _retrieve(self, query):
+        """检索最多使用总预算的 RETRIEVAL_BUDGET_SHARE，超时则不带知识库继续。"""
+        queries = self._plan(query)
+        with deadlines.limit(fraction=RETRIEVAL_BUDGET_SHARE) as budget:
+            if queries:
+                candidates = self.rag_system.retrieve_multi(queries, top_k=self.rag_agent.fetch_k)
+            else:
+                candidates = self.rag_system.retrieve_candidates(query, top_k=self.rag_agent.fetch_k)
+        return self._note_retrieval(budget, candidates)
+
+    async def _aretrieve(self, query):
+        queries = self._plan(query)
+        with deadlines.limit(fraction=RETRIEVAL_BUDGET_SHARE) as budget:
+            if queries:
+                candidates = await self.rag_system.aretrieve_multi(queries, top_k=self.rag_agent.fetch_k)
+            else:
+                candidates = await self.rag_system.aretrieve_candidates(query, top_k=self.rag_agent.fetch_k)
+        return self._note_retrieval(budget, candidates)
+
+    @profiled("auto_run")
+    def auto_run(self, user_question, conversation=None):
+        # 只检索一次，候选直接交给检索专员重排，避免重复计算查询向量
+        self.last_queries = None
+        if conversation is None:
+            return self.run_all_agents(user_question, self._retrieve(user_question))
+        context = conversation.context()
+        rag_result = conversation.reusable_candidates(user_question)
+        reused = rag_result is not None
+        if not reused:
+            rag_result = self._retrieve(conversation.retrieval_query(user_question))
+        result = self.run_all_agents(user_question, rag_result, context)
+        return self._remember(conversation, user_question, result, rag_result, reused)
+
+    async def aauto_run(self, user_question, conversation=None, on_status=None):
+        """异步版本：在独立副本上运行，同一实例可同时处理多个问题（同一会话的记忆需按顺序提问）。"""
+        run = self._fork()
+        run.status_listener = on_status
+        run.last_queries = None
+        if conversation is None:
+            return await run.arun_all_agents(user_question, await run._aretrieve(user_question))
+        context = conversation.context()
+        rag_result = conversation.reusable_candidates(user_question)
+        reused = rag_result is not None
+        if not reused:
+            rag_result = await run._aretrieve(conversation.retrieval_query(user_question))
+        result = await run.arun_all_agents(user_question, rag_result, context)
+        return self._remember(conversation, user_question, result, rag_result, reused)
 
 
 # 兼容旧类名
 multi_agents = MultiAgents
 
 
-def initialize_system(api_key, api_url, model_type=DEFAULT_CHAT_MODEL):
+def prewarm(api_key, api_url, index_path=None, snapshot_root=None):
+    """提前建立到模型服务的 keep-alive 连接，并加载持久化索引（优先只读快照）；返回 {"rag_system", "timings", "errors"}。"""
+    timings = {"import": IMPORT_SECONDS}
+    errors = []
+    start = time.perf_counter()
+    if api_key and str(api_key).strip():
+        get_client(api_url, api_key.strip()).warm()
+    timings["connect"] = round(time.perf_counter() - start, 3)
+    rag_system = None
+    index_path = index_path or os.getenv(INDEX_PATH_ENV, DEFAULT_INDEX_PATH)
+    snapshot_root = snapshot_root or os.getenv(index_snapshot.SNAPSHOT_DIR_ENV, index_snapshot.DEFAULT_SNAPSHOT_DIR)
+    start = time.perf_counter()
+    # 优先映射已发布的快照（多进程共享内存），没有时回退到 .npz 索引
+    if index_snapshot.current_version(snapshot_root):
+        rag_system = VectorStorage(api_key=api_key, model_type=DEFAULT_EMBEDDING_MODEL, url=api_url)
+        try:
+            rag_system.load_snapshot(snapshot_root)
+        except Exception as e:
+            errors.append(f"索引快照加载失败: {e}")
+            rag_system = None
+    if rag_system is None and index_path and os.path.exists(index_path):
+        rag_system = VectorStorage(api_key=api_key, model_type=DEFAULT_EMBEDDING_MODEL, url=api_url)
+        try:
+            rag_system.load(index_path)
+        except Exception as e:
+            errors.append(f"索引加载失败: {e}")
+            rag_system = None
+    timings["load_index"] = round(time.perf_counter() - start, 3)
+    return {"rag_system": rag_system, "timings": timings, "errors": errors}
+
+
+def initialize_system(api_key, api_url, model_type=DEFAULT_CHAT_MODEL, reranker="lexical",
+                      fallback_models=None, light_models=None, extra_api_keys=None, agent_profiles=None,
+                      knowledge_base=None, speculative=False, hedge=False):
+    """knowledge_base 为 prewarm() 预加载的 VectorStorage 时，新系统在其副本上工作；hedge 为 True 时对慢调用发起对冲请求。"""
+    start = time.perf_counter()
     try:
         if not api_key or not str(api_key).strip():
             raise ValueError("API密钥不能为空")
+        router = build_router(
+            api_url,
+            [api_key] + list(extra_api_keys or []),
+            model_type,
+            fallback_models=fallback_models or [],
+            light_models=light_models or [],
+            hedging=HedgePolicy() if hedge else None,
+        )
         agent = MultiAgents(
             agent_name="EDA_multi_agent",
             model_type=model_type,
             url=api_url,
             api_key=api_key.strip(),
+            reranker=reranker,
+            router=router,
+            agent_profiles=agent_profiles,
+            rag_system=knowledge_base.clone() if knowledge_base is not None else None,
+            speculative=speculative,
         )
         return {
             "status": "success",
@@ -491,6 +1535,7 @@ def initialize_system(api_key, api_url, model_type=DEFAULT_CHAT_MODEL):
             "rag_system": agent.rag_system,
             "model_type": model_type,
             "message": "初始化成功",
+            "timings": {"import": IMPORT_SECONDS, "init": round(time.perf_counter() - start, 3)},
         }
     except Exception as e:
         return {
@@ -500,30 +1545,100 @@ def initialize_system(api_key, api_url, model_type=DEFAULT_CHAT_MODEL):
         }
 
 
-def process_question(multi_agent, user_question):
-    try:
-        if multi_agent is None:
-            raise ValueError("multi_agent实例未初始化")
-        if not user_question or not str(user_question).strip():
-            raise ValueError("问题内容不能为空")
-        result = multi_agent.auto_run(user_question)
-        final_result = result.get("final_result", "")
-        failed = str(final_result).startswith("调度失败")
-        return {
-            "status": "failure" if failed else "success",
-            "final_result": final_result,
-            "message": final_result if failed else "",
-            "agents_responses": result.get("agents_responses", {}),
-            "agent_status": result.get("agent_status", {}),
-        }
-    except Exception as e:
-        agent_status = multi_agent.get_agent_status() if multi_agent else {}
-        return {
-            "status": "failure",
-            "message": str(e),
-            "traceback": traceback.format_exc(),
-            "agent_status": agent_status,
-        }
+def _check_question(multi_agent, user_question):
+    if multi_agent is None:
+        raise ValueError("multi_agent实例未初始化")
+    if not user_question or not str(user_question).strip():
+        raise ValueError("问题内容不能为空")
+
+
+def _question_result(result):
+    final_result = result.get("final_result", "")
+    failed = str(final_result).startswith("调度失败")
+    return {
+        "status": "failure" if failed else "success",
+        "final_result": final_result,
+        "message": final_result if failed else "",
+        "agents_responses": result.get("agents_responses", {}),
+        "agent_status": result.get("agent_status", {}),
+        "conversation": result.get("conversation"),
+        "token_usage": result.get("token_usage", {}),
+        "speculation": result.get("speculation"),
+        "retrieval_queries": result.get("retrieval_queries"),
+        "deadline": result.get("deadline"),
+    }
+
+
+def _question_failure(multi_agent, exc):
+    agent_status = multi_agent.get_agent_status() if multi_agent else {}
+    return {
+        "status": "failure",
+        "message": str(exc),
+        "traceback": traceback.format_exc(),
+        "agent_status": agent_status,
+        "deadline": deadlines.report(),
+    }
+
+
+def _question_span(user_question, conversation, seconds=None):
+    """每个问题一条链路的根 span。"""
+    return span("process_question", {
+        "question_chars": len(str(user_question or "")),
+        "conversation_turns": len(conversation) if conversation is not None else None,
+        "deadline_s": seconds,
+    })
+
+
+def _close_question_span(question_span, result):
+    question_span.set_attributes({
+        "status": result["status"],
+        "answer_chars": len(str(result.get("final_result") or "")),
+        "total_tokens": sum(
+            (result.get("token_usage") or {}).get("合计", {}).get(key, 0)
+            for key in ("prompt_tokens", "completion_tokens")
+        ),
+        "skipped_steps": len(result["deadline"]["skipped"]) if result.get("deadline") else None,
+    })
+    return result
+
+
+def _deadline_seconds(deadline):
+    return deadlines.default_seconds() if deadline is None else deadline
+
+
+def process_question(multi_agent, user_question, conversation=None, deadline=None):
+    """conversation 为 ConversationMemory 时带上多轮对话背景，并在同主题追问时复用上一轮检索结果。
+
+    deadline 为整次问答的时间预算（秒，缺省读取 EDA_QA_DEADLINE，0 为不限时）：时间不足时跳过评审步骤，
+    整合专家也来不及时返回检索专员的回答；结果的 "deadline" 字段列出被跳过的步骤。
+    """
+    seconds = _deadline_seconds(deadline)
+    with _question_span(user_question, conversation, seconds) as question_span, deadlines.start(seconds):
+        try:
+            _check_question(multi_agent, user_question)
+            result = _question_result(multi_agent.auto_run(user_question, conversation=conversation))
+        except Exception as e:
+            question_span.record_exception(e)
+            result = _question_failure(multi_agent, e)
+        return _close_question_span(question_span, result)
+
+
+async def aprocess_question(multi_agent, user_question, conversation=None, on_status=None, deadline=None):
+    """process_question 的 asyncio 版本，可在同一事件循环中并发处理多个问题；on_status(智能体名, 状态) 接收进度。"""
+    seconds = _deadline_seconds(deadline)
+    with _question_span(user_question, conversation, seconds) as question_span, deadlines.start(seconds):
+        try:
+            _check_question(multi_agent, user_question)
+            result = _question_result(
+                await multi_agent.aauto_run(user_question, conversation=conversation, on_status=on_status)
+            )
+        except Exception as e:
+            question_span.record_exception(e)
+            result = _question_failure(multi_agent, e)
+        return _close_question_span(question_span, result)
+
+
+IMPORT_SECONDS = round(time.perf_counter() - _IMPORT_STARTED, 3)
 
 
 if __name__ == "__main__":
@@ -538,3 +1653,4 @@ if __name__ == "__main__":
     )
     out = agent.auto_run("什么是EDA？")
     print(out.get("final_result", "")[:500])
+
@@ -0,0 +1,155 @@
+"""性能分析模式：对问答流水线与文档入库逐请求运行 cProfile，落盘 .pstats 并汇总 CPU 热点与等待时间。
+
+环境变量 EDA_QA_PROFILE 设为目录即开启（也可在侧栏切换），每个请求生成：
+    <时间>_<标签>.pstats   可用 `python -m pstats` 或 snakeviz 查看
+    <时间>_<标签>.json     摘要：墙钟 / CPU / 等待时间、分类耗时与前若干热点函数
+"""
+
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+PROFILE_ENV = "EDA_QA_PROFILE"
+DEFAULT_PROFILE_DIR = "profiles"
+TOP_HOTSPOTS = 15
+RECENT_REPORTS = 20
+
+# 这些内置函数耗时是在等待网络 / 锁 / sleep，不计入 CPU 热点
+_WAIT_MARKERS = ("_ssl.", "_socket.", "select", "time.sleep", "_thread.lock", "_thread.RLock", "getaddrinfo")
+# (分类, 文件路径或函数名中的关键字)
+_CATEGORIES = (
+    ("import", ("<frozen importlib", "marshal.loads", "builtins.compile")),
+    ("chunking", ("eda_chunker",)),
+    ("retriever", ("hybrid_index", "reranker")),
+    ("embedding", ("embeddings.py", "onnxruntime", "tokenizers")),
+    ("json", ("json",)),
+    ("parsing", ("PyPDF2", "pypdf", "docx", "openpyxl", "pandas")),
+    ("http", ("httpx", "httpcore", "h11", "ssl")),
+    ("numpy", ("numpy",)),
+)
+
+
+def _is_wait(func_name):
+    return any(marker in func_name for marker in _WAIT_MARKERS)
+
+
+def _category(filename, func_name):
+    if _is_wait(func_name):
+        return "wait"
+    location = f"{filename} {func_name}".replace("\\", "/")
+    for name, markers in _CATEGORIES:
+        if any(marker in location for marker in markers):
+            return name
+    return "other"
+
+
+def _location(filename, line, func_name):
+    if filename == "~":
+        return func_name
+    return f"{os.path.basename(filename)}:{line}({func_name})"
+
+
+def summarize(stats, top=TOP_HOTSPOTS):
+    """从 pstats.Stats 汇总分类自耗时与前 top 个 CPU 热点（按自耗时排序，排除等待类函数）。"""
+    categories = {}
+    entries = []
+    for (filename, line, func_name), (_, calls, self_time, cum_time, _) in stats.stats.items():
+        category = _category(filename, func_name)
+        categories[category] = categories.get(category, 0.0) + self_time
+        if category != "wait":
+            entries.append((self_time, cum_time, calls, _location(filename, line, func_name), category))
+    entries.sort(reverse=True)
+    return {
+        "categories": {name: round(seconds, 4) for name, seconds in sorted(categories.items(), key=lambda x: -x[1])},
+        "hotspots": [
+            {"function": where, "category": category, "self_s": round(self_time, 4),
+             "cumulative_s": round(cum_time, 4), "calls": calls}
+            for self_time, cum_time, calls, where, category in entries[:top]
+        ],
+    }
+
+
+class Profiler:
+    """directory 为空时关闭；同一时刻只分析一个请求（3.12 起进程内只允许一个活动的 profiler），并发或嵌套调用直接执行。"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or None
+        self.reports = deque(maxlen=RECENT_REPORTS)
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def _output_path(self, label):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        return os.path.join(self.directory, f"{stamp}_{label}")
+
+    def _write(self, profile, label, wall, cpu):
+        stats = pstats.Stats(profile)
+        base = self._output_path(label)
+        stats.dump_stats(base + ".pstats")
+        report = {
+            "label": label,
+            "file": base + ".pstats",
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            # 墙钟减去本线程 CPU 时间，主要是网络等待、限流 sleep 与锁等待
+            "wait_s": round(max(wall - cpu, 0.0), 4),
+            **summarize(stats),
+        }
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.reports.append(report)
+        return report
+
+    def call(self, label, func, *args, **kwargs):
+        if not self.enabled or not self._busy.acquire(blocking=False):
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+            try:
+                self._write(profile, label, wall, cpu)
+            except OSError as e:
+                print(f"性能分析结果写入失败：{e}")
+            finally:
+                self._busy.release()
+
+
+_profiler = Profiler(os.getenv(PROFILE_ENV))
+
+
+def configure(directory):
+    """运行时开启（传目录）或关闭（传空值）；作用于整个进程。"""
+    _profiler.directory = directory or None
+    return _profiler
+
+
+def is_enabled():
+    return _profiler.enabled
+
+
+def recent_reports():
+    """最近的分析摘要（新的在后）。"""
+    return list(_profiler.reports)
+
+
+def profiled(label):
+    """装饰器：开启性能分析时对每次调用单独生成一份分析结果，关闭时直接调用。"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return _profiler.call(label, func, *args, **kwargs)
+        return wrapper
+    return decorator
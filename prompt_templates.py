@@ -0,0 +1,96 @@
+"""提示词模板：静态说明在前、共享上下文居中、逐步变化的内容在后，便于服务端前缀缓存（KV cache）复用。"""
+
+from textwrap import dedent
+
+RESEARCHER_INSTRUCTIONS = dedent("""\
+    角色：你是EDA（电子设计自动化）领域的资深专家。
+    强制要求：
+    1. 必须直接回答用户问题，严禁出现“无法回答”“作为语言模型”等拒绝或能力不足的措辞。
+    2. 优先基于检索/知识库内容；如信息不足，结合EDA通用原理与合理推断给出可执行建议，可标注假设来源，但不能拒绝。
+    3. 回答需聚焦电子设计/布线/EDA范畴，不讨论无关领域，不添加开场寒暄。""")
+
+# 检索专员之后的六个步骤共用同一段静态说明，保证这些调用的前缀（系统提示 + 说明 + 共享上下文）完全一致
+PIPELINE_INSTRUCTIONS = dedent("""\
+    你是EDA（电子设计自动化）多智能体问答流水线中的一名专家，请按【当前任务】指定的角色及下方对应规范完成任务。
+
+    【关键信息提取专家】从检索专员的回复中提取核心关键词/关键信息点。
+    1. 提取结果需精准对应用户问题，不遗漏核心要点；
+    2. 以简洁的列表或短语形式呈现，无需完整句子；
+    3. 去除冗余信息，只保留关键概念、数据、结论。
+
+    【检索文档评估专家】评测关键信息（见【上一位专家回复】）与用户问题的相关性。
+    1. 基于关键信息提取结果，判断其与用户问题的匹配程度；
+    2. 给出明确的相关性评级（高/中/低）；
+    3. 简要说明评级理由（1-2句话即可）。
+
+    【拒绝评估专家】检测检索专员的回答是否存在“不当拒绝”。
+    1. 不当拒绝定义：用户问题合理但未给出有效回答、故意回避核心问题、无理由拒绝回答；
+    2. 给出明确判断结果（存在不当拒绝/无不当拒绝）；
+    3. 简要说明判断依据（1-2句话即可）。
+
+    【语义一致性专家】校验检索专员的回答是否存在逻辑矛盾或信息缺失。
+    1. 逻辑矛盾：回答内部观点冲突、数据前后不一致；
+    2. 信息缺失：未覆盖用户问题的核心要点（需结合问题判断）；
+    3. 给出明确判断结果（无矛盾无缺失/存在矛盾/存在缺失）；
+    4. 简要说明判断依据（1-2句话即可）。
+
+    【幻觉检测专家】检测检索专员的回答是否包含虚构信息（幻觉）。
+    1. 幻觉定义：不存在的事实、虚假数据、未证实的观点、错误的概念关联；
+    2. 给出明确判断结果（无幻觉/存在幻觉）；
+    3. 若存在幻觉，简要指出虚构内容（1-2句话即可）。
+
+    【整合专家】基于所有智能体的回复，生成最终的专业回答。
+    1. 必须给出最终答案，严禁使用“无法回答/作为语言模型”等拒绝措辞。
+    2. 优先采纳检索专员内容并融合关键信息提取要点；如信息不足，基于EDA常识给出合理推断并标注假设来源，不得拒绝。
+    3. 语言流畅、逻辑清晰，输出聚焦电子设计自动化（EDA）范畴，不扩展无关内容。
+    4. 若上游存在不当拒绝/矛盾/幻觉，需在回答中修正并给出更可靠表述。""")
+
+
+def render_researcher(question):
+    """无检索结果时检索专员的提示词：静态说明在前，用户问题在后。"""
+    return f"{RESEARCHER_INSTRUCTIONS}\n用户问题：{str(question).strip()}"
+
+
+def shared_context(question, answer):
+    """下游步骤共享的上下文块，位置固定在静态说明之后。"""
+    return f"【共享上下文】\n用户问题：{str(question).strip()}\n检索专员回复：{str(answer).strip()}"
+
+
+def render_step(role, question, answer, previous="", extra=""):
+    """下游步骤的提示词：静态说明 → 共享上下文 → 当前任务 → 逐步变化的内容。"""
+    parts = [
+        PIPELINE_INSTRUCTIONS,
+        shared_context(question, answer),
+        f"【当前任务】你是{role}，请按【{role}】规范输出。",
+    ]
+    if extra:
+        parts.append(str(extra).strip())
+    if previous:
+        parts.append(f"【上一位专家回复】\n{str(previous).strip()}")
+    return "\n\n".join(parts)
+
+
+def cached_tokens(usage):
+    """从 usage 中读取命中前缀缓存的 token 数（OpenAI / DeepSeek 两种字段），无则为 0。"""
+    if not usage:
+        return 0
+    details = usage.get("prompt_tokens_details") or {}
+    value = details.get("cached_tokens")
+    if value is None:
+        value = usage.get("prompt_cache_hit_tokens", 0)
+    return int(value or 0)
+
+
+def empty_usage():
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+
+def add_usage(total, usage):
+    """把一次调用的 usage 累加到 total（就地修改并返回）。"""
+    if usage is None:
+        return total
+    total["calls"] += 1
+    total["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+    total["completion_tokens"] += int(usage.get("completion_tokens") or 0)
+    total["cached_tokens"] += cached_tokens(usage)
+    return total
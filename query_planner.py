@@ -0,0 +1,108 @@
+"""查询规划：把复合问题拆成若干子查询，一次批量向量化后并行检索，再用 RRF 合并候选。
+
+按规则拆分，不调用模型，检索耗时与单次检索相近：
+    对比类   “A 与 B 的区别”“比较 A 和 B”“A vs B”“difference between A and B”  → A、B
+    并列类   “……；……”“……？……？”“……，另外 / 此外 / 同时 ……”                  → 各分句
+原问题始终是第一个子查询；拆不出两个有效子查询时只返回原问题，检索与不拆分时完全一致。
+环境变量 EDA_QA_QUERY_PLANNING=0 关闭拆分。
+"""
+
+import os
+import re
+
+from hybrid_index import RANK_SMOOTHING_FACTOR, tokenize
+
+QUERY_PLANNING_ENV = "EDA_QA_QUERY_PLANNING"
+# 含原问题在内最多检索这么多次
+MAX_QUERIES = 4
+# 分句拆出的子查询词项（英文单词 / 中文二字组）少于该数时过于宽泛，丢弃；
+# 对比对象多为单个标识符（set_false_path、CTS、setup），一个词项即可
+MIN_SUB_QUERY_TOKENS = 2
+MIN_COMPARE_TOKENS = 1
+
+_PUNCT = "？?。.!！;；,，:： "
+_COMPARE_PREFIX = re.compile(r"^(?:请|请你|试)?(?:比较|对比|比对|区分|辨析)(?:一下|下)?")
+_COMPARE_SUFFIX = re.compile(
+    r"(?:两者|二者|三者|它们)?(?:之间)?(?:的|有)?(?:什么|哪些|何|哪)?(?:主要)?"
+    r"(?:区别|差别|差异|异同|不同|优缺点|优劣|联系|关系)(?:是什么|有哪些|在哪里?|如何|吗|呢)?[？?。.!！]*$"
+)
+_COMPARE_WORDS = re.compile(r"相比|对比|\s(?:vs\.?|versus)\s", re.I)
+_CJK_JOINERS = re.compile(r"\s*(?:、|与|和|跟|相比于?|对比|vs\.?|VS)\s*")
+_EN_COMPARE = (
+    re.compile(r"^(?:what(?:'s| is| are)\s+)?(?:the\s+)?(?:differences?|trade-?offs?)\s+between\s+(.+)$", re.I),
+    re.compile(r"^(?:compare|contrast)\s+(.+)$", re.I),
+    re.compile(r"^(.+\s(?:vs\.?|versus)\s.+)$", re.I),
+)
+_EN_JOINERS = re.compile(r"\s*(?:,|\band\b|\bwith\b|\bto\b|\bvs\.?|\bversus\b)\s*", re.I)
+_CLAUSES = re.compile(r"[；;]|[？?](?=.)|[，,]?\s*(?:另外|此外|同时|并且|还有|以及|also|additionally)[，,]?\s*", re.I)
+
+
+def planning_enabled():
+    return os.getenv(QUERY_PLANNING_ENV) != "0"
+
+
+def _useful(text, min_tokens):
+    return len(tokenize(text)) >= min_tokens
+
+
+def _share_tail(parts):
+    """“拥塞驱动和时序驱动的布局流程”：只有最后一项带“的……”修饰时，前面各项补上同样的尾部。"""
+    tail = parts[-1].rsplit("的", 1)
+    if len(parts[-1]) > 1 and len(tail) == 2 and tail[1] and not any("的" in part for part in parts[:-1]):
+        return [f"{part}的{tail[1]}" for part in parts[:-1]] + [parts[-1]]
+    return parts
+
+
+def _comparison(question):
+    """对比类问题的各比较对象；不是对比问题时返回 []。"""
+    text = question.strip().strip(_PUNCT)
+    for pattern in _EN_COMPARE:
+        match = pattern.match(text)
+        if match:
+            return [part.strip(_PUNCT) for part in _EN_JOINERS.split(match.group(1)) if part.strip(_PUNCT)]
+    trimmed = _COMPARE_SUFFIX.sub("", text)
+    body = _COMPARE_PREFIX.sub("", trimmed)
+    if body == text and not _COMPARE_WORDS.search(text):
+        return []
+    parts = [part.strip(_PUNCT) for part in _CJK_JOINERS.split(body) if part.strip(_PUNCT)]
+    return _share_tail(parts) if len(parts) > 1 else []
+
+
+def _clauses(question):
+    return [part.strip(_PUNCT) for part in _CLAUSES.split(question) if part.strip(_PUNCT)]
+
+
+def plan_queries(question, max_queries=MAX_QUERIES):
+    """返回检索用的查询列表：[原问题, 子查询...]；无需拆分时为 [原问题]。"""
+    question = str(question).strip()
+    subs = _comparison(question)
+    min_tokens = MIN_COMPARE_TOKENS
+    if not subs:
+        subs = _clauses(question)
+        min_tokens = MIN_SUB_QUERY_TOKENS
+    seen = {question}
+    queries = [question]
+    for sub in subs:
+        if sub not in seen and _useful(sub, min_tokens):
+            seen.add(sub)
+            queries.append(sub)
+    if len(queries) < 3:
+        # 只剩一个子查询时它与原问题几乎相同，没有额外覆盖
+        return [question]
+    return queries[:max_queries]
+
+
+def fuse(result_lists, top_k=3, smoothing=RANK_SMOOTHING_FACTOR):
+    """各子查询的候选按 RRF 合并：得分为 Σ 1 / (smoothing + 名次)，同一文本块以 index（缺省为文本）去重；
+    同分时排在前面的列表（原问题）优先。hits 为命中该块的子查询数，similarity 取最高值。"""
+    merged = {}
+    for results in result_lists:
+        for rank, item in enumerate(results, 1):
+            key = item.get("index", item["text"])
+            entry = merged.get(key)
+            if entry is None:
+                entry = merged[key] = {**item, "score": 0.0, "hits": 0}
+            entry["score"] += 1.0 / (smoothing + rank)
+            entry["hits"] += 1
+            entry["similarity"] = max(entry.get("similarity", 0.0), item.get("similarity", 0.0))
+    return sorted(merged.values(), key=lambda entry: -entry["score"])[:top_k]
@@ -0,0 +1,161 @@
+"""检索结果重排：过量召回后重新打分、去除重叠片段，并按 token 预算裁剪上下文。"""
+
+import math
+import re
+from collections import Counter
+
+from hybrid_index import tokenize
+
+DEFAULT_CANDIDATE_K = 12
+DEFAULT_CONTEXT_TOKEN_BUDGET = 1500
+DEFAULT_CROSS_ENCODER_MODEL = "BAAI/bge-reranker-base"
+RERANKER_KINDS = ["lexical", "cross-encoder", "none"]
+
+_CJK_CHAR = re.compile(r"[\u4e00-\u9fff]")
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+_MIN_OVERLAP = 20
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文约 1 字 1 token，英文单词约 1.3 token。"""
+    text = str(text)
+    return len(_CJK_CHAR.findall(text)) + math.ceil(len(_WORD.findall(text)) * 1.3)
+
+
+def _overlap_length(prev_text, next_text, max_check=200):
+    """返回 prev_text 尾部与 next_text 头部的最长重合长度。"""
+    limit = min(len(prev_text), len(next_text), max_check)
+    for size in range(limit, _MIN_OVERLAP - 1, -1):
+        if prev_text.endswith(next_text[:size]):
+            return size
+    return 0
+
+
+def _shingles(text, size=5):
+    compact = re.sub(r"\s+", "", text)
+    return {compact[i:i + size] for i in range(max(len(compact) - size + 1, 1))}
+
+
+def dedupe_chunks(texts, similarity_threshold=0.8):
+    """去除近似重复的片段，并裁掉与已选片段首尾重叠的部分（分块重叠区）。"""
+    kept = []
+    kept_shingles = []
+    for text in texts:
+        text = str(text).strip()
+        if not text:
+            continue
+        shingles = _shingles(text)
+        if any(
+            text in other
+            or len(shingles & seen) / max(min(len(shingles), len(seen)), 1) >= similarity_threshold
+            for other, seen in zip(kept, kept_shingles)
+        ):
+            continue
+        for other in kept:
+            overlap = _overlap_length(other, text)
+            if overlap:
+                text = text[overlap:].strip()
+            overlap = _overlap_length(text, other)
+            if overlap:
+                text = text[:-overlap].strip()
+        if text:
+            kept.append(text)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def select_within_budget(texts, token_budget):
+    """按顺序选取片段直到用完 token 预算；首个片段超预算时截断保留。"""
+    selected = []
+    used = 0
+    for text in texts:
+        cost = estimate_tokens(text)
+        if used + cost <= token_budget:
+            selected.append(text)
+            used += cost
+        elif not selected:
+            ratio = token_budget / max(cost, 1)
+            selected.append(text[:max(int(len(text) * ratio), 1)])
+            break
+    return selected
+
+
+class BaseReranker:
+    """重排器基类：子类实现 score(query, texts)。"""
+
+    def score(self, query, texts):
+        raise NotImplementedError
+
+    def rerank(self, query, candidates, top_k=3, token_budget=DEFAULT_CONTEXT_TOKEN_BUDGET):
+        """candidates 为检索返回的 [{"text", "score"}]；返回裁剪后的文本列表。"""
+        if not candidates:
+            return []
+        texts = [str(item["text"]) for item in candidates]
+        scores = self.score(query, texts)
+        order = sorted(range(len(texts)), key=lambda i: scores[i], reverse=True)
+        ranked = dedupe_chunks([texts[i] for i in order])
+        return select_within_budget(ranked[:top_k], token_budget)
+
+
+class LexicalReranker(BaseReranker):
+    """词法重排：候选集内 BM25 + 查询词覆盖率，并与原检索名次加权融合，纯 CPU 无需模型。"""
+
+    def __init__(self, retrieval_weight=0.3, k1=1.2, b=0.75):
+        self.retrieval_weight = retrieval_weight
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query, texts):
+        query_terms = set(tokenize(query))
+        docs = [Counter(tokenize(text)) for text in texts]
+        if not query_terms or not docs:
+            return [0.0] * len(texts)
+        avg_length = sum(sum(doc.values()) for doc in docs) / len(docs) or 1.0
+        idf = {
+            term: math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            for term in query_terms
+            for df in [sum(1 for doc in docs if term in doc)]
+        }
+        scores = []
+        for rank, doc in enumerate(docs):
+            length = sum(doc.values()) or 1
+            lexical = 0.0
+            for term in query_terms:
+                freq = doc.get(term, 0)
+                if freq:
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    lexical += idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            coverage = sum(1 for term in query_terms if term in doc) / len(query_terms)
+            # 候选按检索得分降序传入，名次先验避免词法噪声完全覆盖语义相似度
+            prior = 1.0 / (1 + rank)
+            scores.append((1 - self.retrieval_weight) * (lexical / (1 + lexical) + coverage) + self.retrieval_weight * prior)
+        return scores
+
+
+class CrossEncoderReranker(BaseReranker):
+    """本地 CPU cross-encoder 重排（需安装 sentence-transformers）。"""
+
+    def __init__(self, model_name=DEFAULT_CROSS_ENCODER_MODEL, max_length=512):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("cross-encoder 重排需要安装 sentence-transformers") from e
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+    def score(self, query, texts):
+        return [float(s) for s in self.model.predict([(query, text) for text in texts])]
+
+
+def build_reranker(kind="lexical"):
+    """按名称创建重排器；cross-encoder 不可用时回退到词法重排。"""
+    if not kind or kind == "none":
+        return None
+    if kind == "cross-encoder":
+        try:
+            return CrossEncoderReranker()
+        except Exception as e:
+            print(f"cross-encoder 加载失败，改用词法重排: {e}")
+            return LexicalReranker()
+    if kind == "lexical":
+        return LexicalReranker()
+    raise ValueError(f"未知的重排器类型: {kind}")
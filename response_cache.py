@@ -0,0 +1,213 @@
+"""智能体回复缓存：按 (模型, 完整消息, 生成参数) 的 SHA-256 落盘，超出容量时淘汰最久未用的条目。
+
+环境变量：
+    EDA_QA_RESPONSE_CACHE        缓存目录，设置即开启
+    EDA_QA_RESPONSE_CACHE_MODE   readwrite（默认）：命中直接返回，未命中调用模型后写入
+                                 replay：只读缓存，未命中时报错且不调用模型，用于回归测试与演示
+    EDA_QA_RESPONSE_CACHE_MB     容量上限（MB），默认 256
+每个智能体步骤的输入完全由问题、检索结果与前序步骤输出决定，某一步失败后重问时，前面已成功的步骤直接命中缓存。
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+CACHE_ENV = "EDA_QA_RESPONSE_CACHE"
+CACHE_MODE_ENV = "EDA_QA_RESPONSE_CACHE_MODE"
+CACHE_SIZE_ENV = "EDA_QA_RESPONSE_CACHE_MB"
+DEFAULT_CACHE_DIR = ".eda_qa_response_cache"
+DEFAULT_MAX_MB = 256
+MODE_READWRITE = "readwrite"
+MODE_REPLAY = "replay"
+CACHE_MODES = (MODE_READWRITE, MODE_REPLAY)
+
+_KEY = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ReplayMiss(LookupError):
+    """回放模式下缓存未命中。"""
+
+
+def cache_key(model, messages, params=None):
+    """模型 + 消息 + 生成参数（temperature、max_tokens、stop、层级等）的 SHA-256；键排序保证稳定。"""
+    payload = json.dumps(
+        {"model": str(model), "messages": messages, "params": params or {}},
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """每个条目一个 JSON 文件（按哈希前两位分目录）；命中时更新修改时间，淘汰按修改时间从旧到新。"""
+
+    def __init__(self, directory, mode=MODE_READWRITE, max_bytes=DEFAULT_MAX_MB << 20):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"未知的缓存模式：{mode}，可选 {', '.join(CACHE_MODES)}")
+        self.directory = os.path.abspath(directory)
+        self.mode = mode
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._entries = None
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        if not _KEY.match(str(key)):
+            raise ValueError(f"无效的缓存键：{key!r}")
+        return os.path.join(self.directory, key[:2], key[2:] + ".json")
+
+    def _index(self):
+        """首次访问时扫描目录，按修改时间建立 LRU 顺序；调用方持有锁。"""
+        if self._entries is None:
+            found = []
+            if os.path.isdir(self.directory):
+                for shard in os.listdir(self.directory):
+                    folder = os.path.join(self.directory, shard)
+                    if len(shard) != 2 or not os.path.isdir(folder):
+                        continue
+                    for name in os.listdir(folder):
+                        key = shard + name[:-len(".json")]
+                        if name.endswith(".json") and _KEY.match(key):
+                            stat = os.stat(os.path.join(folder, name))
+                            found.append((stat.st_mtime, key, stat.st_size))
+            found.sort()
+            self._entries = OrderedDict((key, size) for _, key, size in found)
+            self._total = sum(self._entries.values())
+        return self._entries
+
+    def get(self, key):
+        """返回缓存条目；未命中返回 None，回放模式下未命中抛出 ReplayMiss。"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            entry = None
+        with self._lock:
+            entries = self._index()
+            if entry is None:
+                self.misses += 1
+                self._total -= entries.pop(key, 0)
+            else:
+                self.hits += 1
+                if key in entries:
+                    entries.move_to_end(key)
+        if entry is None and self.mode == MODE_REPLAY:
+            raise ReplayMiss(f"回放模式下缓存未命中（{key[:12]}），请先以 {MODE_READWRITE} 模式录制")
+        return entry
+
+    def put(self, key, entry):
+        """写入临时文件后原子替换；回放模式下不写入。"""
+        if self.mode == MODE_REPLAY:
+            return False
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            entries = self._index()
+            self._total += len(data) - entries.pop(key, 0)
+            entries[key] = len(data)
+            self.writes += 1
+            self._evict()
+        return True
+
+    def _evict(self):
+        # 调用方持有锁；最新写入的条目即使超限也保留
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index()):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._entries = OrderedDict()
+            self._total = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._index()
+            lookups = self.hits + self.misses
+            return {
+                "directory": self.directory,
+                "mode": self.mode,
+                "entries": len(entries),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+
+def _from_env():
+    directory = os.getenv(CACHE_ENV)
+    if not directory:
+        return None
+    mode = os.getenv(CACHE_MODE_ENV) or MODE_READWRITE
+    max_mb = float(os.getenv(CACHE_SIZE_ENV) or DEFAULT_MAX_MB)
+    return ResponseCache(directory, mode, int(max_mb * (1 << 20)))
+
+
+_cache = _from_env()
+
+
+def configure(directory, mode=MODE_READWRITE, max_mb=DEFAULT_MAX_MB):
+    """运行时开启（传目录）或关闭（传空值）；作用于整个进程。"""
+    global _cache
+    _cache = ResponseCache(directory, mode, int(max_mb * (1 << 20))) if directory else None
+    return _cache
+
+
+def get_cache():
+    return _cache
+
+
+def lookup(model, messages, params=None):
+    """返回 (缓存键, 条目)；缓存关闭时为 (None, None)，未命中时条目为 None，回放模式未命中抛出 ReplayMiss。"""
+    cache = _cache
+    if cache is None:
+        return None, None
+    key = cache_key(model, messages, params)
+    return key, cache.get(key)
+
+
+def store(key, model, content, usage=None):
+    """只缓存非空的成功回复；key 为 None（缓存关闭）时忽略。"""
+    cache = _cache
+    if cache is None or key is None or not content:
+        return False
+    return cache.put(key, {"model": str(model), "content": content, "usage": usage})
+
+
+def stats():
+    return _cache.stats() if _cache is not None else None
@@ -65,7 +65,7 @@ if exist "%PROJECT_DIR%requirements.txt" (
     if errorlevel 1 goto :fail
     "%VENV_PY%" -m pip install "pydantic>=2.9,<2.10" "psutil>=5.9.8,<6"
     if errorlevel 1 goto :fail
-    "%VENV_PY%" -m pip install "streamlit>=1.28.0" "requests>=2.28.0" "python-dotenv>=1.0.0" "langchain-text-splitters>=0.2.0" "PyPDF2>=3.0.0" "python-docx>=1.0.0" "pandas>=2.0.0" "openpyxl>=3.1.0"
+    "%VENV_PY%" -m pip install "streamlit>=1.28.0" "requests>=2.28.0" "httpx>=0.27.0" "starlette>=0.37.0" "uvicorn>=0.29.0" "python-dotenv>=1.0.0" "numpy>=1.24.0" "orjson>=3.9.0" "PyPDF2>=3.0.0" "python-docx>=1.0.0" "pandas>=2.0.0" "openpyxl>=3.1.0" "pyarrow>=14.0.0"
     if errorlevel 1 goto :fail
 )
 
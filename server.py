@@ -0,0 +1,512 @@
+"""HTTP 服务模式：全团队共享一个多智能体实例与知识库，有界任务队列 + 固定数量 worker，按租户限制并发，支持轮询与 SSE。
+
+启动：python server.py --port 8000 --workers 4
+租户通过请求头 X-Tenant 区分；设置 EDA_QA_SERVICE_TOKEN 后需携带 Authorization: Bearer <token>。
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from multi_agent_backend import (
+    DEFAULT_API_URL,
+    DEFAULT_CHAT_MODEL,
+    HEDGE_ENV,
+    SPECULATIVE_ENV,
+    ConversationMemory,
+    aprocess_question,
+    initialize_system,
+    load_key,
+    pacing_stats,
+    prewarm,
+)
+import response_cache
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_TENANT_LIMIT = 4
+DEFAULT_JOB_TTL = 3600
+# 会话记忆按最近使用保留，超出时淘汰最久未用且没有任务在执行的会话
+DEFAULT_MAX_SESSIONS = 1024
+SSE_HEARTBEAT = 15.0
+DEFAULT_TENANT = "default"
+# 与界面上的分块参数范围一致
+CHUNK_SIZE_RANGE = (100, 4000)
+CHUNK_OVERLAP_RANGE = (0, 500)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = {JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED}
+
+
+class AdmissionError(Exception):
+    """队列已满或租户超出并发上限。"""
+
+    def __init__(self, message, status_code, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Job:
+    """一个问答任务；状态变化时唤醒等待中的 SSE 连接。"""
+
+    _seq = itertools.count()
+
+    def __init__(self, tenant, question, session_id=None, deadline=None):
+        self.id = uuid.uuid4().hex
+        self.seq = next(self._seq)
+        self.tenant = tenant
+        self.question = question
+        self.session_id = session_id
+        # 时间预算（秒）从开始执行时计起，不含排队时间；None 时使用 EDA_QA_DEADLINE
+        self.deadline = deadline
+        self.status = JOB_QUEUED
+        self.agent_status = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.task = None
+        self.version = 0
+        self.changed = asyncio.Event()
+
+    def touch(self):
+        self.version += 1
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def on_agent_status(self, agent_name, status):
+        self.agent_status[agent_name] = status
+        self.touch()
+
+    def snapshot(self, position=None):
+        data = {
+            "job_id": self.id,
+            "tenant": self.tenant,
+            "session_id": self.session_id,
+            "status": self.status,
+            "agent_status": dict(self.agent_status),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.deadline is not None:
+            data["deadline_s"] = self.deadline
+        if position is not None:
+            data["position"] = position
+        if self.error:
+            data["error"] = self.error
+        if self.result is not None:
+            data["result"] = self.result
+        return data
+
+
+class JobQueue:
+    """有界队列 + 固定数量 worker；同一会话的任务按顺序执行，保证多轮对话记忆有序。"""
+
+    def __init__(self, multi_agent, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 tenant_limit=DEFAULT_TENANT_LIMIT, job_ttl=DEFAULT_JOB_TTL, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.multi_agent = multi_agent
+        self.workers = workers
+        self.queue_size = queue_size
+        self.tenant_limit = tenant_limit
+        self.job_ttl = job_ttl
+        self.max_sessions = max_sessions
+        self.jobs = {}
+        self.active = Counter()
+        self.sessions = OrderedDict()
+        self.session_locks = {}
+        self.busy = 0
+        self.completed = 0
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, tenant, question, session_id=None, deadline=None):
+        self._purge()
+        if self.active[tenant] >= self.tenant_limit:
+            raise AdmissionError(f"租户 {tenant} 进行中的任务已达上限（{self.tenant_limit}）", 429, retry_after=5)
+        job = Job(tenant, question, session_id, deadline)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise AdmissionError("任务队列已满，请稍后重试", 503, retry_after=10) from None
+        self.jobs[job.id] = job
+        self.active[tenant] += 1
+        return job
+
+    def position(self, job):
+        if job.status != JOB_QUEUED:
+            return None
+        return sum(1 for other in self.jobs.values() if other.status == JOB_QUEUED and other.seq < job.seq)
+
+    def get(self, job_id, tenant):
+        job = self.jobs.get(job_id)
+        return job if job is not None and job.tenant == tenant else None
+
+    def cancel(self, job):
+        if job.status == JOB_QUEUED:
+            # 仍在队列中的任务由 worker 取出后直接跳过
+            self._finish(job, JOB_CANCELLED)
+        elif job.status == JOB_RUNNING and job.task is not None:
+            job.task.cancel()
+
+    def conversation(self, tenant, session_id):
+        if not session_id:
+            return None
+        key = (tenant, session_id)
+        if key in self.sessions:
+            self.sessions.move_to_end(key)
+        else:
+            self.sessions[key] = ConversationMemory()
+            self.session_locks[key] = asyncio.Lock()
+            self._evict_sessions()
+        return self.sessions[key]
+
+    def _evict_sessions(self):
+        idle = [key for key in self.sessions if not self.session_locks[key].locked()]
+        for key in idle[:max(0, len(self.sessions) - self.max_sessions)]:
+            del self.sessions[key]
+            del self.session_locks[key]
+
+    def clear_session(self, tenant, session_id):
+        memory = self.sessions.get((tenant, session_id))
+        if memory is not None:
+            memory.clear()
+        return memory is not None
+
+    def _finish(self, job, status, result=None, error=None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished = time.time()
+        self.active[job.tenant] -= 1
+        if self.active[job.tenant] <= 0:
+            del self.active[job.tenant]
+        job.touch()
+
+    def _purge(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished < cutoff]:
+            del self.jobs[job_id]
+
+    async def _run(self, job):
+        conversation = self.conversation(job.tenant, job.session_id)
+        if conversation is None:
+            return await aprocess_question(
+                self.multi_agent, job.question, on_status=job.on_agent_status, deadline=job.deadline
+            )
+        async with self.session_locks[(job.tenant, job.session_id)]:
+            return await aprocess_question(
+                self.multi_agent, job.question, conversation=conversation, on_status=job.on_agent_status,
+                deadline=job.deadline,
+            )
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status != JOB_QUEUED:
+                    continue
+                job.status = JOB_RUNNING
+                job.started = time.time()
+                job.touch()
+                self.busy += 1
+                job.task = asyncio.create_task(self._run(job))
+                try:
+                    result = await job.task
+                except asyncio.CancelledError:
+                    if not job.task.cancelled():
+                        raise
+                    self._finish(job, JOB_CANCELLED, error="任务已取消")
+                except Exception as e:
+                    self._finish(job, JOB_FAILED, error=str(e))
+                else:
+                    status = JOB_COMPLETED if result.get("status") == "success" else JOB_FAILED
+                    self._finish(job, status, result=result, error=result.get("message") or None)
+                    self.completed += 1
+                finally:
+                    self.busy -= 1
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "tenant_limit": self.tenant_limit,
+            "active_by_tenant": dict(self.active),
+            "jobs": len(self.jobs),
+            "completed": self.completed,
+            "sessions": len(self.sessions),
+        }
+
+
+def _error(message, status_code, retry_after=None):
+    headers = {"Retry-After": str(retry_after)} if retry_after else None
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+
+
+def _tenant(request):
+    return request.headers.get("x-tenant", "").strip() or DEFAULT_TENANT
+
+
+def _authorized(request):
+    token = request.app.state.token
+    return not token or request.headers.get("authorization", "") == f"Bearer {token}"
+
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def _guarded(handler):
+    async def wrapper(request):
+        if not _authorized(request):
+            return _error("未授权", 401)
+        return await handler(request, request.app.state.jobs)
+    return wrapper
+
+
+async def submit_job(request, jobs):
+    body = await _json_body(request)
+    question = str((body or {}).get("question", "")).strip()
+    if not question:
+        return _error("问题内容不能为空", 400)
+    deadline = body.get("deadline_s")
+    if deadline is not None:
+        try:
+            deadline = float(deadline)
+        except (TypeError, ValueError):
+            return _error("deadline_s 必须是秒数", 400)
+        if deadline <= 0:
+            return _error("deadline_s 必须大于 0", 400)
+    try:
+        job = jobs.submit(_tenant(request), question, session_id=(body.get("session_id") or None), deadline=deadline)
+    except AdmissionError as e:
+        return _error(str(e), e.status_code, e.retry_after)
+    return JSONResponse(
+        job.snapshot(position=jobs.position(job)),
+        status_code=202,
+        headers={"Location": f"/v1/jobs/{job.id}"},
+    )
+
+
+async def get_job(request, jobs):
+    job = jobs.get(request.path_params["job_id"], _tenant(request))
+    if job is None:
+        return _error("任务不存在", 404)
+    return JSONResponse(job.snapshot(position=jobs.position(job)))
+
+
+async def cancel_job(request, jobs):
+    job = jobs.get(request.path_params["job_id"], _tenant(request))
+    if job is None:
+        return _error("任务不存在", 404)
+    jobs.cancel(job)
+    return JSONResponse(job.snapshot())
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def job_events(request, jobs):
+    """SSE：每次状态变化推送 status 事件，结束时推送 result 事件。"""
+    job = jobs.get(request.path_params["job_id"], _tenant(request))
+    if job is None:
+        return _error("任务不存在", 404)
+
+    async def stream():
+        seen = -1
+        while True:
+            changed = job.changed
+            if job.version != seen:
+                seen = job.version
+                if job.status in FINISHED_STATES:
+                    yield _sse("result", job.snapshot())
+                    return
+                yield _sse("status", job.snapshot(position=jobs.position(job)))
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=SSE_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def _int_param(body, name, bounds):
+    """可选整数参数：缺省为 None；类型或范围不对时抛出 ValueError（信息可直接返回给调用方）。"""
+    value = body.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} 必须是整数")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} 必须是整数") from None
+    low, high = bounds
+    if not low <= value <= high:
+        raise ValueError(f"{name} 必须在 {low}~{high} 之间")
+    return value
+
+
+async def ingest_documents(request, jobs):
+    """写入共享知识库。"""
+    body = await _json_body(request)
+    texts = [str(text) for text in (body or {}).get("texts", []) if str(text).strip()]
+    if not texts:
+        return _error("texts 不能为空", 400)
+    try:
+        chunk_size = _int_param(body, "chunk_size", CHUNK_SIZE_RANGE)
+        chunk_overlap = _int_param(body, "chunk_overlap", CHUNK_OVERLAP_RANGE)
+    except ValueError as e:
+        return _error(str(e), 400)
+    summary = await jobs.multi_agent.rag_system.aingest_texts(texts, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return JSONResponse(summary)
+
+
+async def reset_documents(request, jobs):
+    if not request.app.state.allow_kb_reset:
+        return _error("服务端未开启知识库清空（EDA_QA_ALLOW_KB_RESET=1）", 403)
+    jobs.multi_agent.rag_system.reset_storage()
+    return JSONResponse({"status": "success"})
+
+
+async def publish_snapshot(request, jobs):
+    """把共享知识库发布为只读快照；挂载同一快照目录的其他服务进程会在几秒内切换到新版本。"""
+    try:
+        manifest = await asyncio.to_thread(jobs.multi_agent.rag_system.publish_snapshot)
+    except ValueError as e:
+        return _error(str(e), 409)
+    return JSONResponse(manifest)
+
+
+async def clear_session(request, jobs):
+    found = jobs.clear_session(_tenant(request), request.path_params["session_id"])
+    return JSONResponse({"status": "success" if found else "not_found"})
+
+
+async def health(request, jobs):
+    agent = jobs.multi_agent
+    return JSONResponse({
+        "status": "ok",
+        "model": agent.model_type,
+        "knowledge_chunks": len(agent.rag_system),
+        "knowledge_version": agent.rag_system.version.number,
+        "embedding_model": agent.rag_system.model_type,
+        "snapshot": agent.rag_system.snapshot.version if agent.rag_system.snapshot is not None else None,
+        "queue": jobs.stats(),
+        "router": agent.router.stats() if agent.router is not None else [],
+        "hedging": agent.router.hedging.stats() if agent.router is not None and agent.router.hedging else None,
+        "pacing": pacing_stats(),
+        "speculation": agent.get_speculation_stats(),
+        "response_cache": response_cache.stats(),
+    })
+
+
+def create_app(multi_agent=None, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+               tenant_limit=DEFAULT_TENANT_LIMIT, job_ttl=DEFAULT_JOB_TTL, token=None, allow_kb_reset=False):
+    """创建 ASGI 应用；未传入 multi_agent 时按环境变量与 api_key.env 初始化。"""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        agent = multi_agent
+        if agent is None:
+            api_key = load_key() or ""
+            api_url = os.getenv("API_URL", DEFAULT_API_URL)
+            # 启动阶段即建立连接并加载已保存的索引，首个请求无需冷启动
+            warm = prewarm(api_key, api_url)
+            for error in warm["errors"]:
+                print(error)
+            init_result = initialize_system(
+                api_key,
+                api_url,
+                model_type=os.getenv("CHAT_MODEL", DEFAULT_CHAT_MODEL),
+                knowledge_base=warm["rag_system"],
+                speculative=os.getenv(SPECULATIVE_ENV) == "1",
+                hedge=os.getenv(HEDGE_ENV) == "1",
+            )
+            if init_result["status"] != "success":
+                raise RuntimeError(f"系统初始化失败：{init_result['message']}")
+            agent = init_result["multi_agent"]
+            timings = {**warm["timings"], **init_result["timings"]}
+            print("启动耗时：" + "，".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+        app.state.jobs = JobQueue(agent, workers, queue_size, tenant_limit, job_ttl)
+        app.state.jobs.start()
+        try:
+            yield
+        finally:
+            await app.state.jobs.stop()
+
+    app = Starlette(
+        routes=[
+            Route("/v1/jobs", _guarded(submit_job), methods=["POST"]),
+            Route("/v1/jobs/{job_id}", _guarded(get_job), methods=["GET"]),
+            Route("/v1/jobs/{job_id}", _guarded(cancel_job), methods=["DELETE"]),
+            Route("/v1/jobs/{job_id}/events", _guarded(job_events), methods=["GET"]),
+            Route("/v1/documents", _guarded(ingest_documents), methods=["POST"]),
+            Route("/v1/documents", _guarded(reset_documents), methods=["DELETE"]),
+            Route("/v1/snapshots", _guarded(publish_snapshot), methods=["POST"]),
+            Route("/v1/sessions/{session_id}", _guarded(clear_session), methods=["DELETE"]),
+            Route("/v1/health", _guarded(health), methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+    app.state.token = token if token is not None else os.getenv("EDA_QA_SERVICE_TOKEN", "")
+    app.state.allow_kb_reset = allow_kb_reset or os.getenv("EDA_QA_ALLOW_KB_RESET") == "1"
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EDA 多智能体问答 HTTP 服务")
+    parser.add_argument("--host", default=os.getenv("EDA_QA_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("EDA_QA_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("EDA_QA_WORKERS", DEFAULT_WORKERS)))
+    parser.add_argument("--queue-size", type=int, default=int(os.getenv("EDA_QA_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)))
+    parser.add_argument("--tenant-limit", type=int, default=int(os.getenv("EDA_QA_TENANT_LIMIT", DEFAULT_TENANT_LIMIT)))
+    args = parser.parse_args()
+
+    import uvicorn
+
+    # 任务并发由 JobQueue 控制；多进程 / 多机部署时各自启动并共享同一快照目录，入库后 POST /v1/snapshots 发布
+    uvicorn.run(
+        create_app(workers=args.workers, queue_size=args.queue_size, tenant_limit=args.tenant_limit),
+        host=args.host,
+        port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
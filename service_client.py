@@ -0,0 +1,106 @@
+"""HTTP 服务模式的同步客户端；接口与 MultiAgents / VectorStorage 保持一致，Streamlit 前端可直接替换使用。"""
+
+import time
+import uuid
+
+import httpx
+
+import deadlines
+from api_client import APIError
+from multi_agent_backend import merge_agent_profiles
+
+POLL_INTERVAL = 1.0
+JOB_TIMEOUT = 900.0
+
+
+class RemoteKnowledgeBase:
+    """服务端共享知识库。"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def ingest_texts(self, texts, chunk_size=None, chunk_overlap=None):
+        return self._client.request(
+            "POST", "/v1/documents",
+            json={"texts": list(texts), "chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
+        )
+
+    def reset_storage(self):
+        self._client.request("DELETE", "/v1/documents")
+
+
+class ServiceClient:
+    """把问答提交到服务端任务队列并轮询结果；每个客户端实例对应一个对话会话。"""
+
+    router = None
+
+    def __init__(self, base_url, tenant="default", token=None, timeout=30.0):
+        headers = {"X-Tenant": tenant}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        self._http = httpx.Client(base_url=str(base_url).rstrip("/"), headers=headers, timeout=timeout)
+        self.session_id = uuid.uuid4().hex
+        self.agent_status = {}
+        self.agent_profiles = merge_agent_profiles()
+        self.rag_system = RemoteKnowledgeBase(self)
+        self.model_type = self.health()["model"]
+
+    def request(self, method, path, **kwargs):
+        try:
+            response = self._http.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            raise APIError(f"服务连接失败: {e!r}") from e
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {"error": response.text[:200]}
+        if response.status_code >= 400:
+            raise APIError(
+                f"HTTP {response.status_code}: {payload.get('error', '')}",
+                status_code=response.status_code,
+                headers=response.headers,
+            )
+        return payload
+
+    def health(self):
+        return self.request("GET", "/v1/health")
+
+    def get_agent_status(self):
+        return dict(self.agent_status)
+
+    def set_agent_profiles(self, overrides=None):
+        # 服务模式下各智能体参数由服务端统一配置，此处仅做校验
+        self.agent_profiles = merge_agent_profiles(overrides)
+        return self.agent_profiles
+
+    def clear_session(self):
+        self.request("DELETE", f"/v1/sessions/{self.session_id}")
+
+    def auto_run(self, user_question, conversation=None):
+        """提交任务并等待完成；conversation 不为 None 时使用服务端的会话记忆。"""
+        payload = {"question": user_question}
+        if conversation is not None:
+            payload["session_id"] = self.session_id
+        # 本地 process_question 的剩余时间预算交给服务端执行
+        remaining = deadlines.remaining()
+        if remaining is not None:
+            payload["deadline_s"] = max(remaining, 0.1)
+        job = self.request("POST", "/v1/jobs", json=payload)
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while job["status"] in ("queued", "running"):
+            if time.monotonic() > deadline:
+                self.request("DELETE", f"/v1/jobs/{job['job_id']}")
+                raise TimeoutError("等待服务端结果超时")
+            time.sleep(POLL_INTERVAL)
+            job = self.request("GET", f"/v1/jobs/{job['job_id']}")
+            self.agent_status = job.get("agent_status", {})
+        result = job.get("result")
+        if result is None:
+            return {"final_result": f"调度失败{job.get('error') or job['status']}", "agent_status": self.agent_status}
+        if result.get("status") != "success":
+            message = str(result.get("message", ""))
+            return {
+                "final_result": message if message.startswith("调度失败") else f"调度失败{message}",
+                "agent_status": result.get("agent_status", {}),
+            }
+        return result
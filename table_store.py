@@ -0,0 +1,284 @@
+"""表格知识：Excel / CSV 按列存放（pyarrow，磁盘上为 Parquet），只向量化表结构与行摘要，精确查询走列过滤。
+
+每张表（工作表）得到一个内容哈希 id，向量库中的摘要文本以 〔表格 <id>〕 开头；
+检索命中摘要后，按问题中出现的单元格取值与列名过滤，必要时求最大 / 最小 / 平均值，结果作为参考内容交给检索专员。
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+from io import BytesIO
+
+TABLE_DIR_ENV = "EDA_QA_TABLE_DIR"
+DEFAULT_TABLE_DIR = ".eda_qa_tables"
+TABLE_SUFFIXES = ("xlsx", "xls", "csv")
+# 行摘要只列文本列的取值，按字符预算决定每条摘要覆盖的行数
+SUMMARY_CHARS = 800
+MAX_ROWS_PER_SUMMARY = 500
+MAX_LOOKUP_ROWS = 20
+MAX_LOOKUP_COLUMNS = 12
+# 取值种类过多的列（如数值 id）不参与问题中的取值匹配
+MAX_MATCH_VALUES = 20000
+
+_TAG = re.compile(r"〔表格 ([0-9a-f]{16})〕")
+_NAME_KEY = b"eda_qa_name"
+_AGGREGATES = (
+    ("max", ("最大", "最高", "最多", "上限", "max")),
+    ("min", ("最小", "最低", "最少", "下限", "min")),
+    ("mean", ("平均", "均值", "avg", "mean")),
+)
+_AGGREGATE_NAMES = {"max": "最大值", "min": "最小值", "mean": "平均值"}
+
+
+def _normalize(text):
+    return re.sub(r"[\s_\-]+", "", str(text).lower())
+
+
+def table_tag(table_id):
+    return f"〔表格 {table_id}〕"
+
+
+def table_ids(text):
+    """文本中引用的表格 id（按出现顺序去重）。"""
+    return list(dict.fromkeys(_TAG.findall(str(text))))
+
+
+def _clean_frame(df):
+    # 列名统一为字符串；混合类型的 object 列转为字符串，保证能写成 Parquet
+    import pandas as pd
+
+    df = df.dropna(how="all").dropna(axis=1, how="all")
+    df.columns = [str(col).strip() or f"列{i + 1}" for i, col in enumerate(df.columns)]
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].map(lambda v: None if pd.isna(v) else str(v).strip())
+    return df
+
+
+def read_tables(name, data):
+    """解析 Excel（每个工作表一张）或 CSV，返回 [(表名, pyarrow.Table)]；空表跳过。"""
+    import pandas as pd
+    import pyarrow as pa
+
+    suffix = name.lower().rsplit(".", 1)[-1]
+    if suffix == "csv":
+        frames = {"": pd.read_csv(BytesIO(data))}
+    else:
+        frames = pd.read_excel(BytesIO(data), sheet_name=None)
+    tables = []
+    for sheet, df in frames.items():
+        df = _clean_frame(df)
+        if df.empty:
+            continue
+        label = f"{name} / {sheet}" if sheet != "" and len(frames) > 1 else name
+        tables.append((label, pa.Table.from_pandas(df, preserve_index=False)))
+    return tables
+
+
+def tables_to_text(tables):
+    """退回纯文本（服务模式等不支持表格存储时使用）。"""
+    return "\n".join(table.to_pandas().to_csv(index=False) for _, table in tables)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:g}"
+    return str(value)
+
+
+def _markdown(table, limit=MAX_LOOKUP_ROWS):
+    columns = table.column_names
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for row in table.slice(0, limit).to_pylist():
+        lines.append("| " + " | ".join("" if row[col] is None else _format_value(row[col]) for col in columns) + " |")
+    if table.num_rows > limit:
+        lines.append(f"（共 {table.num_rows} 行，仅列出前 {limit} 行）")
+    return "\n".join(lines)
+
+
+def _clip(text, limit=SUMMARY_CHARS):
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+class TableStore:
+    """表格按内容哈希写成 Parquet（root 下 <id>.parquet），内存中缓存已打开的表，重启后按需内存映射读取。"""
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.getenv(TABLE_DIR_ENV, DEFAULT_TABLE_DIR))
+        self._tables = {}
+
+    def __len__(self):
+        return len(self._tables)
+
+    def _path(self, table_id):
+        if not re.fullmatch(r"[0-9a-f]{16}", str(table_id)):
+            raise ValueError(f"无效的表格 id：{table_id!r}")
+        return os.path.join(self.root, f"{table_id}.parquet")
+
+    def add(self, name, table):
+        """写入一张表，返回表格 id；相同内容（含表名）只存一份。"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = table.replace_schema_metadata({_NAME_KEY: str(name).encode("utf-8")})
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink)
+        data = sink.getvalue().to_pybytes()
+        table_id = hashlib.sha256(data).hexdigest()[:16]
+        path = self._path(table_id)
+        if not os.path.exists(path):
+            os.makedirs(self.root, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        self._tables[table_id] = table
+        return table_id
+
+    def get(self, table_id):
+        table = self._tables.get(table_id)
+        if table is None:
+            import pyarrow.parquet as pq
+
+            table = pq.read_table(self._path(table_id), memory_map=True)
+            self._tables[table_id] = table
+        return table
+
+    def name(self, table_id):
+        metadata = self.get(table_id).schema.metadata or {}
+        return metadata.get(_NAME_KEY, table_id.encode()).decode("utf-8")
+
+    def clear(self):
+        """清空内存中的表；磁盘文件保留（与 blob 存储一样可随时手动清理）。"""
+        self._tables.clear()
+
+    def describe(self, table_id):
+        """表结构摘要：行列数、每列类型与取值范围 / 示例取值。"""
+        import pyarrow.compute as pc
+        import pyarrow.types as pt
+
+        table = self.get(table_id)
+        parts = []
+        for field in table.schema:
+            column = table.column(field.name)
+            if pt.is_integer(field.type) or pt.is_floating(field.type):
+                bounds = pc.min_max(column).as_py()
+                detail = f"范围 {_format_value(bounds['min'])}–{_format_value(bounds['max'])}"
+            else:
+                samples = [str(v) for v in pc.unique(column.drop_null()).slice(0, 5).to_pylist()]
+                detail = "如 " + "、".join(samples) if samples else "空"
+            parts.append(f"{field.name}（{field.type}，{detail}）")
+        header = f"{table_tag(table_id)}{self.name(table_id)}：{table.num_rows} 行 × {table.num_columns} 列"
+        return _clip(f"{header}\n列：" + "；".join(parts), SUMMARY_CHARS * 2)
+
+    def summaries(self, table_id, rows_per_summary=None):
+        """用于向量化的文本：一条表结构摘要 + 若干条行摘要（列出文本列的去重取值，数值列只出现在表结构中）。"""
+        import pyarrow.compute as pc
+        import pyarrow.types as pt
+
+        table = self.get(table_id)
+        name = self.name(table_id)
+        text_columns = [f.name for f in table.schema if pt.is_string(f.type) or pt.is_large_string(f.type)]
+        if rows_per_summary is None:
+            row_chars = sum(
+                pc.sum(pc.utf8_length(table.column(col).drop_null())).as_py() or 0 for col in text_columns
+            ) / max(table.num_rows, 1) + len(text_columns)
+            rows_per_summary = int(min(max(SUMMARY_CHARS // max(row_chars, 1), 10), MAX_ROWS_PER_SUMMARY))
+        texts = [self.describe(table_id)]
+        for start in range(0, table.num_rows, rows_per_summary):
+            block = table.slice(start, rows_per_summary)
+            end = start + block.num_rows
+            lines = [f"{table_tag(table_id)}{name} 第 {start + 1}-{end} 行"]
+            for col in text_columns:
+                values = [v for v in dict.fromkeys(block.column(col).to_pylist()) if v]
+                if values:
+                    lines.append(f"{col}：" + "、".join(values))
+            if len(lines) == 1:
+                lines.append(_markdown(block.select(block.column_names[:MAX_LOOKUP_COLUMNS]), limit=3))
+            texts.append(_clip("\n".join(lines)))
+        return texts
+
+    def _value_filters(self, table, question):
+        """问题中出现的单元格取值 → {列名: [取值]}；较长的取值优先，被其包含的短取值不再单独匹配。"""
+        import pyarrow.compute as pc
+        import pyarrow.types as pt
+
+        lowered = str(question).lower()
+        matches = []
+        for field in table.schema:
+            if not (pt.is_string(field.type) or pt.is_large_string(field.type)):
+                continue
+            values = pc.unique(table.column(field.name).drop_null())
+            if len(values) > MAX_MATCH_VALUES:
+                continue
+            for value in values.to_pylist():
+                if len(value) >= 2 and value.lower() in lowered:
+                    matches.append((field.name, value))
+        matches.sort(key=lambda item: -len(item[1]))
+        filters = {}
+        kept = []
+        for col, value in matches:
+            if any(value.lower() in longer.lower() and value != longer for longer in kept):
+                continue
+            kept.append(value)
+            filters.setdefault(col, []).append(value)
+        return filters
+
+    def lookup(self, table_id, question):
+        """按问题做精确查询：取值过滤 + 提到的列 + 最大/最小/平均；无可用条件时返回 None。"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.types as pt
+
+        table = self.get(table_id)
+        normalized = _normalize(question)
+        mentioned = [col for col in table.column_names if _normalize(col) and _normalize(col) in normalized]
+        filters = self._value_filters(table, question)
+        # 去掉列名后再判断聚合词，避免 max_fanout 之类的列名被当成“求最大值”
+        remainder = normalized
+        for col in sorted(mentioned, key=len, reverse=True):
+            remainder = remainder.replace(_normalize(col), " ")
+        aggregate = next(
+            (name for name, words in _AGGREGATES if any(word in remainder for word in words)), None
+        )
+        numeric = [
+            col for col in mentioned
+            if col not in filters and (pt.is_integer(table.schema.field(col).type)
+                                       or pt.is_floating(table.schema.field(col).type))
+        ]
+        if not filters and not (aggregate and numeric):
+            return None
+
+        selected = table
+        for col, values in filters.items():
+            selected = selected.filter(pc.is_in(selected.column(col), value_set=pa.array(values)))
+        conditions = [f"{col} ∈ {{{'、'.join(values)}}}" for col, values in filters.items()]
+        matched = selected.num_rows
+        if aggregate and numeric and selected.num_rows:
+            target = numeric[0]
+            if aggregate == "mean":
+                value = pc.mean(selected.column(target)).as_py()
+                # 平均值不对应具体行，只给出结果
+                selected = selected.slice(0, 0)
+            else:
+                value = pc.min_max(selected.column(target)).as_py()[aggregate]
+                selected = selected.filter(pc.equal(selected.column(target), value))
+            conditions.append(f"{target} 的{_AGGREGATE_NAMES[aggregate]} = {_format_value(value)}")
+
+        columns = list(dict.fromkeys([table.column_names[0], *filters, *mentioned]))
+        if len(columns) == 1 or not mentioned:
+            columns = table.column_names[:MAX_LOOKUP_COLUMNS]
+        result = selected.select(columns)
+        header = f"【表格查询】{self.name(table_id)}（{'；'.join(conditions)}，命中 {matched} 行）"
+        if result.num_rows:
+            text = header + "\n" + _markdown(result)
+        else:
+            text = header if matched else header + "：无匹配行"
+        return {
+            "table_id": table_id,
+            "table": self.name(table_id),
+            "conditions": conditions,
+            "rows": matched,
+            "text": text,
+        }
@@ -0,0 +1,240 @@
+"""轻量链路追踪：contextvars 传递父子 span，按 OpenTelemetry 数据模型导出到 OTLP/HTTP 采集器或 JSON 文件。
+
+环境变量 EDA_QA_TRACE：
+    http(s)://host:4318   发送到 OTLP/HTTP 采集器（JSON 编码，POST /v1/traces）
+    traces.jsonl          每条链路追加一行 OTLP JSON（可导入采集器或 Jaeger 等工具）
+未设置时关闭追踪，span() 返回空操作对象，几乎无开销。
+"""
+
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+TRACE_ENV = "EDA_QA_TRACE"
+SERVICE_NAME = "eda-multi-agent-qa"
+EXPORT_QUEUE_SIZE = 256
+EXPORT_TIMEOUT = 5.0
+# 记住最近已导出的链路，根 span 结束后才结束的子 span（如落败的对冲请求）单独导出
+FINISHED_TRACES = 1024
+
+SPAN_KIND = {"internal": 1, "server": 2, "client": 3}
+STATUS_ERROR = 2
+
+_current = contextvars.ContextVar("eda_qa_span", default=None)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class Span:
+    """一个计时区间；attributes 记录块数、token 数、状态码等。"""
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None, kind="internal"):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        self.attributes.update(attributes)
+
+    def record_exception(self, exc):
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    @property
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KIND.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": _otlp_attributes(self.attributes),
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error:
+            span["status"] = {"code": STATUS_ERROR, "message": self.error}
+        return span
+
+
+class _NoopSpan:
+    """追踪关闭时使用，接口与 Span 相同。"""
+
+    attributes = {}
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def otlp_payload(spans):
+    """把一组 span 包装为 OTLP ExportTraceServiceRequest（JSON 编码）。"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp() for span in spans]}],
+        }]
+    }
+
+
+class JsonFileExporter:
+    """每条链路追加一行 OTLP JSON。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        line = json.dumps(otlp_payload(spans), ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class OtlpHttpExporter:
+    """后台线程批量发送到 OTLP/HTTP 采集器；队列满或采集器不可用时丢弃，不影响问答。"""
+
+    def __init__(self, endpoint):
+        url = str(endpoint).rstrip("/")
+        self.url = url if url.endswith("/v1/traces") else f"{url}/v1/traces"
+        self._queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._warned = False
+        threading.Thread(target=self._worker, name="otlp-exporter", daemon=True).start()
+
+    def export(self, spans):
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            pass
+
+    def _worker(self):
+        import httpx
+
+        with httpx.Client(timeout=EXPORT_TIMEOUT) as client:
+            while True:
+                spans = self._queue.get()
+                try:
+                    client.post(self.url, json=otlp_payload(spans)).raise_for_status()
+                except httpx.HTTPError as e:
+                    if not self._warned:
+                        print(f"链路追踪导出失败（{self.url}）：{e!r}")
+                        self._warned = True
+
+
+def exporter_for(target):
+    """按目标创建导出器：http(s) 地址用 OTLP/HTTP，其余视为文件路径；为空时返回 None。"""
+    target = str(target or "").strip()
+    if not target:
+        return None
+    if target.startswith(("http://", "https://")):
+        return OtlpHttpExporter(target)
+    return JsonFileExporter(target)
+
+
+class Tracer:
+    """根 span 结束时把整条链路交给导出器；链路导出后才结束的子 span 单独导出，不再滞留内存。"""
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+        self._pending = {}
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    @contextmanager
+    def span(self, name, attributes=None, kind="internal"):
+        if self.exporter is None:
+            yield NOOP_SPAN
+            return
+        parent = _current.get()
+        span = Span(
+            name,
+            parent.trace_id if parent else os.urandom(16).hex(),
+            parent.span_id if parent else None,
+            attributes,
+            kind,
+        )
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.end_ns = time.time_ns()
+            self._finish(span, is_root=parent is None)
+
+    def _finish(self, span, is_root):
+        with self._lock:
+            if not is_root and span.trace_id in self._finished:
+                spans = [span]
+            else:
+                spans = self._pending.setdefault(span.trace_id, [])
+                spans.append(span)
+                if not is_root:
+                    return
+                del self._pending[span.trace_id]
+                self._finished[span.trace_id] = None
+                if len(self._finished) > FINISHED_TRACES:
+                    self._finished.popitem(last=False)
+        self.exporter.export(spans)
+
+
+_tracer = Tracer(exporter_for(os.getenv(TRACE_ENV)))
+
+
+def configure(target):
+    """在运行时切换导出目标（文件路径 / OTLP 地址），传空值关闭追踪。"""
+    global _tracer
+    _tracer = Tracer(exporter_for(target))
+    return _tracer
+
+
+def span(name, attributes=None, kind="internal"):
+    """with span("retrieve", {"top_k": 3}) as s: ...；嵌套调用自动形成父子关系（跨 await 同样有效）。"""
+    return _tracer.span(name, attributes, kind)
+
+
+def current_span():
+    """返回当前 span，未开启追踪或不在任何 span 内时返回空操作对象。"""
+    return _current.get() or NOOP_SPAN